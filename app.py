@@ -8,18 +8,41 @@ import sys
 import os
 import json
 from assets.funcs import cmdargs
+from assets.predetect import predetect
+from assets.store import export_tracks
+from assets.detect import model_settings, shared_detector
 import time
 from assets.ui import MainWindow
 from PyQt5 import QtWidgets
 
 
-def app(detection=False, tracking=False, useGPU=False, project_path=None):
+def app(
+    detection=False,
+    tracking=False,
+    useGPU=False,
+    project_path=None,
+    frame_buffer_mb=512,
+    frame_cache_mb=256,
+    display_width=1280,
+    detect_batch=1,
+    detect_wait_ms=50,
+    detect_workers=0,
+    detection_cache=True,
+    detect_every=1,
+    redetect_motion=0.05,
+    motion_gate=0,
+    detector=None,
+    tracker="sort",
+    track_threads=0,
+    stats_file=None,
+):
     # clear the screen
     os.system("clear")
     # set environment variables
 
+    # decoder threads and codec are picked per file, see assets/decoder.py
+
     os.environ["OPENCV_FFMPEG_READ_ATTEMPTS"] = "150000"
-    os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = "threads;1|video_codec;hevc"
 
     # welcome message
 
@@ -41,6 +64,20 @@ def app(detection=False, tracking=False, useGPU=False, project_path=None):
         "useGPU": useGPU,
         "sample_id": None,
         "Plot": None,
+        "frame_buffer_mb": frame_buffer_mb,
+        "frame_cache_mb": frame_cache_mb,
+        "display_width": display_width,
+        "detect_batch": detect_batch,
+        "detect_wait_ms": detect_wait_ms,
+        "detect_workers": detect_workers,
+        "detection_cache": detection_cache,
+        "detect_every": detect_every,
+        "redetect_motion": redetect_motion,
+        "motion_gate": motion_gate,
+        "detector": detector or {},
+        "tracker": tracker,
+        "track_threads": track_threads,
+        "stats_file": stats_file,
     }
     # load project info
 
@@ -55,6 +92,14 @@ def app(detection=False, tracking=False, useGPU=False, project_path=None):
     else:
         project_info = None
 
+    # load the detection model in the background while the window opens,
+    # worker processes load their own
+
+    if (detection or tracking) and detect_workers == 0:
+        overrides = project_info.get("detector", {}) if project_info else {}
+
+        shared_detector(useGPU, model_settings({**overrides, **(detector or {})}))
+
     # initialize the process
 
     sys.stdout.write("\rStart main window...            ")
@@ -94,8 +139,79 @@ if __name__ == "__main__":
     if args.project:
         project_path = args.project
 
+    # detection settings given on the command line, the rest come from the
+    # project file or the defaults
+
+    detector = {
+        key: value
+        for key, value in {
+            "backend": args.backend,
+            "weights": args.model,
+            "cfg": args.model_cfg,
+            "input_size": args.input_size,
+            "target_fps": args.target_fps,
+            "confidence_threshold": args.confidence,
+            "nms_threshold": args.nms,
+            "classes": args.classes,
+            "detect_classes": args.detect_classes,
+        }.items()
+        if value is not None
+    }
+
+    # detect ahead of annotation without the GUI
+
+    if args.command == "predetect":
+        if project_path is None or not os.path.exists(project_path):
+            print("predetect needs a project file, pass it with -p.")
+            sys.exit(1)
+
+        with open(project_path, "r") as file:
+            project_info = json.load(file)
+
+        done = predetect(
+            project_info,
+            workers=args.detect_workers,
+            batch_size=args.detect_batch,
+            useGPU=useGPU,
+            detector=detector,
+            display_width=args.display_width,
+        )
+
+        sys.exit(0 if done else 1)
+
+    # trajectories saved while tracking, for movement analyses
+
+    if args.command == "export-tracks":
+        if project_path is None or not os.path.exists(project_path):
+            print("export-tracks needs a project file, pass it with -p.")
+            sys.exit(1)
+
+        with open(project_path, "r") as file:
+            project_info = json.load(file)
+
+        out = args.out or os.path.join(project_info["data_folder"], "tracks.csv")
+
+        sys.exit(0 if export_tracks(project_info, out) else 1)
+
     # run
 
     app(
-        useGPU=useGPU, detection=detection, tracking=tracking, project_path=project_path
+        useGPU=useGPU,
+        detection=detection,
+        tracking=tracking,
+        project_path=project_path,
+        frame_buffer_mb=args.frame_buffer_mb,
+        frame_cache_mb=args.frame_cache_mb,
+        display_width=args.display_width,
+        detect_batch=args.detect_batch,
+        detect_wait_ms=args.detect_wait_ms,
+        detect_workers=args.detect_workers,
+        detection_cache=not args.no_detection_cache,
+        detect_every=args.detect_every,
+        redetect_motion=args.redetect_motion,
+        motion_gate=args.motion_gate,
+        detector=detector,
+        tracker=args.tracker,
+        track_threads=args.track_threads,
+        stats_file=args.stats,
     )
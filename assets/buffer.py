@@ -0,0 +1,169 @@
+# preallocated frame storage
+
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from queue import Queue, Empty
+import numpy as np
+
+
+# fixed pool of frame slots carved out of one preallocated slab, the number
+# of slots is set by a byte budget so memory is capped whatever the resolution
+#
+# a shared ring keeps the slab in shared memory so worker processes can read
+# frames by slot number without copying them
+
+
+class FrameRing:
+    def __init__(self, shape, budget_mb=512, dtype=np.uint8, shared=False):
+        frame_bytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+
+        self.size = max(2, int(budget_mb * 1024 * 1024) // frame_bytes)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+        if shared:
+            self.memory = shared_memory.SharedMemory(
+                create=True, size=self.size * frame_bytes
+            )
+            self.frames = np.ndarray(
+                (self.size, *shape), dtype=dtype, buffer=self.memory.buf
+            )
+        else:
+            self.memory = None
+            self.frames = np.empty((self.size, *shape), dtype=dtype)
+
+        self.free = Queue()
+
+        for slot in range(self.size):
+            self.free.put(slot)
+
+    @property
+    def nbytes(self):
+        return self.frames.nbytes
+
+    def acquire(self, timeout=None):
+        # get a free slot, None if none frees up in time
+
+        try:
+            return self.free.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def release(self, slot):
+        if slot is not None:
+            self.free.put(slot)
+
+    def available(self):
+        return self.free.qsize()
+
+    def __getitem__(self, slot):
+        return self.frames[slot]
+
+    @property
+    def name(self):
+        # shared memory block other processes attach to
+
+        return self.memory.name if self.memory is not None else None
+
+    def close(self):
+        # free the shared block, views handed out earlier keep the mapping
+        # alive until they are gone
+
+        if self.memory is None:
+            return
+
+        self.memory.unlink()
+
+        try:
+            self.memory.close()
+        except BufferError:
+            pass
+
+        self.memory = None
+
+
+def attach_frames(name, size, shape, dtype=np.uint8):
+    # open a shared ring from another process, returns the block and a frame
+    # array backed by it, the owner is responsible for unlinking it
+
+    memory = shared_memory.SharedMemory(name=name, track=False)
+
+    frames = np.ndarray((size, *shape), dtype=dtype, buffer=memory.buf)
+
+    return memory, frames
+
+
+# least recently used cache of decoded frames keyed by frame index, frames are
+# copied into a preallocated slab so the cache never grows past its budget
+
+
+class FrameCache:
+    def __init__(self, shape, budget_mb=256, dtype=np.uint8):
+        frame_bytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+
+        self.size = int(budget_mb * 1024 * 1024) // frame_bytes
+        self.shape = tuple(shape)
+        self.frames = np.empty((self.size, *shape), dtype=dtype)
+
+        # frame index -> slot, oldest first
+
+        self.slots = OrderedDict()
+        self.free = list(range(self.size))
+
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self):
+        return self.frames.nbytes
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, index):
+        return index in self.slots
+
+    def put(self, index, frame):
+        if self.size == 0:
+            return
+
+        if index in self.slots:
+            self.slots.move_to_end(index)
+
+            return
+
+        # evict the least recently used frame if full
+
+        if self.free:
+            slot = self.free.pop()
+        else:
+            _, slot = self.slots.popitem(last=False)
+
+        np.copyto(self.frames[slot], frame)
+
+        self.slots[index] = slot
+
+    def get(self, index):
+        slot = self.slots.get(index)
+
+        if slot is None:
+            self.misses += 1
+
+            return None
+
+        self.hits += 1
+        self.slots.move_to_end(index)
+
+        return self.frames[slot]
+
+    def run(self, index):
+        # first frame at or after index that is not cached
+
+        while index in self.slots:
+            index += 1
+
+        return index
+
+    def clear(self):
+        self.free.extend(self.slots.values())
+        self.slots.clear()
@@ -176,11 +176,13 @@ def enter_data(frame, video, data, sizes, file, deployment_id, coordinates, stat
         "time_out": 0,
     }
 
-    save_image(frame, (x1, y1, x2, y2), fish_id)
+    if frame is not None:
+        save_image(frame, (x1, y1, x2, y2), fish_id)
+
     save_to_json(data)
 
-    video.stream.set(cv2.CAP_PROP_POS_MSEC, time_in)
-    video.speed = 1
+    video.set_speed(1)
+    video.seek(time_in)
     video.paused = True
     # alert on screen
     status_bar.setText(
@@ -208,17 +210,11 @@ def time_out(video, status_bar):
     # Save to json
     save_to_json(video.data)
 
-    # Get lock
-    with video.lock:
-        # Clear queue
-        while not video.Q.empty():
-            video.Q.get()
-
-        # Reset frame to time in
-        video.stream.set(cv2.CAP_PROP_POS_MSEC, video.data[fish_id]["time_in"])
+    # Clear queue and reset frame to time in
+    video.seek(video.data[fish_id]["time_in"])
 
-        # Pause
-        video.paused = True
+    # Pause
+    video.paused = True
 
     status_bar.setText(
         f"\nFish {fish_id} has been recorded from {calculate_time(time_in)} to {calculate_time(time_out)}\n"
@@ -289,7 +285,9 @@ class predatorDialog(widgets.QDialog):
 def predators(video, sizes, status_bar):
     data_folder = video.project_info["data_folder"]
 
-    frame = video.current_frame
+    # full resolution frame, the one on screen is scaled down
+
+    frame = video.stream.full_frame()
 
     # load predator data from file, if it exists
     predators = {}
@@ -316,7 +314,8 @@ def predators(video, sizes, status_bar):
         "remarks": dialog.result["remarks"],
     }
 
-    cv2.imwrite(data_folder + "/" + f"predators/{predator_id}.png", frame)
+    if frame is not None:
+        cv2.imwrite(data_folder + "/" + f"predators/{predator_id}.png", frame)
 
     # Save to json
     if os.path.exists(data_folder + "/" + "predators.json"):
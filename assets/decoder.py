@@ -0,0 +1,98 @@
+# per file FFmpeg decoder configuration
+
+import os
+from threading import Lock
+import cv2
+
+# FFmpeg reads extra capture options from the environment when a file is
+# opened, so opening is serialised while the variable is swapped
+
+OPTIONS_VARIABLE = "OPENCV_FFMPEG_CAPTURE_OPTIONS"
+options_lock = Lock()
+
+# pixels one decoder thread keeps up with, about a quarter of 1080p
+
+PIXELS_PER_THREAD = 960 * 540
+
+# FFmpeg frame threading stops scaling past this
+
+MAX_THREADS = 16
+
+
+def fourcc_to_str(fourcc):
+    fourcc = int(fourcc)
+
+    return "".join(chr((fourcc >> 8 * i) & 0xFF) for i in range(4)).strip("\x00 ")
+
+
+def probe(path):
+    # codec and geometry from the container headers
+
+    capture = cv2.VideoCapture(path, cv2.CAP_FFMPEG)
+
+    info = {
+        "codec": fourcc_to_str(capture.get(cv2.CAP_PROP_FOURCC)),
+        "width": int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "fps": capture.get(cv2.CAP_PROP_FPS),
+    }
+
+    capture.release()
+
+    return info
+
+
+def decoder_threads(width, height, cores=None):
+    # one thread per quarter of 1080p, capped by the cores available
+
+    if cores is None:
+        cores = os.cpu_count() or 1
+
+    threads = -(-width * height // PIXELS_PER_THREAD)
+
+    return max(1, min(threads, cores, MAX_THREADS))
+
+
+def decoder_options(path, overrides=None):
+    # pick decoder settings for a file, project settings take precedence
+    #
+    # overrides is the "decoder" entry of the project file, e.g.
+    # {"threads": 8, "video_codec": "hevc"}
+
+    info = probe(path)
+
+    options = {"threads": decoder_threads(info["width"], info["height"])}
+
+    if overrides:
+        options.update(overrides)
+
+    return info, options
+
+
+def open_capture(path, options=None):
+    # open a capture with the given decoder options, the thread count goes
+    # through the capture parameters, everything else is handed to FFmpeg
+
+    options = dict(options or {})
+
+    params = []
+
+    if "threads" in options:
+        params = [cv2.CAP_PROP_N_THREADS, int(options.pop("threads"))]
+
+    value = "|".join(f"{key};{value}" for key, value in options.items())
+
+    with options_lock:
+        previous = os.environ.get(OPTIONS_VARIABLE)
+
+        os.environ[OPTIONS_VARIABLE] = value
+
+        try:
+            capture = cv2.VideoCapture(path, cv2.CAP_FFMPEG, params)
+        finally:
+            if previous is None:
+                del os.environ[OPTIONS_VARIABLE]
+            else:
+                os.environ[OPTIONS_VARIABLE] = previous
+
+    return capture
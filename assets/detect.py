@@ -1,20 +1,158 @@
 # fish detection function etc.
 
+import json
+import os
+import time
+from threading import Event, Lock, Thread
 import cv2
 import numpy as np
+from assets.tracking import SortTracker, TrackManager
+from assets.tuning import InputSizeTuner
+
+# model files and detection settings, cached detections are keyed on these
+
+MODEL_FOLDER = "model/"
+MODEL_CFG = MODEL_FOLDER + "model.cfg"
+MODEL_WEIGHTS = MODEL_FOLDER + "model.weights"
+MODEL_ONNX = MODEL_FOLDER + "model.onnx"
+BACKEND = "darknet"
+INPUT_SIZE = 416
+CONFIDENCE_THRESHOLD = 0.5
+NMS_THRESHOLD = 0.4
+CLASSES = ["Fish"]
+
+# tiled detection defaults, tile size in source pixels and the share of a
+# tile that overlaps its neighbours, tiles go through the net this many at a
+# time
+
+TILE_SIZE = 640
+TILE_OVERLAP = 0.2
+TILE_BATCH = 8
+
+
+def model_settings(detector=None, tiling=None):
+    # the defaults overridden by the "detector" entry of the project file and
+    # the command line, e.g. {"weights": "model/yolov5n.onnx", "input_size":
+    # 320}, the backend follows from the weights file unless given
+
+    detector = {
+        key: value for key, value in (detector or {}).items() if value is not None
+    }
+
+    backend = detector.get("backend")
+
+    if backend is None:
+        onnx = str(detector.get("weights", "")).endswith(".onnx")
+        backend = "onnx" if onnx else BACKEND
+
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown detector backend {backend}, use one of {', '.join(BACKENDS)}"
+        )
+
+    settings = {
+        "backend": backend,
+        **BACKENDS[backend].files,
+        "input_size": INPUT_SIZE,
+        "confidence_threshold": CONFIDENCE_THRESHOLD,
+        "nms_threshold": NMS_THRESHOLD,
+        "classes": list(CLASSES),
+    }
+
+    settings.update({key: detector[key] for key in settings if key in detector})
+
+    # class names to keep out of the model's classes, all of them if not
+    # given
+
+    if detector.get("detect_classes"):
+        settings["detect_classes"] = list(detector["detect_classes"])
+
+    # input size picked at run time for this frame rate, see assets/tuning.py
+
+    if detector.get("target_fps"):
+        settings["target_fps"] = detector["target_fps"]
+
+    if tiling:
+        settings["tiling"] = tiling
+
+    return settings
+
+
+def model_files(settings):
+    return [settings[name] for name in BACKENDS[settings["backend"]].files]
+
+
+# detector backends, each loads its model with OpenCV's dnn module and turns
+# the raw outputs into darknet style rows, centre and size relative to the
+# input, objectness and class scores, so post-processing is shared
+
+
+class DarknetBackend:
+    # YOLO models in darknet format (https://github.com/tamim662/YOLO-Fish/tree/main)
+
+    files = {"cfg": MODEL_CFG, "weights": MODEL_WEIGHTS}
+
+    @staticmethod
+    def load(settings):
+        return cv2.dnn.readNetFromDarknet(settings["cfg"], settings["weights"])
+
+    @staticmethod
+    def rows(outs, batch, input_size):
+        # yolo layers stack the detections of a batch along the first axis
+
+        return [np.reshape(out, (batch, -1, out.shape[-1])) for out in outs]
+
+
+class OnnxBackend:
+    # YOLO models exported to ONNX, boxes are in input pixels, YOLOv5 style
+    # outputs are (batch, rows, 5 + classes) with objectness and YOLOv8
+    # style ones (batch, 4 + classes, rows) without
+
+    files = {"weights": MODEL_ONNX}
+
+    @staticmethod
+    def load(settings):
+        return cv2.dnn.readNetFromONNX(settings["weights"])
+
+    @staticmethod
+    def rows(outs, batch, input_size):
+        rows = []
+
+        for out in outs:
+            out = np.reshape(out, (batch, *out.shape[-2:]))
+
+            # there are always more candidates than columns
+
+            if out.shape[1] < out.shape[2]:
+                out = out.transpose(0, 2, 1)
+
+                scores = out[..., 4:]
+                objectness = scores.max(axis=-1, keepdims=True)
+            else:
+                objectness = out[..., 4:5]
+                scores = out[..., 5:] * objectness
+
+            rows.append(
+                np.concatenate([out[..., :4] / input_size, objectness, scores], -1)
+            )
+
+        return rows
+
+
+BACKENDS = {"darknet": DarknetBackend, "onnx": OnnxBackend}
+
 
 # function to load model
 
 
-def load_model(video):
+def load_model(video, settings=None):
     # load model
 
-    # load the yolo model (https://github.com/tamim662/YOLO-Fish/tree/main)
+    video.settings = settings or model_settings()
+    video.backend = BACKENDS[video.settings["backend"]]
 
-    model_folder = "model/"
-    video.net = cv2.dnn.readNetFromDarknet(
-        model_folder + "model.cfg", model_folder + "model.weights"
-    )
+    video.net = video.backend.load(video.settings)
+    video.input_size = video.settings["input_size"]
 
     if video.useGPU:  # run on GPU
         # Set the backend and target to CUDA
@@ -29,23 +167,213 @@ def load_model(video):
         video.layer_names[i - 1] for i in video.net.getUnconnectedOutLayers()
     ]
 
-    # get the class labels
+    # get the class labels, and the ids of the classes to keep
+
+    video.model_classes = video.settings["classes"]
+    video.keep_classes = class_filter(video.settings)
+
+
+def class_filter(settings):
+    # ids of the classes in detect_classes, None to keep every class
+
+    names = settings.get("detect_classes")
+
+    if not names:
+        return None
+
+    unknown = [name for name in names if name not in settings["classes"]]
+
+    if unknown:
+        raise ValueError(
+            f"Unknown classes {', '.join(unknown)}, the model has "
+            f"{', '.join(settings['classes'])}"
+        )
+
+    return np.array([settings["classes"].index(name) for name in names])
+
+
+def class_name(settings, class_id):
+    # label of a class id, models may have more classes than names given
+
+    classes = settings["classes"]
+
+    return classes[class_id] if 0 <= class_id < len(classes) else f"Class {class_id}"
+
+
+# one model per process, loaded in the background when the app starts and
+# shared by every stream so switching samples doesn't load it again
+
+
+class Detector:
+    def __init__(self, useGPU=False, settings=None):
+        self.useGPU = useGPU
+        self.settings = settings or model_settings()
+        self.ready = Event()
+        self.error = None
+        self.load_seconds = 0
+        self.tuner = None
+
+        # a net runs one forward pass at a time
+
+        self.lock = Lock()
+
+        self.thread = Thread(target=self.load, daemon=True)
+
+    def load(self):
+        start = time.perf_counter()
+
+        try:
+            load_model(self, self.settings)
+
+            # the first forward pass allocates the layers, do it now rather
+            # than on the first frame
+
+            size = self.settings["input_size"]
+
+            self.detect([np.zeros((size, size, 3), dtype=np.uint8)])
+
+            if self.settings.get("target_fps"):
+                self.tune(size)
+        except Exception as e:
+            self.error = e
+
+        self.load_seconds = time.perf_counter() - start
+
+        self.ready.set()
+
+    def tune(self, size):
+        # pick the input size for the target frame rate, ONNX models are
+        # exported for one size
+
+        if self.settings["backend"] != "darknet":
+            print(f"\nThe input size of {self.settings['backend']} models is fixed")
+
+            return
+
+        frame = np.zeros((size, size, 3), dtype=np.uint8)
+
+        def run(size):
+            self.input_size = size
+
+            forward(self, [frame])
+
+        self.tuner = InputSizeTuner(self.settings["target_fps"])
+        self.input_size = self.tuner.calibrate(run)
+
+    def start(self):
+        self.thread.start()
+
+        return self
+
+    def wait(self, timeout=None):
+        # block until the model is loaded, errors loading it are raised here
+
+        if not self.ready.wait(timeout):
+            raise TimeoutError("Timed out loading the detection model")
+
+        if self.error is not None:
+            raise RuntimeError(f"Unable to load the detection model: {self.error}")
+
+        return self
+
+    def detect(self, frames, rgb=False, tiles=None):
+        # detections per frame and the input size they were made at
+
+        with self.lock:
+            start = time.perf_counter()
+
+            size = self.input_size
 
-    video.model_classes = ["Fish"]
+            results = detect_batch(self, frames, rgb, tiles)
+
+            # step the input size down or up if the frame rate drifts
+
+            if self.tuner is not None:
+                seconds = (time.perf_counter() - start) / len(frames)
+
+                self.input_size = self.tuner.update(seconds) or self.input_size
+
+            return results, size
+
+
+# detectors by settings and device
+
+detectors = {}
+detectors_lock = Lock()
+
+
+def shared_detector(useGPU=False, settings=None):
+    # the process's detector for these settings, loading starts on the first
+    # call
+
+    settings = settings or model_settings()
+
+    files = {
+        name: os.path.abspath(settings[name])
+        for name in ["cfg", "weights"]
+        if name in settings
+    }
+
+    key = (json.dumps({**settings, **files}, sort_keys=True), useGPU)
+
+    with detectors_lock:
+        # a model that failed to load is tried again, the files may have
+        # been fixed since
+
+        failed = key in detectors and detectors[key].ready.is_set()
+
+        if key not in detectors or (failed and detectors[key].error is not None):
+            detectors[key] = Detector(useGPU, settings).start()
+
+        return detectors[key]
 
 
 # function to detect fish
 
 
-def detect_fish(video, frame):
-    # get the height and width of the frame
+def detect_fish(video, frame, rgb=False):
+    boxes, confidences, _ = detect_batch(video, [frame], rgb)[0]
+
+    return boxes, confidences
+
+
+def detect_batch(video, frames, rgb=False, tiles=None):
+    # detect fish on several frames with a single forward pass, returns
+    # boxes, confidences and class ids per frame, with tiles each frame is
+    # detected on tile by tile instead
+
+    if tiles is not None:
+        return detect_tiled(video, frames, tiles, rgb)
+
+    outs = forward(video, frames, rgb)
+
+    return [
+        process_outputs(
+            out,
+            frame.shape[1],
+            frame.shape[0],
+            video.settings["confidence_threshold"],
+            video.settings["nms_threshold"],
+            video.keep_classes,
+        )
+        for out, frame in zip(outs, frames)
+    ]
 
-    height, width, channels = frame.shape
 
-    # create a blob from the frame
+def forward(video, images, rgb=False):
+    # raw output rows of every layer for each image
 
-    blob = cv2.dnn.blobFromImage(
-        frame, 0.00392, (416, 416), (0, 0, 0), True, crop=False
+    size = video.input_size
+
+    # create one blob from all images, the model expects RGB
+
+    blob = cv2.dnn.blobFromImages(
+        images,
+        0.00392,
+        (size, size),
+        (0, 0, 0),
+        not rgb,
+        crop=False,
     )
 
     # set the input
@@ -56,185 +384,183 @@ def detect_fish(video, frame):
 
     outs = video.net.forward(video.output_layers)
 
-    # lists for non-max suppression
+    outs = video.backend.rows(outs, len(images), size)
 
-    confidences = []
-    class_ids = []
+    return [[out[i] for out in outs] for i in range(len(images))]
 
-    # loop through the detections
 
-    for out in outs:
-        # Vectorize the detection processing
-        scores = out[:, 5:]
-        class_ids = np.argmax(scores, axis=1)
-        confidences = scores[np.arange(len(scores)), class_ids]
+def tile_grid(width, height, tiling, scale=1):
+    # (x, y, w, h) of overlapping tiles covering the region of interest of
+    # a frame, or all of it
+    #
+    # tiling is the "tiling" entry of the project file, tile size and region
+    # of interest are in source pixels and scale converts them to the frames
+    # detected on, e.g. {"tile": 640, "overlap": 0.2, "roi": [x, y, w, h]}
 
-        # Filter out weak detections
-        mask = confidences > 0.5
-        confidences = confidences[mask]
-        class_ids = class_ids[mask]
-        detections = out[mask]
+    tile = max(1, round(tiling.get("tile", TILE_SIZE) * scale))
+    overlap = tiling.get("overlap", TILE_OVERLAP)
 
-        # create an array of boxes
+    if not 0 <= overlap < 1:
+        raise ValueError(f"Tile overlap must be between 0 and 1, got {overlap}")
 
-        boxes = np.zeros((len(detections), 4))
+    if tiling.get("roi"):
+        x, y, w, h = (round(v * scale) for v in tiling["roi"])
+    else:
+        x, y, w, h = 0, 0, width, height
 
-        for i, detection in enumerate(detections):
-            center_x = int(detection[0] * width)
-            center_y = int(detection[1] * height)
-            w = int(detection[2] * width)
-            h = int(detection[3] * height)
+    # keep the region inside the frame
 
-            x = int(center_x - w / 2)
-            y = int(center_y - h / 2)
+    x, y = max(0, x), max(0, y)
+    w, h = min(w, width - x), min(h, height - y)
 
-            boxes[i] = [x, y, w, h]
+    if w <= 0 or h <= 0:
+        raise ValueError(f"Region of interest {tiling['roi']} is outside the frame")
 
-    return boxes, confidences
+    def spans(start, length):
+        # tiles along one axis spread evenly from edge to edge
 
+        if length <= tile:
+            return [(start, length)]
 
-# draw boxes after non-max suppression
+        count = int(np.ceil((length - tile) / (tile * (1 - overlap)))) + 1
 
+        return [
+            (start + round(offset), tile)
+            for offset in np.linspace(0, length - tile, count)
+        ]
 
-def draw_fish(video, frame, boxes, confidences):
-    # get number of fish so far
+    return [(tx, ty, tw, th) for ty, th in spans(y, h) for tx, tw in spans(x, w)]
 
-    fish_count = len(video.data)
 
-    # apply non-max suppression
+def detect_tiled(video, frames, tiles, rgb=False):
+    # detect on every tile of every frame, TILE_BATCH tiles per forward
+    # pass, then suppress duplicates of fish seen by more than one tile
 
-    indices = cv2.dnn.NMSBoxes(boxes, confidences, 0.4, 0.4)
+    crops = [(i, tile) for i in range(len(frames)) for tile in tiles]
+    found = [[] for _ in frames]
 
-    fish_id = fish_count
+    for start in range(0, len(crops), TILE_BATCH):
+        batch = crops[start : start + TILE_BATCH]
 
-    boxes = [boxes[i] for i in indices]
+        images = [frames[i][y : y + h, x : x + w] for i, (x, y, w, h) in batch]
 
-    for i, box in enumerate(boxes):
-        x, y, w, h = [int(i) for i in box]
+        for (i, (x, y, w, h)), outs in zip(batch, forward(video, images, rgb)):
+            boxes, confidences, class_ids = output_boxes(
+                outs, w, h, video.settings["confidence_threshold"], video.keep_classes
+            )
 
-        # get the fish id
+            # back to frame pixels
 
-        fish_id = fish_id + 1
+            boxes[:, :2] += (x, y)
 
-        # draw the box
+            found[i].append((boxes, confidences, class_ids))
 
-        label = f"Fish {fish_id}"
-        cv2.putText(
-            frame,
-            label,
-            (x, y - 10),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            0.5,
-            (0, 255, 0),
-            2,
-        )
+    results = []
 
-    return frame
+    for parts in found:
+        boxes, confidences, class_ids = (
+            np.concatenate(values) for values in zip(*parts)
+        )
 
+        keep = non_max_suppression(boxes, confidences, video.settings["nms_threshold"])
 
-# function to determine intersection of boxes
+        results.append((boxes[keep], confidences[keep], class_ids[keep]))
 
+    return results
 
-def iou_vectorized(box, t_boxes):
-    x1, y1, w1, h1 = box
-    x2, y2, w2, h2 = t_boxes[:, 0], t_boxes[:, 1], t_boxes[:, 2], t_boxes[:, 3]
 
-    xi1 = np.maximum(x1, x2)
-    yi1 = np.maximum(y1, y2)
-    xi2 = np.minimum(x1 + w1, x2 + w2)
-    yi2 = np.minimum(y1 + h1, y2 + h2)
-    inter_area = np.maximum(0, xi2 - xi1) * np.maximum(0, yi2 - yi1)
+def process_outputs(
+    outs,
+    width,
+    height,
+    confidence_threshold=CONFIDENCE_THRESHOLD,
+    nms_threshold=NMS_THRESHOLD,
+    classes=None,
+):
+    # boxes, confidences and class ids in pixels from the rows of every
+    # output layer, after thresholding and non-max suppression
 
-    box1_area = w1 * h1
-    box2_area = w2 * h2
-    union_area = box1_area + box2_area - inter_area
+    boxes, confidences, class_ids = output_boxes(
+        outs, width, height, confidence_threshold, classes
+    )
 
-    return inter_area / union_area
+    keep = non_max_suppression(boxes, confidences, nms_threshold)
 
+    return boxes[keep], confidences[keep], class_ids[keep]
 
-# function to track fish and draw a bounding box
 
+def output_boxes(outs, width, height, threshold=CONFIDENCE_THRESHOLD, classes=None):
+    # every candidate above the confidence threshold, of one of the given
+    # class ids if any, in pixels
 
-def track_fish(video, frame, boxes, confidences):
-    # apply non-max suppression
-    indices = cv2.dnn.NMSBoxes(boxes, confidences, 0.5, 0.4)
+    out = np.concatenate([np.reshape(out, (-1, out.shape[-1])) for out in outs])
 
-    # filter boxes
-    boxes = [boxes[i] for i in indices]
+    scores = out[:, 5:]
+    class_ids = np.argmax(scores, axis=1)
+    confidences = np.take_along_axis(scores, class_ids[:, None], axis=1)[:, 0]
 
-    # update trackers
-    t_boxes = []
+    # filter out weak detections
 
-    # get number of fish
+    mask = confidences > threshold
 
-    fish_id = len(video.data)
+    if classes is not None:
+        mask &= np.isin(class_ids, classes)
 
-    if len(video.trackers) > 0:
-        for tracker in video.trackers:
-            success, box = tracker.update(frame)
+    detections = out[mask]
+    confidences = confidences[mask]
+    class_ids = class_ids[mask]
 
-            if success:
-                t_boxes.append(box)
+    # centre and size relative to the frame to top left corner and size in
+    # whole pixels
 
-                # draw
+    size = np.array([width, height], dtype=np.float32)
 
-                x, y, w, h = [int(i) for i in box]
+    centres = (detections[:, 0:2] * size).astype(np.int64)
+    sizes = (detections[:, 2:4] * size).astype(np.int64)
+    corners = (centres - sizes / 2).astype(np.int64)
 
-                fish_id += 1
+    boxes = np.hstack([corners, sizes]).astype(np.float64)
 
-                label = f"Fish {fish_id}"
+    return boxes, confidences, class_ids
 
-                cv2.putText(
-                    frame,
-                    label,
-                    (x, y - 10),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.5,
-                    (0, 255, 0),
-                    2,
-                )
 
-    # check if any are detected
+def non_max_suppression(boxes, confidences, threshold):
+    # indices of the boxes kept by greedy non-max suppression, in the order
+    # of the boxes, the boxes are already thresholded so none are dropped for
+    # their confidence here
 
     if len(boxes) == 0:
-        return frame
-
-    # Convert t_boxes to a NumPy array for vectorized operations
-    if len(t_boxes) > 0:
-        t_boxes_np = np.array(t_boxes)
-        # Vectorized check for new fish
-        ious = np.array([iou_vectorized(box, t_boxes_np) for box in boxes])
-        is_tracked = np.max(ious, axis=1) > 0.5
-    else:
-        is_tracked = np.zeros(len(boxes), dtype=bool)
+        return np.zeros(0, dtype=np.int64)
 
-    # Process boxes that are not tracked
-    new_boxes = np.array(boxes)[~is_tracked]
+    keep = cv2.dnn.NMSBoxes(boxes, confidences, 0, threshold)
 
-    # check for new fish
-    for i, box in enumerate(new_boxes):
-        x, y, w, h = [int(i) for i in box]
+    return np.sort(np.asarray(keep, dtype=np.int64).reshape(-1))
 
-        # create a tracker
 
-        tracker = cv2.TrackerKCF_create()
+# draw boxes after non-max suppression
 
-        # initialize the tracker
 
-        tracker.init(frame, (x, y, w, h))
+def draw_fish(video, frame, boxes, confidences, class_ids=None):
+    # boxes come from process_outputs, already thresholded and suppressed
+    # with the detector settings
 
-        # add the tracker to the list
+    if class_ids is None:
+        class_ids = np.zeros(len(boxes), dtype=int)
 
-        video.trackers.append(tracker)
+    # get number of fish so far
 
-        # fish id
+    fish_id = len(video.data)
 
-        fish_id += 1
+    for box, class_id in zip(boxes, class_ids):
+        x, y, w, h = [int(i) for i in box]
 
-        # draw the box
+        # get the fish id
+
+        fish_id = fish_id + 1
 
-        label = f"Fish {fish_id}"
+        # draw the box
 
+        label = f"{class_name(video.settings, int(class_id))} {fish_id}"
         cv2.putText(
             frame,
             label,
@@ -246,3 +572,65 @@ def track_fish(video, frame, boxes, confidences):
         )
 
     return frame
+
+
+# appearance trackers by name, KCF and CSRT come with the opencv-contrib
+# builds only
+
+APPEARANCE_TRACKERS = {
+    "kcf": "TrackerKCF_create",
+    "csrt": "TrackerCSRT_create",
+    "mil": "TrackerMIL_create",
+}
+
+
+def tracker_available(name):
+    return name == "sort" or hasattr(cv2, APPEARANCE_TRACKERS[name])
+
+
+def make_tracker(name, threads=0):
+    # Kalman tracks for sort, otherwise one appearance tracker per fish
+    # updated over threads, 0 for one per core
+
+    if name == "sort":
+        return SortTracker()
+
+    return TrackManager(
+        getattr(cv2, APPEARANCE_TRACKERS[name]),
+        threads=threads or os.cpu_count() or 1,
+    )
+
+
+def track_fish(video, frame, boxes, confidences, class_ids=None):
+    # label the fish followed by video.tracker, boxes are None on frames the
+    # detector didn't run on, where the tracks are carried on without them
+    #
+    # returns the ids, boxes, detection confidences and class ids of the
+    # tracked fish, boxes come from process_outputs, already thresholded and
+    # suppressed with the detector settings
+
+    if isinstance(video.tracker, SortTracker):
+        tracks = video.tracker.update(boxes, confidences, class_ids)
+    else:
+        tracks = video.tracker.update(frame, boxes, confidences, class_ids)
+
+    ids, tracked, _, classes = tracks
+
+    for fish_id, box, class_id in zip(ids, tracked, classes):
+        x, y, w, h = [int(i) for i in box]
+
+        cv2.putText(
+            frame,
+            f"{class_name(video.settings, int(class_id))} {fish_id}",
+            (x, y - 10),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.5,
+            (0, 255, 0),
+            2,
+        )
+
+    # share of trackers that lost their fish, a reason to detect again
+
+    video.lost = video.tracker.lost
+
+    return tracks
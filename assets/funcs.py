@@ -7,6 +7,7 @@ import argparse
 from PyQt5 import QtWidgets as widgets
 import cv2
 import random
+from assets.store import video_files
 
 
 # help description
@@ -33,6 +34,13 @@ def cmdargs():
         epilog=epilog,
     )
 
+    parser.add_argument(
+        "command",
+        help="'predetect' runs detection over the project's samples without the GUI, 'export-tracks' writes the saved fish tracks to one table.",
+        nargs="?",
+        choices=["predetect", "export-tracks"],
+    )
+
     parser.add_argument(
         "-g", "--gpu", help="Run detection model with CUDA.", action="store_true"
     )
@@ -45,6 +53,155 @@ def cmdargs():
 
     parser.add_argument("-p", "--project", help="Load project file.", type=str)
 
+    parser.add_argument(
+        "--frame-buffer-mb",
+        help="Memory reserved for decoded frames in MB (default: 512).",
+        type=int,
+        default=512,
+    )
+
+    parser.add_argument(
+        "--frame-cache-mb",
+        help="Memory for recently shown frames in MB, 0 to disable (default: 256).",
+        type=int,
+        default=256,
+    )
+
+    parser.add_argument(
+        "--display-width",
+        help="Width frames are scaled to while decoding, 0 for full size (default: 1280).",
+        type=int,
+        default=1280,
+    )
+
+    parser.add_argument(
+        "--detect-batch",
+        help="Frames passed to the detection model at once (default: 1).",
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--detect-wait-ms",
+        help="Longest wait for a detection batch to fill in ms (default: 50).",
+        type=float,
+        default=50,
+    )
+
+    parser.add_argument(
+        "--detect-workers",
+        help="Detection worker processes, 0 to detect in the app process, or to use every core with predetect (default: 0).",
+        type=int,
+        default=0,
+    )
+
+    parser.add_argument(
+        "--detect-every",
+        help="Run the detection model every N frames, trackers or the last boxes fill in between (default: 1).",
+        type=int,
+        default=1,
+    )
+
+    parser.add_argument(
+        "--redetect-motion",
+        help="Share of changed pixels between frames that triggers detection early (default: 0.05).",
+        type=float,
+        default=0.05,
+    )
+
+    parser.add_argument(
+        "--motion-gate",
+        help="Share of changed pixels since the last detection below which the detection model is skipped, 0 to always detect (default: 0).",
+        type=float,
+        default=0,
+    )
+
+    parser.add_argument(
+        "--tracker",
+        help="Tracking method with --track, sort tracks every fish at once with a Kalman filter, kcf, csrt and mil follow each fish's appearance (default: sort).",
+        choices=["sort", "kcf", "csrt", "mil"],
+        default="sort",
+    )
+
+    parser.add_argument(
+        "--track-threads",
+        help="Threads updating kcf, csrt and mil trackers, 0 for one per core (default: 0).",
+        type=int,
+        default=0,
+    )
+
+    parser.add_argument(
+        "--backend",
+        help="Detection model format, darknet or onnx (default: from the model file, or the project's detector settings).",
+        choices=["darknet", "onnx"],
+    )
+
+    parser.add_argument(
+        "--model",
+        help="Model weights, a darknet .weights or an .onnx file (default: model/model.weights).",
+        type=str,
+    )
+
+    parser.add_argument(
+        "--model-cfg",
+        help="Darknet model configuration (default: model/model.cfg).",
+        type=str,
+    )
+
+    parser.add_argument(
+        "--input-size",
+        help="Size frames are resized to for the detection model (default: 416).",
+        type=int,
+    )
+
+    parser.add_argument(
+        "--target-fps",
+        help="Pick the largest input size the detection model runs at this frame rate, darknet models only (default: off).",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--confidence",
+        help="Confidence above which detections are kept (default: 0.5).",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--nms",
+        help="Overlap above which weaker boxes are suppressed (default: 0.4).",
+        type=float,
+    )
+
+    parser.add_argument(
+        "--classes",
+        help="Comma separated class names of the detection model, used to label boxes (default: Fish).",
+        type=lambda value: value.split(","),
+    )
+
+    parser.add_argument(
+        "--detect-classes",
+        help="Comma separated class names to keep, detections of other classes are dropped (default: all).",
+        type=lambda value: value.split(","),
+    )
+
+    parser.add_argument(
+        "--no-detection-cache",
+        help="Run the detection model on every frame instead of reusing saved detections.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--stats",
+        help="Save pipeline stats to this .json or .csv file on exit.",
+        type=str,
+    )
+
+    parser.add_argument(
+        "--out",
+        help="File export-tracks writes, .csv or .parquet (default: tracks.csv in the project's data folder).",
+        type=str,
+    )
+
     args = parser.parse_args()
 
     return args
@@ -237,7 +394,7 @@ class projectInit(widgets.QDialog):
                     plot_id = str.join("_", [replicate, plot])
                     plot_info[plot_id] = {}
 
-                    for video in os.listdir(
+                    for video in video_files(
                         self.video_folder.text() + "/" + replicate + "/" + plot
                     ):
                         video_path = (
@@ -328,7 +485,7 @@ class projectInit(widgets.QDialog):
 
                         found = False
 
-                        for video in os.listdir(plot_path):
+                        for video in video_files(plot_path):
                             # load video
 
                             video_path = plot_path + "/" + video
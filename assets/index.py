@@ -0,0 +1,157 @@
+# keyframe and timestamp index for fast, frame accurate seeks
+
+import os
+import cv2
+import numpy as np
+
+INDEX_SUFFIX = ".idx.npz"
+
+
+def sidecar_path(path, suffix):
+    # files derived from a video are kept next to it
+
+    return path + suffix
+
+
+# per frame timestamps and keyframe positions of one video file
+
+
+class SeekIndex:
+    def __init__(self, pts, msec, keyframes, size=0, mtime=0):
+        self.pts = pts
+        self.msec = msec
+        self.keyframes = keyframes
+        self.size = size
+        self.mtime = mtime
+
+    @property
+    def frame_count(self):
+        return len(self.msec)
+
+    @property
+    def max_gop(self):
+        # longest run of frames that has to be decoded to reach any frame
+
+        if len(self.keyframes) == 0:
+            return self.frame_count
+
+        return int(np.diff(np.append(self.keyframes, self.frame_count)).max())
+
+    @classmethod
+    def build(cls, path):
+        # walk the packets without decoding them
+
+        capture = cv2.VideoCapture(path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+
+        if not capture.isOpened():
+            return None
+
+        pts = []
+        msec = []
+        keyframes = []
+
+        while capture.grab():
+            if capture.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(len(pts))
+
+            pts.append(capture.get(cv2.CAP_PROP_PTS))
+            msec.append(capture.get(cv2.CAP_PROP_POS_MSEC))
+
+        capture.release()
+
+        if len(pts) == 0:
+            return None
+
+        # some containers don't flag the first frame
+
+        if len(keyframes) == 0 or keyframes[0] != 0:
+            keyframes.insert(0, 0)
+
+        stat = os.stat(path)
+
+        return cls(
+            np.array(pts, dtype=np.int64),
+            np.array(msec, dtype=np.float64),
+            np.array(keyframes, dtype=np.int32),
+            stat.st_size,
+            stat.st_mtime,
+        )
+
+    @classmethod
+    def load(cls, path, build=True):
+        # reuse the sidecar if it matches the video, otherwise rebuild it, or
+        # return None without build
+
+        index_path = sidecar_path(path, INDEX_SUFFIX)
+
+        if not os.path.exists(path):
+            return None
+
+        stat = os.stat(path)
+
+        if os.path.exists(index_path):
+            try:
+                with np.load(index_path) as f:
+                    index = cls(
+                        f["pts"], f["msec"], f["keyframes"], f["size"], f["mtime"]
+                    )
+
+                if index.size == stat.st_size and index.mtime == stat.st_mtime:
+                    return index
+
+            except (OSError, KeyError, ValueError):
+                pass
+
+        if not build:
+            return None
+
+        print(f"\rIndexing {path}...")
+
+        index = cls.build(path)
+
+        if index is not None:
+            try:
+                index.save(index_path)
+            except OSError as e:
+                print(f"\nUnable to save seek index: {e}")
+
+        return index
+
+    def save(self, index_path):
+        np.savez_compressed(
+            index_path,
+            pts=self.pts,
+            msec=self.msec,
+            keyframes=self.keyframes,
+            size=self.size,
+            mtime=self.mtime,
+        )
+
+    def frame_at(self, msec):
+        # last frame starting at or before msec
+
+        frame = np.searchsorted(self.msec, msec, side="right") - 1
+
+        return int(np.clip(frame, 0, self.frame_count - 1))
+
+    def keyframe_before(self, frame):
+        return int(self.keyframes[np.searchsorted(self.keyframes, frame, "right") - 1])
+
+    def seek(self, capture, frame, position=None):
+        # move the capture so the next read returns exactly this frame
+        #
+        # position is the frame the capture will read next, if it is in the
+        # same group of pictures and behind the target decoding forward is
+        # cheaper than any seek, otherwise the backend seeks to the keyframe
+        # before the target and decodes forward, so at most max_gop frames
+        # are decoded either way
+
+        frame = int(np.clip(frame, 0, self.frame_count - 1))
+
+        if position is not None and self.keyframe_before(frame) <= position <= frame:
+            for _ in range(frame - position):
+                capture.grab()
+        else:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, frame)
+
+        return frame
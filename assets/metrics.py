@@ -0,0 +1,212 @@
+# pipeline instrumentation: stage latencies, queue depths, dropped frames
+
+import json
+import time
+from collections import deque, Counter
+from contextlib import contextmanager
+from threading import Lock
+import numpy as np
+import pandas as pd
+
+# upper edges of the latency histogram bins in milliseconds
+
+BINS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float("inf")]
+
+# columns of the stage table written to CSV
+
+STAGE_COLUMNS = ["count", "mean_ms", "p50_ms", "p95_ms", "max_ms"]
+
+
+class PipelineStats:
+    def __init__(self, history=10000, fps_window=2):
+        self.lock = Lock()
+        self.started = time.perf_counter()
+
+        # stage -> histogram counts, total and max in ms
+
+        self.stages = {}
+
+        # (seconds since start, depth per queue) samples
+
+        self.depths = deque(maxlen=history)
+
+        # frames thrown away, by reason
+
+        self.dropped = Counter()
+
+        # events worth counting, e.g. frames the detector skipped
+
+        self.counts = Counter()
+
+        # times frames were shown, for the effective display rate
+
+        self.shown = deque()
+        self.shown_total = 0
+        self.fps_window = fps_window
+
+        # anything else worth reporting, e.g. detector settings
+
+        self.info = {}
+
+    def record(self, stage, seconds):
+        ms = seconds * 1000
+
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = {
+                    "hist": np.zeros(len(BINS), dtype=np.int64),
+                    "count": 0,
+                    "total": 0.0,
+                    "max": 0.0,
+                }
+
+            entry = self.stages[stage]
+            entry["hist"][np.searchsorted(BINS, ms)] += 1
+            entry["count"] += 1
+            entry["total"] += ms
+            entry["max"] = max(entry["max"], ms)
+
+    @contextmanager
+    def time(self, stage):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def sample(self, **depths):
+        with self.lock:
+            self.depths.append((time.perf_counter() - self.started, depths))
+
+    def drop(self, reason, frames=1):
+        if frames > 0:
+            with self.lock:
+                self.dropped[reason] += frames
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.counts[key] += n
+
+    def mean(self, stage):
+        # mean ms of a stage, 0 before it was timed
+
+        with self.lock:
+            entry = self.stages.get(stage)
+
+            return entry["total"] / entry["count"] if entry else 0.0
+
+    def set(self, key, value):
+        with self.lock:
+            self.info[key] = value
+
+    def frame_shown(self):
+        now = time.perf_counter()
+
+        with self.lock:
+            self.shown.append(now)
+            self.shown_total += 1
+
+            while now - self.shown[0] > self.fps_window:
+                self.shown.popleft()
+
+    def display_fps(self):
+        with self.lock:
+            if len(self.shown) < 2:
+                return 0.0
+
+            return (len(self.shown) - 1) / (self.shown[-1] - self.shown[0])
+
+    def percentile(self, hist, q):
+        # upper edge of the bin the q-th percentile falls in
+
+        counts = np.cumsum(hist)
+
+        if counts[-1] == 0:
+            return 0.0
+
+        return BINS[int(np.searchsorted(counts, q / 100 * counts[-1]))]
+
+    def summary(self):
+        fps = self.display_fps()
+
+        with self.lock:
+            stages = {
+                stage: {
+                    "count": entry["count"],
+                    "mean_ms": entry["total"] / entry["count"],
+                    "p50_ms": min(self.percentile(entry["hist"], 50), entry["max"]),
+                    "p95_ms": min(self.percentile(entry["hist"], 95), entry["max"]),
+                    "max_ms": entry["max"],
+                    "histogram": dict(zip(map(str, BINS), entry["hist"].tolist())),
+                }
+                for stage, entry in self.stages.items()
+            }
+
+            return {
+                "elapsed_s": time.perf_counter() - self.started,
+                "frames_shown": self.shown_total,
+                "display_fps": fps,
+                "dropped": dict(self.dropped),
+                "counts": dict(self.counts),
+                "queue_depth": dict(self.depths[-1][1]) if self.depths else {},
+                "stages": stages,
+                "info": dict(self.info),
+            }
+
+    def report(self):
+        # short text version for the debug panel
+
+        summary = self.summary()
+
+        lines = [
+            f"Display: {summary['display_fps']:.1f} fps, "
+            f"{summary['frames_shown']} frames shown",
+            f"Queues: {summary['queue_depth']}",
+            f"Dropped: {summary['dropped']}",
+            f"Counts: {summary['counts']}",
+            "",
+            f"{'Stage':<12}{'count':>8}{'mean':>10}{'p95':>10}{'max':>10}  (ms)",
+        ]
+
+        for stage, entry in summary["stages"].items():
+            lines.append(
+                f"{stage:<12}{entry['count']:>8}{entry['mean_ms']:>10.2f}"
+                f"{entry['p95_ms']:>10.1f}{entry['max_ms']:>10.1f}"
+            )
+
+        if summary["info"]:
+            lines.append("")
+
+            for key, value in summary["info"].items():
+                lines.append(f"{key}: {value}")
+
+        return "\n".join(lines)
+
+    def dump(self, path):
+        # JSON holds everything, CSV writes the stage table and puts the
+        # queue depth series next to it
+
+        summary = self.summary()
+
+        with self.lock:
+            depths = [{"time_s": t, **depths} for t, depths in self.depths]
+
+        if path.endswith(".csv"):
+            # a run that recorded nothing, e.g. closed before a video was
+            # opened, still gets the headers
+
+            stages = pd.DataFrame.from_dict(summary["stages"], orient="index")
+            stages = stages.reindex(columns=STAGE_COLUMNS)
+            stages.index.name = "stage"
+            stages.to_csv(path)
+
+            queues = (
+                pd.DataFrame(depths) if depths else pd.DataFrame(columns=["time_s"])
+            )
+            queues.to_csv(path[: -len(".csv")] + "_queues.csv", index=False)
+        else:
+            summary["queue_depths"] = depths
+
+            with open(path, "w") as f:
+                json.dump(summary, f, indent=4, default=str)
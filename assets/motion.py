@@ -0,0 +1,130 @@
+# cheap motion measures on shrunk grey frames, used to decide which frames go
+# through the detector
+
+import cv2
+import numpy as np
+
+# width frames are shrunk to before comparing them
+
+MOTION_WIDTH = 160
+
+# grey level change that counts a pixel as moving
+
+PIXEL_THRESHOLD = 15
+
+
+def shrink(frame, width=MOTION_WIDTH):
+    # small grey copy of an RGB frame
+
+    height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+
+    small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+    return cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+
+
+def changed(grey, reference, pixel_threshold=PIXEL_THRESHOLD):
+    # fraction of pixels that differ from the reference, 1 without one
+
+    if reference is None or reference.shape != grey.shape:
+        return 1.0
+
+    diff = cv2.absdiff(grey, reference)
+
+    return np.count_nonzero(diff > pixel_threshold) / diff.size
+
+
+class MotionMeter:
+    def __init__(self):
+        self.previous = None
+
+    def reset(self):
+        self.previous = None
+
+    def update(self, grey):
+        # change since the last frame
+
+        motion = changed(grey, self.previous)
+
+        self.previous = grey
+
+        return motion
+
+
+# decides which frames go through the detector, every nth frame, or sooner if
+# the picture moves or trackers lose their fish, boxes are carried by the
+# trackers or the last detections in between
+
+
+class DetectionCadence:
+    def __init__(self, every=1, motion_threshold=0.05, lost_threshold=0):
+        self.every = max(1, every)
+        self.motion_threshold = motion_threshold
+        self.lost_threshold = lost_threshold
+        self.meter = MotionMeter()
+        self.since = None
+
+    def reset(self):
+        # after a seek the next frame is always detected on
+
+        self.since = None
+        self.meter.reset()
+
+    def due(self, grey, lost=0):
+        # reason to detect on this frame, None to carry the last boxes
+
+        if self.every == 1:
+            return "interval"
+
+        motion = self.meter.update(grey)
+
+        if self.since is None or self.since + 1 >= self.every:
+            reason = "interval"
+        elif motion > self.motion_threshold:
+            reason = "motion"
+        elif lost > self.lost_threshold:
+            reason = "tracker"
+        else:
+            self.since += 1
+
+            return None
+
+        self.since = 0
+
+        return reason
+
+
+# skips the detector on frames that barely differ from the last frame it ran
+# on, comparing with that frame rather than the previous one so slow changes
+# still add up
+
+
+class MotionGate:
+    def __init__(self, threshold=0):
+        self.threshold = threshold
+        self.reference = None
+
+        self.checked = 0
+        self.static = 0
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def reset(self):
+        self.reference = None
+
+    def is_static(self, grey):
+        self.checked += 1
+
+        if changed(grey, self.reference) < self.threshold:
+            self.static += 1
+
+            return True
+
+        return False
+
+    def detected(self, grey):
+        # the detector ran on this frame
+
+        self.reference = grey
@@ -0,0 +1,362 @@
+# detection over a whole project ahead of annotation, results go to the same
+# per video detection files the player reads so samples open with their
+# detections ready
+
+import multiprocessing
+import os
+import sys
+import time
+from queue import Empty
+from types import SimpleNamespace
+import cv2
+from assets.decoder import decoder_options, open_capture
+from assets.detect import (
+    load_model,
+    model_files,
+    model_settings,
+    detect_batch,
+    tile_grid,
+)
+from assets.index import SeekIndex
+from assets.store import DetectionCache, video_files
+
+
+def project_jobs(project_info):
+    # video -> list of (start, end) windows in seconds, end is None for the
+    # whole video
+
+    jobs = {}
+
+    if project_info["type"] == "Individual":
+        folder = project_info["video_folder"]
+
+        for name in sorted(video_files(folder)):
+            path = os.path.join(folder, name)
+
+            if not os.path.isfile(path):
+                continue
+
+            jobs[path] = [(0, None)]
+    else:
+        for plot in project_info.get("samples", {}).values():
+            for sample in plot.values():
+                if sample["video"] is None:
+                    continue
+
+                start = sample["start_time"]
+
+                jobs.setdefault(sample["video"], []).append(
+                    (start, start + project_info["sample_s"])
+                )
+
+    return jobs
+
+
+def job_frames(path, windows):
+    # frames to detect on, from the container headers
+
+    capture = cv2.VideoCapture(path, cv2.CAP_FFMPEG)
+
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    capture.release()
+
+    frames = 0
+
+    for start, end in windows:
+        end = count / fps if end is None else end
+
+        frames += max(0, min(round(end * fps), count) - round(start * fps))
+
+    return frames
+
+
+# state of each worker process, set up once by init_worker
+
+worker = {}
+
+
+def detect_size(capture, display_width):
+    # frames are scaled down like they are for playback, the size they are
+    # detected at and the scale from source pixels
+
+    width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    if display_width and width > display_width:
+        scale = display_width / width
+    else:
+        scale = 1
+
+    return (round(width * scale), round(height * scale)), scale
+
+
+def video_tiling(path, tiling, display_width):
+    # the project's tiling if it fits the video's frames, otherwise the
+    # video is detected on whole frames like it is played back, under the
+    # same key
+
+    if not tiling:
+        return None
+
+    capture = cv2.VideoCapture(path, cv2.CAP_FFMPEG)
+
+    size, scale = detect_size(capture, display_width)
+
+    capture.release()
+
+    try:
+        tile_grid(*size, tiling, scale)
+    except ValueError as e:
+        print(f"Tiling off for {path}: {e}")
+
+        return None
+
+    return tiling
+
+
+def init_worker(progress, useGPU, batch_size, threads, detector, display_width):
+    cv2.setNumThreads(threads)
+
+    video = SimpleNamespace(useGPU=useGPU)
+
+    load_model(video, model_settings(detector))
+
+    worker.update(
+        video=video,
+        progress=progress,
+        batch_size=batch_size,
+        detector=detector,
+        display_width=display_width,
+    )
+
+
+def detect_video(job):
+    path, windows, tiling = job
+
+    video = worker["video"]
+    progress = worker["progress"]
+
+    index = SeekIndex.load(path)
+
+    if index is None:
+        progress.put(("error", f"Unable to read {path}"))
+
+        return path
+
+    capture = open_capture(path, decoder_options(path)[1])
+
+    # detections made at another size are kept apart
+
+    size, scale = detect_size(capture, worker["display_width"])
+
+    cache = DetectionCache(
+        path,
+        {**model_settings(worker["detector"], tiling), "detect_width": size[0]},
+        scale,
+    )
+
+    tiles = None
+
+    if tiling:
+        tiles = tile_grid(*size, tiling, scale)
+
+    def run(frames, images):
+        for frame, detections in zip(frames, detect_batch(video, images, tiles=tiles)):
+            cache.add(frame, *detections)
+
+        progress.put(("detected", len(frames)))
+
+    # frames detected before an error or an interrupt are still saved, so a
+    # run that stops early carries on from them
+
+    try:
+        for start, end in windows:
+            first = index.frame_at(start * 1000)
+            last = index.frame_count if end is None else index.frame_at(end * 1000)
+
+            # frames detected on in an earlier run are passed over
+
+            todo = [frame for frame in range(first, last) if frame not in cache]
+
+            progress.put(("cached", last - first - len(todo)))
+
+            position = None
+            frames = []
+            images = []
+
+            for frame in todo:
+                index.seek(capture, frame, position)
+
+                ret, image = capture.read()
+
+                if not ret:
+                    break
+
+                position = frame + 1
+
+                if scale < 1:
+                    image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+                frames.append(frame)
+                images.append(image)
+
+                if len(frames) == worker["batch_size"]:
+                    run(frames, images)
+
+                    frames = []
+                    images = []
+
+            if frames:
+                run(frames, images)
+    finally:
+        cache.flush()
+        capture.release()
+
+    return path
+
+
+def format_time(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def predetect(
+    project_info,
+    workers=0,
+    batch_size=1,
+    useGPU=False,
+    detector=None,
+    display_width=1280,
+):
+    # detect on every sample window, or every video of an Individual project,
+    # in parallel processes, can be stopped and run again to carry on
+    #
+    # detector holds command line overrides of the project's detector settings,
+    # display_width has to match playback for the detections to be reused
+
+    detector = {**project_info.get("detector", {}), **(detector or {})}
+
+    missing = [
+        path
+        for path in model_files(model_settings(detector))
+        if not os.path.exists(path)
+    ]
+
+    if missing:
+        print(f"Model files not found: {', '.join(missing)}")
+
+        return False
+
+    # a model that fails to load fails every worker, which the pool starts
+    # over without end, so it is loaded once here first
+
+    try:
+        load_model(SimpleNamespace(useGPU=useGPU), model_settings(detector))
+    except Exception as e:
+        print(f"Unable to load the detection model: {e!r}")
+
+        return False
+
+    jobs = project_jobs(project_info)
+
+    if len(jobs) == 0:
+        print("Nothing to detect on.")
+
+        return True
+
+    # longest videos first so the last workers don't finish alone
+
+    totals = {path: job_frames(path, windows) for path, windows in jobs.items()}
+    order = sorted(jobs.items(), key=lambda job: totals[job[0]], reverse=True)
+
+    # a tiling that doesn't fit a video would fail its worker, it is checked
+    # here first
+
+    tiling = project_info.get("tiling")
+
+    order = [
+        (path, windows, video_tiling(path, tiling, display_width))
+        for path, windows in order
+    ]
+
+    total = sum(totals.values())
+
+    cores = os.cpu_count() or 1
+    workers = min(workers if workers > 0 else cores, len(jobs))
+    threads = max(1, cores // workers)
+
+    print(f"Detecting on {len(jobs)} videos, {total} frames with {workers} workers")
+
+    context = multiprocessing.get_context("spawn")
+    progress = context.Queue()
+
+    counts = {"done": 0, "detected": 0, "videos": 0}
+    start = time.perf_counter()
+
+    def report():
+        # frames done so far, the rate only counts frames detected on
+
+        while True:
+            try:
+                kind, value = progress.get_nowait()
+            except Empty:
+                break
+
+            if kind == "error":
+                print(f"\n{value}")
+            else:
+                counts["done"] += value
+
+                if kind == "detected":
+                    counts["detected"] += value
+
+        elapsed = time.perf_counter() - start
+        fps = counts["detected"] / elapsed if elapsed > 0 else 0
+        done = min(counts["done"], total)
+
+        eta = format_time((total - done) / fps) if fps > 0 else "--:--:--"
+
+        sys.stdout.write(
+            f"\rDetected {done}/{total} frames ({100 * done / max(total, 1):.1f}%), "
+            f"{counts['videos']}/{len(order)} videos, {fps:.1f} fps, ETA {eta}   "
+        )
+        sys.stdout.flush()
+
+    with context.Pool(
+        workers,
+        initializer=init_worker,
+        initargs=(
+            progress,
+            useGPU,
+            batch_size,
+            threads,
+            detector,
+            display_width,
+        ),
+    ) as pool:
+        results = pool.imap_unordered(detect_video, order)
+
+        while counts["videos"] < len(order):
+            try:
+                results.next(timeout=0.5)
+
+                counts["videos"] += 1
+            except multiprocessing.TimeoutError:
+                pass
+
+            report()
+
+        # workers flush what is left of their progress as they exit
+
+        pool.close()
+        pool.join()
+
+    report()
+
+    print(f"\nDone in {format_time(time.perf_counter() - start)}")
+
+    return True
@@ -0,0 +1,475 @@
+# append only columnar files for per frame results kept next to a video
+
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from assets.index import INDEX_SUFFIX, sidecar_path
+
+# bytes read from the start, middle and end of a video to fingerprint it,
+# hashing whole recordings would take longer than detecting on them
+
+HASH_SAMPLE = 1024 * 1024
+
+# detection files are named after the video, a short key and this suffix
+
+DETECTION_SUFFIX = ".det"
+
+# frames buffered before detections are written out
+
+DETECTION_CHUNK = 256
+
+# tracks are saved next to the project's data, this many frames at a time
+
+TRACK_SUFFIX = ".tracks"
+TRACK_CHUNK = 256
+
+# files kept next to a video that are not videos themselves
+
+SIDECAR_SUFFIXES = (INDEX_SUFFIX, DETECTION_SUFFIX)
+
+
+def video_files(folder):
+    # names of the videos in a folder, passing over their seek index and
+    # detection files
+
+    return [name for name in os.listdir(folder) if not name.endswith(SIDECAR_SUFFIXES)]
+
+
+# file hashes by (path, size, mtime) so model weights are read once
+
+hashes = {}
+
+
+def file_hash(path, sample=None):
+    # sha1 of a file, or of its size and three samples of it
+
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime, sample)
+
+    if key in hashes:
+        return hashes[key]
+
+    digest = hashlib.sha1()
+
+    with open(path, "rb") as f:
+        if sample is None or stat.st_size <= 3 * sample:
+            for block in iter(lambda: f.read(HASH_SAMPLE), b""):
+                digest.update(block)
+        else:
+            digest.update(str(stat.st_size).encode())
+
+            for offset in [0, (stat.st_size - sample) // 2, stat.st_size - sample]:
+                f.seek(offset)
+                digest.update(f.read(sample))
+
+    hashes[key] = digest.hexdigest()
+
+    return hashes[key]
+
+
+# file of chunks, each a fixed set of named columns stored as consecutive
+# .npy arrays after a JSON header, chunks are appended as they fill so an
+# interrupted run keeps everything written before the last partial chunk
+
+
+class ColumnStore:
+    def __init__(self, path, columns, header=None):
+        self.path = path
+        self.columns = list(columns)
+        self.header = dict(header or {})
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def append(self, **chunk):
+        new = not self.exists()
+
+        with open(self.path, "ab") as f:
+            if new:
+                header = json.dumps({"columns": self.columns, **self.header})
+
+                np.save(f, np.frombuffer(header.encode(), dtype=np.uint8))
+
+            for column in self.columns:
+                np.save(f, np.asarray(chunk[column]), allow_pickle=False)
+
+    def read(self):
+        # header and the columns of every complete chunk, a partly written
+        # last chunk is cut off so later appends follow on from the last
+        # complete one
+
+        chunks = {column: [] for column in self.columns}
+
+        if not self.exists():
+            return None, chunks
+
+        with open(self.path, "rb") as f:
+            try:
+                header = json.loads(np.load(f).tobytes())
+            except (ValueError, EOFError, OSError):
+                return None, chunks
+
+            size = os.fstat(f.fileno()).st_size
+            end = f.tell()
+
+            while end < size:
+                try:
+                    chunk = [np.load(f, allow_pickle=False) for _ in self.columns]
+                except (ValueError, EOFError, OSError):
+                    break
+
+                for column, values in zip(self.columns, chunk):
+                    chunks[column].append(values)
+
+                end = f.tell()
+
+        if end < size:
+            try:
+                os.truncate(self.path, end)
+            except OSError:
+                pass
+
+        return header, chunks
+
+    def remove(self):
+        if self.exists():
+            os.remove(self.path)
+
+
+# detections per frame of one video for one model and its settings, frames
+# that were detected on without finding anything are kept too so they are
+# not detected on again
+#
+# boxes are saved in source pixels, scale converts them to and from the
+# frames they are detected on
+
+
+class DetectionCache:
+    COLUMNS = ["frames", "frame", "box", "confidence", "class_id"]
+
+    def __init__(self, path, settings, scale=1):
+        self.key = self.make_key(path, settings)
+        self.scale = scale
+        self.store = ColumnStore(
+            sidecar_path(path, f".{self.key[:12]}{DETECTION_SUFFIX}"),
+            self.COLUMNS,
+            {"key": self.key, "settings": settings},
+        )
+
+        # frame index -> (boxes, confidences, class ids)
+
+        self.detections = {}
+
+        # detections waiting to be written
+
+        self.pending = []
+
+        self.hits = 0
+        self.misses = 0
+
+        self.load()
+
+    @staticmethod
+    def make_key(path, settings):
+        # same video content, same model weights and same settings, the input
+        # size tuner's target is left out as only detections made at the
+        # configured input size are saved
+
+        settings = dict(settings)
+        settings.pop("target_fps", None)
+
+        for name in ["cfg", "weights"]:
+            if name in settings and os.path.exists(settings[name]):
+                settings[name] = file_hash(settings[name])
+
+        key = {"video": file_hash(path, HASH_SAMPLE), **settings}
+
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def load(self):
+        header, chunks = self.store.read()
+
+        # start over if the file is unreadable or not for this key
+
+        if header is None or header.get("key") != self.key:
+            try:
+                self.store.remove()
+            except OSError:
+                pass
+
+            return
+
+        for frames, frame, box, confidence, class_id in zip(
+            *(chunks[column] for column in self.COLUMNS)
+        ):
+            # split the chunk's rows back into frames
+
+            order = np.argsort(frame, kind="stable")
+            starts = np.searchsorted(frame[order], frames, "left")
+            ends = np.searchsorted(frame[order], frames, "right")
+
+            for index, start, end in zip(frames.tolist(), starts, ends):
+                rows = order[start:end]
+
+                self.detections[index] = (
+                    box[rows].astype(np.float64),
+                    confidence[rows],
+                    class_id[rows],
+                )
+
+    def __len__(self):
+        return len(self.detections)
+
+    def __contains__(self, frame):
+        return frame in self.detections
+
+    def get(self, frame):
+        detections = self.detections.get(frame)
+
+        if detections is None:
+            self.misses += 1
+
+            return None
+
+        self.hits += 1
+
+        boxes, confidences, class_ids = detections
+
+        return boxes * self.scale, confidences, class_ids
+
+    def add(self, frame, boxes, confidences, class_ids):
+        if frame in self.detections:
+            return
+
+        detections = (
+            np.asarray(boxes, dtype=np.float64).reshape(-1, 4) / self.scale,
+            np.asarray(confidences, dtype=np.float32),
+            np.asarray(class_ids, dtype=np.int16),
+        )
+
+        self.detections[frame] = detections
+        self.pending.append((frame, detections))
+
+        if len(self.pending) >= DETECTION_CHUNK:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        frames = [frame for frame, _ in self.pending]
+        counts = [len(detections[1]) for _, detections in self.pending]
+
+        try:
+            self.store.append(
+                frames=np.array(frames, dtype=np.int32),
+                frame=np.repeat(frames, counts).astype(np.int32),
+                box=np.concatenate(
+                    [d[0] for _, d in self.pending], dtype=np.float32
+                ).reshape(-1, 4),
+                confidence=np.concatenate(
+                    [d[1] for _, d in self.pending], dtype=np.float32
+                ),
+                class_id=np.concatenate(
+                    [d[2] for _, d in self.pending], dtype=np.int16
+                ),
+            )
+        except OSError as e:
+            print(f"\nUnable to save detections: {e}")
+
+        self.pending = []
+
+
+# trajectories of the fish tracked in one sample, a row per fish and frame
+# with its track id, box, the confidence of the detection it matched on
+# that frame, nan between detections, and the class it was detected as
+#
+# boxes are saved in source pixels like detections, frames already saved
+# are not saved again when they are tracked a second time after a seek
+
+
+class TrackStore:
+    COLUMNS = ["frame", "track", "box", "confidence", "class_id"]
+
+    def __init__(self, path, header=None, scale=1):
+        self.scale = scale
+        self.store = ColumnStore(path, self.COLUMNS, header)
+
+        # frames saved or waiting to be, and the rows waiting
+
+        self.frames = set()
+        self.pending = []
+
+        # ids of new tracks start after the saved ones
+
+        self.next_id = 1
+
+        self.header, chunks = self.store.read()
+
+        # a file saved for another video is started over
+
+        video = (header or {}).get("video")
+
+        if self.header is not None and video not in (None, self.header.get("video")):
+            print(f"\nTracks in {path} are for another video, starting over")
+
+            self.header = None
+
+        # or saved with other columns
+
+        if self.header is not None and self.header.get("columns") != self.COLUMNS:
+            self.header = None
+
+        if self.header is None:
+            chunks = {column: [] for column in self.COLUMNS}
+
+            try:
+                self.store.remove()
+            except OSError:
+                pass
+
+        for frame, track in zip(chunks["frame"], chunks["track"]):
+            self.frames.update(frame.tolist())
+
+            if len(track) > 0:
+                self.next_id = max(self.next_id, int(track.max()) + 1)
+
+    def add(self, frame, ids, boxes, confidences, class_ids):
+        if frame in self.frames:
+            return
+
+        self.frames.add(frame)
+        self.pending.append(
+            (
+                frame,
+                np.asarray(ids, dtype=np.int32),
+                np.asarray(boxes, dtype=np.float64).reshape(-1, 4) / self.scale,
+                np.asarray(confidences, dtype=np.float32),
+                np.asarray(class_ids, dtype=np.int16),
+            )
+        )
+
+        if len(self.pending) >= TRACK_CHUNK:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.store.path) or ".", exist_ok=True)
+
+            self.store.append(
+                frame=np.repeat(
+                    [frame for frame, *_ in self.pending],
+                    [len(ids) for _, ids, *_ in self.pending],
+                ).astype(np.int32),
+                track=np.concatenate([row[1] for row in self.pending]),
+                box=np.concatenate(
+                    [row[2] for row in self.pending], dtype=np.float32
+                ).reshape(-1, 4),
+                confidence=np.concatenate([row[3] for row in self.pending]),
+                class_id=np.concatenate([row[4] for row in self.pending]),
+            )
+        except OSError as e:
+            print(f"\nUnable to save tracks: {e}")
+
+        self.pending = []
+
+    def table(self):
+        # every saved row as a data frame ordered by frame and track
+
+        _, chunks = self.store.read()
+
+        boxes = np.concatenate(chunks["box"] or [np.zeros((0, 4), np.float32)])
+
+        table = pd.DataFrame(
+            {
+                "frame": np.concatenate(chunks["frame"] or [np.zeros(0, np.int32)]),
+                "track": np.concatenate(chunks["track"] or [np.zeros(0, np.int32)]),
+                "x": boxes[:, 0],
+                "y": boxes[:, 1],
+                "w": boxes[:, 2],
+                "h": boxes[:, 3],
+                "confidence": np.concatenate(
+                    chunks["confidence"] or [np.zeros(0, np.float32)]
+                ),
+                "class_id": np.concatenate(
+                    chunks["class_id"] or [np.zeros(0, np.int16)]
+                ),
+            }
+        )
+
+        return table.sort_values(["frame", "track"], ignore_index=True)
+
+
+def track_path(project_info, sample_id, video):
+    # one file per sample of a plot project, individuals can share a video
+    # so an individual project keeps one per video
+
+    if project_info["type"] == "Individual":
+        name = os.path.splitext(os.path.basename(video))[0]
+    else:
+        name = sample_id
+
+    return os.path.join(project_info["data_folder"], "tracks", f"{name}{TRACK_SUFFIX}")
+
+
+def export_tracks(project_info, path):
+    # trajectories of every sample in the project in one .csv or .parquet
+    # file, parquet needs pyarrow or fastparquet
+
+    tables = []
+
+    if project_info["type"] == "Individual":
+        # every video tracked, rows are labelled by video
+
+        folder = os.path.join(project_info["data_folder"], "tracks")
+        names = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+
+        for name in names:
+            if not name.endswith(TRACK_SUFFIX):
+                continue
+
+            store = TrackStore(os.path.join(folder, name))
+
+            table = store.table()
+            table.insert(0, "video", (store.header or {}).get("video", name))
+
+            tables.append(table)
+    else:
+        for plot_id, samples in project_info.get("samples", {}).items():
+            for sample_id, sample in samples.items():
+                sample_path = track_path(project_info, sample_id, sample["video"])
+
+                if not os.path.exists(sample_path):
+                    continue
+
+                table = TrackStore(sample_path).table()
+                table.insert(0, "sample_id", sample_id)
+                table.insert(0, "plot_id", plot_id)
+
+                tables.append(table)
+
+    if not tables:
+        print("No tracks saved for this project, run with --track first.")
+
+        return False
+
+    table = pd.concat(tables, ignore_index=True)
+
+    if path.endswith(".parquet"):
+        try:
+            table.to_parquet(path, index=False)
+        except ImportError:
+            print("Parquet export needs pyarrow, pip install pyarrow.")
+
+            return False
+    else:
+        table.to_csv(path, index=False)
+
+    print(f"Saved {len(table)} rows from {len(tables)} files to {path}")
+
+    return True
@@ -1,9 +1,36 @@
-from threading import Thread, Lock
-from queue import Queue
+from collections import deque
+from threading import Thread, Lock, Event, current_thread
+from queue import Queue, Empty, Full
 import cv2
+import numpy as np
 import time
-from assets.detect import load_model, detect_fish, draw_fish, track_fish
-import sys
+from assets.buffer import FrameRing, FrameCache
+from assets.decoder import decoder_options, open_capture
+from assets.index import SeekIndex
+from assets.metrics import PipelineStats
+from assets.motion import DetectionCadence, MotionGate, shrink
+from assets.store import DetectionCache, TrackStore
+from assets.workers import DetectorPool
+from assets.detect import (
+    model_settings,
+    shared_detector,
+    tile_grid,
+    draw_fish,
+    make_tracker,
+    track_fish,
+    tracker_available,
+)
+
+
+# plan entry for frames that keep the last boxes instead of being detected on
+
+CARRY = "carry"
+
+NO_DETECTIONS = (
+    np.zeros((0, 4)),
+    np.zeros(0, dtype=np.float32),
+    np.zeros(0, dtype=int),
+)
 
 
 class VideoStream:
@@ -17,9 +44,35 @@ class VideoStream:
         tracking,
         useGPU,
         skip_seconds=10,
-        queue_size=1024,
+        buffer_mb=512,
+        cache_mb=256,
+        display_width=1280,
+        decoder=None,
+        stats=None,
+        timeout=0.05,
+        seek_index=True,
+        batch_size=1,
+        batch_wait=0.05,
+        workers=0,
+        detection_cache=True,
+        detect_every=1,
+        motion_threshold=0.05,
+        motion_gate=0,
+        tiling=None,
+        detector=None,
+        tracker="sort",
+        track_threads=0,
+        track_file=None,
     ):
-        self.stream = cv2.VideoCapture(path, cv2.CAP_FFMPEG)
+        # decoder threads and codec picked per file, decoder holds project
+        # overrides
+
+        self.codec_info, self.decoder_options = decoder_options(path, decoder)
+        self.stream = open_capture(path, self.decoder_options)
+
+        # per stage latencies and queue depths, may be shared across streams
+
+        self.stats = stats if stats is not None else PipelineStats()
         self.frame_time = 0
         self.data = data
         self.plot_id = plot_id
@@ -27,19 +80,199 @@ class VideoStream:
         self.path = path
         self.skip_seconds = skip_seconds
         self.threads = []
-        self.stopped = False
+        self.stop_event = Event()
         self.paused = False
+        self.ended = False
         self.speed = 1
         self.lock = Lock()
         self.fps = self.stream.get(cv2.CAP_PROP_FPS)
-        self.Q = Queue(maxsize=queue_size)
         self.width = int(self.stream.get(cv2.CAP_PROP_FRAME_WIDTH))
         self.height = int(self.stream.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
+        # keyframe index kept next to the video, one saved earlier is loaded
+        # here, otherwise it is built in the background on start and seeks go
+        # by timestamp until it is ready
+
+        self.index = SeekIndex.load(path, build=False) if seek_index else None
+        self.indexing = seek_index and self.index is None
+        self.frame_count = int(self.stream.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        # frame numbers are exact unless the reader seeked by timestamp
+
+        self.exact = True
+
+        # next frame the reader will decode and any pending seek, seeks are
+        # carried out by the reader so the UI never waits on the decoder
+
+        self.position = 0
+        self.target = None
+        self.seek_time = 0
+
+        # decode rate over the first frames, reported once at stream start
+
+        self.decode_fps = None
+        self.decode_frames = 0
+        self.decode_time = 0
+
+        # frames are scaled down to display size and converted to RGB as they
+        # are decoded, full resolution frames are only fetched on demand
+
+        if display_width and self.width > display_width:
+            self.scale = display_width / self.width
+        else:
+            self.scale = 1
+
+        self.display_width = round(self.width * self.scale)
+        self.display_height = round(self.height * self.scale)
+
+        shape = (self.display_height, self.display_width, 3)
+
+        if self.scale < 1:
+            self.decoded = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        else:
+            self.decoded = None
+
+        # second capture for full resolution frames and its read position
+
+        self.source = None
+        self.source_position = None
+
+        # frames live in a preallocated ring, the queues only pass slot numbers
+        # so their depth is bounded by the ring size
+
+        # detection can run in worker processes that read frames from the ring
+        # directly, it then lives in shared memory
+
+        self.workers = workers if detection or tracking else 0
+        self.pool = None
+        self.pool_error = None
+
+        # model and detection settings, detector holds project and command
+        # line overrides, the model is loaded on start
+
+        self.settings = model_settings(detector)
+        self.detector = None
+
+        # why detection stopped or runs without tiles, shown by the UI
+
+        self.error = None
+
+        # tiles frames are detected on, from the project's tiling settings, a
+        # region of interest outside the frame or a bad overlap detects on
+        # whole frames instead
+
+        self.tiles = None
+
+        if tiling:
+            try:
+                self.tiles = tile_grid(
+                    self.display_width, self.display_height, tiling, self.scale
+                )
+            except ValueError as e:
+                self.error = f"Tiling off: {e}"
+
+                print(f"\n{self.error}")
+
+                tiling = None
+
+        self.ring = FrameRing(shape, budget_mb=buffer_mb, shared=self.workers > 0)
+        self.Q = Queue()
+
+        # slot currently shown by the UI
+
+        self.held = None
+
+        # recently shown frames, so backward skips and replays don't decode
+        # again, frame indices come from the seek index so it is required
+
+        self.cache_mb = cache_mb
+        self.cache = None
+
+        # index of the frame on screen and of the next frame served from the
+        # cache, replay stops at resume where the decoder takes over
+
+        self.frame_index = 0
+        self.replay = None
+        self.resume = None
+
+        # how long a blocked stage waits before checking for stop or seek
+
+        self.timeout = timeout
+
+        # bumped on every seek so stages can drop frames decoded before it
+
+        self.generation = 0
+
         if detection or tracking:
-            self.detect_Q = Queue(maxsize=queue_size)
+            self.detect_Q = Queue()
+
+        # frames detected on per forward pass and how long the detector
+        # waits for a batch to fill before running on what it has
+
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait
+
+        # batches handed to the workers in frame order and the detections
+        # that came back for them, possibly out of order
+
+        self.pending = deque()
+        self.detected = {}
+
+        # frames the detector runs on, the rest reuse the last boxes, lost is
+        # the share of trackers that lost their fish on the last frame
+
+        self.cadence = DetectionCadence(detect_every, motion_threshold)
+        self.cadence_generation = None
+
+        # frames that barely changed since the detector last ran keep its
+        # boxes instead of running it again
+
+        self.gate = MotionGate(motion_gate)
+        self.last_detections = NO_DETECTIONS
+        self.lost = 0
+
+        # detections kept next to the video for this model and its settings
+        # and the width of the frames it sees, frames are looked up by index
+        # so the seek index is required
 
-        self.trackers = []
+        if (detection or tracking) and detection_cache:
+            self.detection_settings = {
+                **model_settings(detector, tiling),
+                "detect_width": self.display_width,
+            }
+        else:
+            self.detection_settings = None
+
+        self.detections = None
+
+        # Kalman tracks of every fish, or one appearance tracker per fish,
+        # started over on seeks, and the time tracking took on the last frame
+
+        if tracker != "sort" and not tracker_available(tracker):
+            print(f"\nThis OpenCV build has no {tracker} tracker, using sort")
+
+            tracker = "sort"
+
+        self.tracker_type = tracker
+        self.tracker = make_tracker(tracker, track_threads)
+        self.track_generation = None
+        self.track_ms = 0
+
+        # guards the trackers and saved tracks, apart from the decoder's lock
+        # so tracking never holds up reads and seeks
+
+        self.track_lock = Lock()
+
+        # trajectories of the tracked fish saved for the sample, new ids
+        # follow on from the ones already saved
+
+        if tracking and track_file is not None:
+            self.trajectories = TrackStore(
+                track_file, {"video": path, "sample_id": sample_id}, self.scale
+            )
+            self.tracker.next_id = self.trajectories.next_id
+        else:
+            self.trajectories = None
 
         # switches
 
@@ -47,118 +280,873 @@ class VideoStream:
         self.tracking = tracking
         self.useGPU = useGPU
 
+        if self.index is not None:
+            self.use_index(self.index)
+
         if not self.stream.isOpened():
             print(f"Error: Unable to open video file {path}")
 
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def use_index(self, index):
+        # frame numbers are known from here on, so frames and detections can
+        # be cached by them
+
+        self.index = index
+        self.frame_count = index.frame_count
+
+        if self.cache_mb > 0:
+            self.cache = FrameCache(self.ring.shape, budget_mb=self.cache_mb)
+
+    def load_detections(self):
+        # the detections saved for the video, opened by the detector thread
+        # once frame numbers are known, hashing the video and weights and
+        # reading a long file would hold up the window if done on open
+
+        if self.detections is None and self.index is not None:
+            if self.detection_settings is not None:
+                self.detections = DetectionCache(
+                    self.path, self.detection_settings, self.scale
+                )
+
+        return self.detections
+
+    def build_index(self):
+        # index a video seen for the first time while it plays, this is not
+        # joined on stop so closing the stream does not wait for it
+
+        index = SeekIndex.load(self.path)
+
+        if index is None:
+            return
+
+        with self.lock:
+            if self.stopped:
+                return
+
+            # frames decoded after a seek by timestamp may be misnumbered,
+            # start again from the frame on screen before anything is cached
+            # by number
+
+            if not self.exact:
+                self.move(self.frame_time)
+
+            self.use_index(index)
+
     def start(self):
-        if self.detection:
-            # load model
+        if self.workers > 0:
+            # every worker loads its own model, collect waits for them, the
+            # pool reads this stream's ring so it is started per sample and
+            # the model loaded again, unlike the shared in-process detector
+
+            self.pool = DetectorPool(
+                self.ring, self.workers, self.useGPU, self.settings, self.tiles
+            ).start()
 
-            load_model(self)
-            detect_thread = Thread(target=self.detect, daemon=True)
-            detect_thread.start()
+            self.threads.append(Thread(target=self.dispatch, daemon=True))
+            self.threads.append(Thread(target=self.collect, daemon=True))
+
+        elif self.detection or self.tracking:
+            self.threads.append(Thread(target=self.detect, daemon=True))
 
         # Create and track threads
-        read_thread = Thread(target=self.read, daemon=True)
-        read_thread.start()
+        self.threads.append(Thread(target=self.read, daemon=True))
+
+        for thread in self.threads:
+            thread.start()
+
+        if self.indexing:
+            Thread(target=self.build_index, daemon=True).start()
 
         return self
 
-    def read(self):
-        while True:
+    def load_detector(self):
+        # the model is loaded once per process, usually in the background
+        # while the app starts, the first frames wait here if it is still
+        # loading
+
+        start = time.perf_counter()
+
+        detector = shared_detector(self.useGPU, self.settings)
+
+        while not detector.ready.wait(self.timeout):
             if self.stopped:
-                sys.stdout.write("Stopped reads\n")
-                sys.stdout.flush()
+                return
 
-                break
+        try:
+            self.detector = detector.wait()
+        except RuntimeError as e:
+            # play on without detections rather than wait for them forever
 
-            if not self.Q.full():
-                with self.lock:
-                    ret, frame = self.stream.read()
+            self.error = str(e)
 
-                    frame_time = self.stream.get(cv2.CAP_PROP_POS_MSEC)
+            print(f"\n{e}")
 
-                    if not ret:
-                        print(
-                            f"Error: Unable to read frame from video file {self.path}"
-                        )
+            return
+
+        self.stats.set(
+            "model",
+            f"loaded in {self.detector.load_seconds:.2f} s, "
+            f"waited {time.perf_counter() - start:.2f} s",
+        )
+
+    def load_pool(self, timeout=120):
+        # the workers load their models while the first frames are decoded,
+        # if one fails every batch fails with its error
+
+        start = time.perf_counter()
+
+        try:
+            while not self.pool.wait(self.timeout):
+                if self.stopped:
+                    return
+
+                if time.perf_counter() - start > timeout:
+                    raise RuntimeError("Detector workers timed out loading the model")
+        except RuntimeError as e:
+            self.pool_error = str(e)
+
+            return
+
+        self.stats.set(
+            "model", f"workers loaded in {time.perf_counter() - start:.2f} s"
+        )
+
+    def put(self, queue, item):
+        # block until there is room, give up if stopped or the frame went stale
+
+        while not self.stopped and item[2] == self.generation:
+            try:
+                queue.put(item, timeout=self.timeout)
+
+                return True
+
+            except Full:
+                continue
+
+        return False
+
+    def get(self, queue):
+        # block until an item arrives, give up if stopped
 
-                        self.stop()
+        while not self.stopped:
+            try:
+                return queue.get(timeout=self.timeout)
 
+            except Empty:
+                continue
+
+        return None
+
+    def read(self):
+        if self.detection or self.tracking:
+            out_Q = self.detect_Q
+        else:
+            out_Q = self.Q
+
+        while not self.stopped:
+            # wait for a free slot, this is where backpressure kicks in
+
+            with self.stats.time("ring_wait"):
+                slot = self.ring.acquire(timeout=self.timeout)
+
+            if slot is None:
+                continue
+
+            with self.lock:
+                if self.target is not None:
+                    self.goto(self.target)
+
+                    self.target = None
+
+                start = time.perf_counter()
+
+                generation = self.generation
+
+                # above 1x only every int(speed)th frame is shown, the ones in
+                # between are grabbed but never converted or detected on
+
+                ret = True
+
+                for _ in range(self.stride() - 1):
+                    ret = self.stream.grab()
+
+                    if not ret:
                         break
 
-                    if self.detection or self.tracking:
-                        self.detect_Q.put([frame, frame_time])
-                    else:
-                        self.Q.put([frame, frame_time])
+                    self.position += 1
+
+                    self.stats.drop("skipped")
+
+                # decode straight into the slot unless it needs scaling
+
+                frame = self.ring[slot]
 
+                if ret:
+                    image = frame if self.decoded is None else self.decoded
+
+                    ret, _ = self.stream.read(image=image)
+
+                frame_time = self.stream.get(cv2.CAP_PROP_POS_MSEC)
+
+                if ret:
+                    self.position += 1
+
+            if not ret:
+                self.ring.release(slot)
+
+                # mark the end of the stream and wait for a seek or stop
+
+                self.put(out_Q, [None, frame_time, generation, self.position])
+
+                while generation == self.generation and not self.stopped:
+                    self.stop_event.wait(self.timeout)
+
+                continue
+
+            if self.decoded is not None:
+                cv2.resize(
+                    self.decoded,
+                    (self.display_width, self.display_height),
+                    dst=frame,
+                    interpolation=cv2.INTER_AREA,
+                )
+
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+
+            decode_time = time.perf_counter() - start
+
+            self.stats.record("decode", decode_time)
+
+            if self.decode_fps is None:
+                self.measure_decode(decode_time)
+
+            item = [slot, frame_time, generation, self.position - 1]
+
+            if not self.put(out_Q, item):
+                self.discard(slot, "stale")
+
+        print("\rStopped reads")
+
+    def next_batch(self):
+        # collect up to batch_size current frames, waiting at most batch_wait
+        # after the first one, an end of stream item closes the batch
+
+        batch = []
+        end = None
+        deadline = None
+
+        while len(batch) < self.batch_size and not self.stopped:
+            if deadline is None:
+                item = self.get(self.detect_Q)
             else:
-                time.sleep(10)
+                remaining = deadline - time.perf_counter()
+
+                if remaining <= 0:
+                    break
 
-                sys.stdout.write("\rQueue full")
-                sys.stdout.flush()
+                try:
+                    item = self.detect_Q.get(timeout=remaining)
+                except Empty:
+                    break
+
+            if item is None:
+                break
+
+            # drop stale frames, pass end of stream through after the batch
+
+            if item[0] is None:
+                end = item
+
+                break
+
+            if item[2] != self.generation:
+                self.discard(item[0], "stale")
 
                 continue
 
+            if deadline is None:
+                deadline = time.perf_counter() + self.batch_wait
+
+            batch.append(item)
+
+        return batch, end
+
     def detect(self):
+        self.stats.set("detect_batch", self.batch_size)
+
+        self.load_detector()
+
         # get frames from the queue
-        while True:
-            if self.stopped:
-                sys.stdout.write("Stopped detection\n")
-                sys.stdout.flush()
+        while not self.stopped:
+            batch, end = self.next_batch()
 
-                break
+            if batch:
+                # only frames without cached detections go through the model,
+                # in one forward pass timed per frame, without a model the
+                # last boxes are kept
+
+                plan = self.plan(batch)
 
-            if not self.detect_Q.empty():
-                with self.lock:
-                    frame, frame_time = self.detect_Q.get()
+                if self.detector is None:
+                    plan = [CARRY if found is None else found for found in plan]
+                missing = [item for item, found in zip(batch, plan) if found is None]
 
-                    boxes, confidences = detect_fish(self, frame)
+                results = []
+                size = self.settings["input_size"]
 
-                    if self.tracking:
-                        self.Q.put(
-                            [track_fish(self, frame, boxes, confidences), frame_time]
+                start = time.perf_counter()
+
+                if missing:
+                    frames = [self.ring[item[0]] for item in missing]
+
+                    try:
+                        results, size = self.detector.detect(
+                            frames, rgb=True, tiles=self.tiles
                         )
+                    except Exception as e:
+                        plan = self.detect_failed(plan, repr(e))
+
+                    if self.detector.tuner is not None:
+                        self.stats.set("input_size", self.detector.tuner.report())
+
+                # detections made at a size picked by the tuner are not saved,
+                # they would be replayed as if made at the configured size
+
+                self.finish(
+                    batch,
+                    plan,
+                    results,
+                    time.perf_counter() - start,
+                    save=size == self.settings["input_size"],
+                )
 
+            if end is not None:
+                self.put(self.Q, end)
+
+        print("\rStopped detection")
+
+    def dispatch(self):
+        # hand batches to the worker pool, keeping their order for collect
+
+        self.stats.set("detect_batch", self.batch_size)
+        self.stats.set("detect_workers", len(self.pool))
+
+        key = 0
+
+        while not self.stopped:
+            batch, end = self.next_batch()
+
+            if batch:
+                plan = self.plan(batch)
+                missing = [item[0] for item, found in zip(batch, plan) if found is None]
+
+                self.pending.append((key, batch, plan, end))
+
+                if missing and self.pool_error is None:
+                    self.pool.submit(key, batch[0][2], missing)
+                elif missing:
+                    self.detected[key] = (self.pool_error, 0)
+                else:
+                    self.detected[key] = ([], 0)
+
+                key += 1
+
+            elif end is not None:
+                self.pending.append((None, batch, [], end))
+
+        print("\rStopped dispatch")
+
+    def collect(self):
+        # gather worker results and pass them on in frame order, a batch waits
+        # until every batch dispatched before it is done
+
+        self.load_pool()
+
+        while not self.stopped:
+            if self.pool_error is None:
+                result = self.pool.result(timeout=self.timeout)
+
+                if result is not None:
+                    key, detections, seconds = result
+
+                    self.detected[key] = (detections, seconds)
+            else:
+                self.stop_event.wait(self.timeout)
+
+            while self.pending:
+                key, batch, plan, end = self.pending[0]
+
+                # batches handed to the workers before they were known to
+                # have failed never come back
+
+                if batch and key not in self.detected and self.pool_error:
+                    self.detected[key] = (self.pool_error, 0)
+
+                if batch and key not in self.detected:
+                    break
+
+                self.pending.popleft()
+
+                if batch:
+                    detections, seconds = self.detected.pop(key)
+
+                    if detections is None:
+                        for item in batch:
+                            self.discard(item[0], "stale")
+                    elif isinstance(detections, str):
+                        plan = self.detect_failed(plan, detections)
+
+                        self.finish(batch, plan, [], seconds)
                     else:
-                        self.Q.put(
-                            [draw_fish(self, frame, boxes, confidences), frame_time]
-                        )
+                        self.finish(batch, plan, detections, seconds)
+
+                if end is not None:
+                    self.put(self.Q, end)
+
+        print("\rStopped collection")
+
+    def plan(self, batch):
+        # per frame the detections saved earlier, None to run the model, or
+        # CARRY to keep the last boxes going
+
+        plan = []
+
+        detections = self.load_detections()
+
+        for item in batch:
+            found = None
+
+            if detections is not None:
+                found = detections.get(item[3])
+
+            if found is None:
+                # a seek starts the cadence and the gate over
+
+                if item[2] != self.cadence_generation:
+                    self.cadence.reset()
+                    self.gate.reset()
+                    self.cadence_generation = item[2]
+
+                reason = self.due(self.ring[item[0]])
+
+                if reason is None:
+                    found = CARRY
+
+                self.stats.count(f"detect_{reason or 'carried'}")
+
+            plan.append(found)
+
+        return plan
+
+    def detect_failed(self, plan, error):
+        # the frames the model failed on keep the last boxes and playback
+        # goes on, the error is shown by the UI and printed once
+
+        self.stats.count("detect_failed", sum(found is None for found in plan))
+
+        error = f"Detection failed: {error}"
 
+        if error != self.error:
+            self.error = error
+
+            print(f"\n{error}")
+
+        return [CARRY if found is None else found for found in plan]
+
+    def due(self, frame):
+        # reason to run the detector on a frame, None to carry the last boxes
+
+        if self.cadence.every == 1 and not self.gate.enabled:
+            return "interval"
+
+        with self.stats.time("motion"):
+            grey = shrink(frame)
+
+            reason = self.cadence.due(grey, self.lost)
+
+            if reason is None or not self.gate.enabled:
+                return reason
+
+            if self.gate.is_static(grey):
+                self.stats.count("detect_static")
+
+                return None
+
+            self.gate.detected(grey)
+
+        return reason
+
+    def finish(self, batch, plan, results, seconds, save=True):
+        # fill in the frames the model ran on and save them unless told not
+        # to, then track or draw on the slots in place, in frame order for
+        # the trackers
+
+        results = iter(results)
+        computed = sum(found is None for found in plan)
+
+        for item, detections in zip(batch, plan):
+            if detections is None:
+                detections = next(results)
+
+                self.stats.record("detect", seconds / computed)
+
+                # the cache is only there once frame numbers are exact, a
+                # new index bumps the generation before setting it so it is
+                # read first
+
+                cache = self.detections
+
+                if save and cache is not None and item[2] == self.generation:
+                    cache.add(item[3], *detections)
+
+            # between detections the trackers carry the fish, without them
+            # the last boxes are drawn again
+
+            if detections is CARRY:
+                detections = None if self.tracking else self.last_detections
             else:
-                time.sleep(10)
+                self.last_detections = detections
+
+            boxes, confidences, class_ids = (
+                (None, None, None) if detections is None else detections
+            )
+
+            frame = self.ring[item[0]]
+
+            with self.track_lock:
+                start = time.perf_counter()
+
+                if self.tracking:
+                    self.reset_tracks(item[2])
+
+                    tracks = track_fish(self, frame, boxes, confidences, class_ids)
+
+                    # frame numbers are only exact once the seek index is
+                    # there, like for saved detections
+
+                    if (
+                        self.trajectories is not None
+                        and self.index is not None
+                        and item[2] == self.generation
+                    ):
+                        self.trajectories.add(item[3], *tracks)
+                else:
+                    draw_fish(self, frame, boxes, confidences, class_ids)
+
+                elapsed = time.perf_counter() - start
+                self.track_ms = elapsed * 1000
+
+                self.stats.record("track" if self.tracking else "draw", elapsed)
+
+            if not self.put(self.Q, item):
+                self.discard(item[0], "stale")
+
+        # detector time saved is estimated from its mean time per frame
+
+        if self.gate.checked > 0:
+            self.stats.set(
+                "motion_gate",
+                f"{self.gate.static}/{self.gate.checked} frames static "
+                f"({self.gate.static / self.gate.checked:.0%}), "
+                f"~{self.gate.static * self.stats.mean('detect'):.0f} ms saved",
+            )
+
+        if self.tracking:
+            self.stats.set(
+                "tracks",
+                f"{len(self.tracker)} live, {self.tracker.next_id - 1} started",
+            )
+
+        if self.detections is not None:
+            self.stats.set(
+                "detection_cache",
+                f"{self.detections.hits} hits, {self.detections.misses} misses",
+            )
+
+    def reset_tracks(self, generation):
+        # fish tracked before a seek are not carried over
+
+        if generation == self.track_generation:
+            return
+
+        self.track_generation = generation
+        self.tracker.reset()
+
+    def get_frame(self):
+        # next frame to display, None if nothing is buffered yet
+        #
+        # the returned array is a view into the ring and stays valid until the
+        # next call, when its slot is handed back to the reader, frames
+        # replayed from the cache are copies so drawing on them leaves the
+        # cache as it was
+
+        if self.replay is not None:
+            frame = self.get_cached()
+
+            if frame is not None:
+                return frame
+
+        while True:
+            try:
+                slot, frame_time, generation, frame_index = self.Q.get_nowait()
 
-                sys.stdout.write("\rDetect queue empty")
-                sys.stdout.flush()
+            except Empty:
+                return None
+
+            if slot is None:
+                if generation == self.generation:
+                    self.ended = True
+
+                    return None
+
+                continue
+
+            # frame decoded before the last seek
+
+            if generation != self.generation:
+                self.discard(slot, "stale")
 
                 continue
 
+            self.ring.release(self.held)
+            self.held = slot
+
+            self.frame_time = frame_time
+            self.frame_index = frame_index
+
+            if self.cache is not None:
+                self.cache.put(frame_index, self.ring[slot])
+
+            return self.ring[slot]
+
+    def get_cached(self):
+        # serve the replay from the cache until the decoder takes over
+
+        frame = None
+
+        if self.replay < self.resume:
+            frame = self.cache.get(self.replay)
+
+        if frame is None:
+            self.replay = None
+
+            return None
+
+        self.ring.release(self.held)
+        self.held = None
+
+        self.frame_index = self.replay
+        self.frame_time = float(self.index.msec[self.replay])
+        self.replay += 1
+
+        return frame.copy()
+
+    def flush(self):
+        # drop everything buffered in the pipeline
+
+        queues = [self.Q]
+
+        if self.detection or self.tracking:
+            queues.append(self.detect_Q)
+
+        for queue in queues:
+            while True:
+                try:
+                    slot, *_ = queue.get_nowait()
+                except Empty:
+                    break
+
+                if slot is not None:
+                    self.discard(slot, "flushed")
+
+    def discard(self, slot, reason):
+        self.ring.release(slot)
+        self.stats.drop(reason)
+
+    def sample_depths(self):
+        # queue depths for the stats, sampled by the UI timer
+
+        depths = {"display": self.Q.qsize(), "free_slots": self.ring.available()}
+
+        if self.detection or self.tracking:
+            depths["detect"] = self.detect_Q.qsize()
+
+        if self.pool is not None:
+            depths["in_flight"] = len(self.pending)
+
+        # live tracks and the cost of tracking them next to the queues, to
+        # check it stays flat over long videos
+
+        if self.tracking:
+            depths["tracks"] = len(self.tracker)
+            depths["track_ms"] = round(self.track_ms, 2)
+
+        self.stats.sample(**depths)
+
     def stop(self):
         # set stop state
 
-        self.stopped = True
+        self.stop_event.set()
+
+        # wait for the stages to notice
+
+        for thread in self.threads:
+            if thread is not current_thread():
+                thread.join()
 
         # Release resources
-        self.stream.release()
+        with self.lock:
+            self.stream.release()
+
+        if self.source is not None:
+            self.source.release()
+
+        if self.pool is not None:
+            self.pool.stop()
 
-        if self.detection:
-            self.detect_Q.queue.clear()
+        if self.detections is not None:
+            self.detections.flush()
+
+        if self.trajectories is not None:
+            self.trajectories.flush()
 
         # Clear queue
-        with self.lock:
-            while not self.Q.empty():
-                self.Q.get()
+        self.flush()
+
+        self.ring.close()
 
         print("\rQueue cleared")
 
         return
 
+    def measure_decode(self, seconds, frames=100):
+        self.decode_frames += 1
+        self.decode_time += seconds
+
+        if self.decode_frames == frames:
+            self.decode_fps = frames * self.stride() / self.decode_time
+
+            info = self.codec_info
+
+            self.stats.set("decoder", {**info, **self.decoder_options})
+            self.stats.set("decode_fps", round(self.decode_fps, 1))
+
+            print(
+                f"\rDecoding {info['codec']} {info['width']}x{info['height']} "
+                f"with {self.decoder_options.get('threads')} threads: "
+                f"{self.decode_fps:.0f} fps"
+            )
+
+    def stride(self):
+        # frames advanced per frame shown
+
+        return int(self.speed) if self.speed > 1 else 1
+
+    def set_speed(self, speed):
+        # frames already buffered were decoded at the old stride, so restart
+        # decoding from the frame on screen when the stride changes
+
+        stride = self.stride()
+
+        self.speed = speed
+
+        if self.stride() != stride:
+            self.seek(self.frame_time)
+
+    def full_frame(self):
+        # full resolution BGR copy of the frame on screen, for saving images
+
+        if self.source is None:
+            self.source = open_capture(self.path, self.decoder_options)
+
+        if self.index is not None:
+            frame = self.index.seek(self.source, self.frame_index, self.source_position)
+
+            self.source_position = frame + 1
+        else:
+            self.source.set(cv2.CAP_PROP_POS_MSEC, self.frame_time)
+
+        ret, image = self.source.read()
+
+        if not ret:
+            self.source_position = None
+
+            return None
+
+        return image
+
+    def to_source(self, x, y):
+        # map display pixel coordinates to source pixel coordinates
+
+        x = int(np.clip(round(x / self.scale), 0, self.width - 1))
+        y = int(np.clip(round(y / self.scale), 0, self.height - 1))
+
+        return x, y
+
+    def goto(self, msec):
+        # position the capture, called by the reader with the lock held
+
+        start = time.perf_counter()
+
+        if self.index is not None:
+            frame = self.index.frame_at(msec)
+
+            self.position = self.index.seek(self.stream, frame, self.position)
+        else:
+            self.stream.set(cv2.CAP_PROP_POS_MSEC, msec)
+
+            self.position = int(self.stream.get(cv2.CAP_PROP_POS_FRAMES))
+            self.exact = False
+
+        self.seek_time = time.perf_counter() - start
+
+        self.stats.record("seek", self.seek_time)
+
+    def seek(self, msec):
+        # ask the reader to move and discard frames decoded before the seek
+
+        with self.lock:
+            self.move(msec)
+
+        return
+
+    def move(self, msec):
+        # seek with the lock held
+
+        self.generation += 1
+        self.ended = False
+
+        if self.pool is not None:
+            self.pool.generation.value = self.generation
+        self.replay = None
+
+        msec = max(0, msec)
+
+        # if the target is cached replay from memory and have the decoder
+        # pick up after the cached run
+
+        if self.cache is not None:
+            frame = self.index.frame_at(msec)
+
+            if frame in self.cache:
+                self.replay = frame
+                self.resume = self.cache.run(frame)
+
+                resume = min(self.resume, self.index.frame_count - 1)
+                msec = float(self.index.msec[resume])
+            else:
+                self.cache.misses += 1
+
+        self.target = msec
+
+        self.flush()
+
     def skip(self, seconds):
         # skip seconds
 
-        self.stream.set(
-            cv2.CAP_PROP_POS_MSEC,
-            self.frame_time + seconds * 1000,
-        )
+        self.seek(self.frame_time + seconds * 1000)
 
         return
@@ -0,0 +1,660 @@
+# SORT style multi-object tracking of detected fish, every track is a
+# constant velocity Kalman filter on its box, all tracks are predicted and
+# corrected at once and detections are matched to tracks by IoU with an
+# optimal one-to-one assignment (https://arxiv.org/abs/1602.00763)
+#
+# TrackManager keeps the same books for OpenCV appearance trackers, one per
+# fish, updated over a shared thread pool
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import numpy as np
+
+# scipy's assignment solver is used when it is installed
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+# overlap a detection needs with a track's predicted or tracked box to
+# continue it
+
+IOU_THRESHOLD = 0.3
+
+# frames a track is kept going without a matching detection
+
+MAX_AGE = 30
+
+# failed updates in a row after which an appearance tracker is dropped
+
+MAX_MISSES = 5
+
+# overlap with its matched detection below which an appearance tracker is
+# started again from the detection, they drift a little every frame
+
+RESEED_IOU = 0.8
+
+# most tracks kept alive at once, the ones seen longest ago go first
+
+MAX_TRACKS = 256
+
+# Kalman noise relative to the box size, as in BoT-SORT
+
+POSITION_NOISE = 1 / 20
+VELOCITY_NOISE = 1 / 160
+
+
+def iou_matrix(a, b):
+    # IoU of every box in a with every box in b, both (x, y, w, h)
+
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+
+    ax1, ay1, aw, ah = (column[:, None] for column in a.T)
+    bx1, by1, bw, bh = b.T
+
+    inter_w = np.minimum(ax1 + aw, bx1 + bw) - np.maximum(ax1, bx1)
+    inter_h = np.minimum(ay1 + ah, by1 + bh) - np.maximum(ay1, by1)
+    inter = np.maximum(inter_w, 0) * np.maximum(inter_h, 0)
+
+    union = aw * ah + bw * bh - inter
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union > 0, inter / union, 0.0)
+
+
+def hungarian(cost):
+    # minimum cost assignment of rows to columns, shortest augmenting paths
+    # with row and column potentials, the inner loop is vectorised over the
+    # columns
+
+    transposed = cost.shape[0] > cost.shape[1]
+
+    if transposed:
+        cost = cost.T
+
+    rows, columns = cost.shape
+
+    u = np.zeros(rows + 1)
+    v = np.zeros(columns + 1)
+
+    # row matched to each column, 1 based with 0 for none, column 0 holds
+    # the row being added
+
+    match = np.zeros(columns + 1, dtype=np.int64)
+    way = np.zeros(columns + 1, dtype=np.int64)
+
+    for row in range(1, rows + 1):
+        match[0] = row
+        column = 0
+
+        best = np.full(columns + 1, np.inf)
+        used = np.zeros(columns + 1, dtype=bool)
+
+        while True:
+            used[column] = True
+
+            current = np.full(columns + 1, np.inf)
+            current[1:] = cost[match[column] - 1] - u[match[column]] - v[1:]
+
+            free = ~used
+            better = free & (current < best)
+
+            best[better] = current[better]
+            way[better] = column
+
+            candidates = np.where(free, best, np.inf)
+            next_column = int(np.argmin(candidates))
+            delta = candidates[next_column]
+
+            u[match[used]] += delta
+            v[used] -= delta
+            best[free] -= delta
+
+            column = next_column
+
+            if match[column] == 0:
+                break
+
+        # flip the matches along the path back to column 0
+
+        while column != 0:
+            previous = way[column]
+            match[column] = match[previous]
+            column = previous
+
+    matched = np.flatnonzero(match[1:])
+
+    pairs = (match[1:][matched] - 1, matched)
+
+    if transposed:
+        pairs = pairs[::-1]
+
+    order = np.argsort(pairs[0])
+
+    return pairs[0][order], pairs[1][order]
+
+
+def linear_assignment(cost):
+    if linear_sum_assignment is not None:
+        return linear_sum_assignment(cost)
+
+    return hungarian(cost)
+
+
+def components(linked):
+    # connected groups of rows and columns in a boolean matrix, as lists of
+    # (rows, columns)
+
+    rows, columns = linked.shape
+
+    parent = list(range(rows + columns))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+
+        return node
+
+    for row, column in zip(*np.nonzero(linked)):
+        parent[find(int(row))] = find(rows + int(column))
+
+    groups = {}
+
+    for node in range(rows + columns):
+        groups.setdefault(find(node), []).append(node)
+
+    return [
+        (
+            np.array([node for node in group if node < rows], dtype=np.int64),
+            np.array([node - rows for node in group if node >= rows], dtype=np.int64),
+        )
+        for group in groups.values()
+    ]
+
+
+def assign(iou, threshold=IOU_THRESHOLD):
+    # one-to-one matches between rows and columns that maximise the total
+    # IoU, pairs below the threshold are never matched
+    #
+    # only pairs above the threshold can be matched, so the problem splits
+    # into small independent ones where fish are far apart
+
+    linked = iou >= threshold
+
+    # pairs that only overlap each other are matched straight away
+
+    rows, columns = np.nonzero(linked)
+
+    single = (linked.sum(axis=1)[rows] == 1) & (linked.sum(axis=0)[columns] == 1)
+
+    matches = [(rows[single], columns[single])]
+
+    rows = np.unique(rows[~single])
+    columns = np.unique(columns[~single])
+
+    for group_rows, group_columns in components(linked[np.ix_(rows, columns)]):
+        if len(group_rows) == 0 or len(group_columns) == 0:
+            continue
+
+        group_rows, group_columns = rows[group_rows], columns[group_columns]
+
+        part = iou[np.ix_(group_rows, group_columns)]
+
+        r, c = linear_assignment(1 - part)
+
+        keep = part[r, c] >= threshold
+
+        matches.append((group_rows[r[keep]], group_columns[c[keep]]))
+
+    rows = np.concatenate([rows for rows, _ in matches])
+    columns = np.concatenate([columns for _, columns in matches])
+
+    order = np.argsort(rows)
+
+    return rows[order], columns[order]
+
+
+# thread pools by size, shared by every sample's trackers
+
+pools = {}
+pools_lock = Lock()
+
+
+def thread_pool(threads):
+    with pools_lock:
+        if threads not in pools:
+            pools[threads] = ThreadPoolExecutor(threads, "tracker")
+
+        return pools[threads]
+
+
+def capped(since, max_tracks):
+    # which tracks to keep under the cap, the most recently seen, earlier
+    # tracks first when tied
+
+    keep = np.ones(len(since), dtype=bool)
+
+    if len(since) > max_tracks:
+        keep[:] = False
+        keep[np.argsort(since, kind="stable")[:max_tracks]] = True
+
+    return keep
+
+
+def scores(boxes, confidences):
+    # confidences of the detections as floats, unknown ones are nan
+
+    if confidences is None:
+        return np.full(len(boxes), np.nan)
+
+    return np.asarray(confidences, dtype=np.float64).reshape(-1)
+
+
+def labels(boxes, class_ids):
+    # class ids of the detections, the first class if not given
+
+    if class_ids is None:
+        return np.zeros(len(boxes), dtype=np.int64)
+
+    return np.asarray(class_ids, dtype=np.int64).reshape(-1)
+
+
+# constant velocity model on centre and size, the state is
+# (cx, cy, w, h, vcx, vcy, vw, vh)
+
+TRANSITION = np.eye(8)
+TRANSITION[:4, 4:] = np.eye(4)
+
+
+def box_noise(sizes, weights):
+    # variances scaled by box width and height, 4 per weight for each box
+
+    w, h = sizes[:, 0:1], sizes[:, 1:2]
+
+    std = np.hstack([np.hstack([w, h, w, h]) * weight for weight in weights])
+
+    return std**2
+
+
+class SortTracker:
+    def __init__(
+        self, iou_threshold=IOU_THRESHOLD, max_age=MAX_AGE, max_tracks=MAX_TRACKS
+    ):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.max_tracks = max_tracks
+
+        self.states = np.zeros((0, 8))
+        self.covariances = np.zeros((0, 8, 8))
+
+        self.ids = np.zeros(0, dtype=np.int64)
+
+        # detections matched to each track, frames since it last matched one
+        # and whether it went unmatched on the last frame detected on
+
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.since = np.zeros(0, dtype=np.int64)
+        self.missed = np.zeros(0, dtype=bool)
+
+        # confidence of the detection each track matched on this frame, nan
+        # when it wasn't detected on, and the class it was last detected as
+
+        self.confidences = np.zeros(0)
+        self.class_ids = np.zeros(0, dtype=np.int64)
+
+        self.next_id = 1
+
+        # share of the tracks matched on the detection before last that the
+        # last one missed, a reason to detect again, tracks only end when
+        # detections stop matching them so none are lost in between
+
+        self.lost = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def reset(self):
+        # ids carry on so they stay unique within a video
+
+        next_id = self.next_id
+
+        self.__init__(self.iou_threshold, self.max_age, self.max_tracks)
+
+        self.next_id = next_id
+
+    def boxes(self):
+        # (x, y, w, h) of every track
+
+        centres, sizes = self.states[:, :2], np.maximum(self.states[:, 2:4], 1)
+
+        return np.hstack([centres - sizes / 2, sizes])
+
+    def predict(self):
+        sizes = np.maximum(self.states[:, 2:4], 1)
+        noise = box_noise(sizes, [POSITION_NOISE, VELOCITY_NOISE])
+
+        self.states = self.states @ TRANSITION.T
+        self.covariances = TRANSITION @ self.covariances @ TRANSITION.T
+
+        self.covariances += noise[:, :, None] * np.eye(8)
+
+        self.since += 1
+
+    def correct(self, tracks, boxes):
+        # Kalman update of the given tracks with their matched boxes
+
+        measured = np.hstack([boxes[:, :2] + boxes[:, 2:] / 2, boxes[:, 2:]])
+
+        covariances = self.covariances[tracks]
+
+        innovation = covariances[:, :4, :4] + box_noise(boxes[:, 2:], [POSITION_NOISE])[
+            :, :, None
+        ] * np.eye(4)
+
+        # gain = P H' S^-1, solved rather than inverted
+
+        cross = covariances[:, :, :4]
+        gain = np.linalg.solve(innovation, cross.transpose(0, 2, 1)).transpose(0, 2, 1)
+
+        residual = measured - self.states[tracks, :4]
+
+        self.states[tracks] += (gain @ residual[:, :, None])[:, :, 0]
+        self.covariances[tracks] = covariances - gain @ covariances[:, :4, :]
+
+    def add(self, boxes, confidences, class_ids):
+        count = len(boxes)
+
+        states = np.zeros((count, 8))
+        states[:, :2] = boxes[:, :2] + boxes[:, 2:] / 2
+        states[:, 2:4] = boxes[:, 2:]
+
+        noise = box_noise(boxes[:, 2:], [2 * POSITION_NOISE, 10 * VELOCITY_NOISE])
+
+        self.states = np.vstack([self.states, states])
+        self.covariances = np.concatenate(
+            [self.covariances, noise[:, :, None] * np.eye(8)]
+        )
+
+        self.ids = np.concatenate(
+            [self.ids, np.arange(self.next_id, self.next_id + count)]
+        )
+        self.hits = np.concatenate([self.hits, np.ones(count, dtype=np.int64)])
+        self.since = np.concatenate([self.since, np.zeros(count, dtype=np.int64)])
+        self.missed = np.concatenate([self.missed, np.zeros(count, dtype=bool)])
+        self.confidences = np.concatenate([self.confidences, confidences])
+        self.class_ids = np.concatenate([self.class_ids, class_ids])
+
+        self.next_id += count
+
+    def keep(self, mask):
+        self.states = self.states[mask]
+        self.covariances = self.covariances[mask]
+        self.ids = self.ids[mask]
+        self.hits = self.hits[mask]
+        self.since = self.since[mask]
+        self.missed = self.missed[mask]
+        self.confidences = self.confidences[mask]
+        self.class_ids = self.class_ids[mask]
+
+    def update(self, boxes=None, confidences=None, class_ids=None):
+        # move every track on a frame, then match and correct them with the
+        # detections if the detector ran on it, returns the ids, boxes,
+        # confidences and class ids of the tracks matched on the last frame
+        # detected on
+
+        self.predict()
+
+        self.confidences[:] = np.nan
+
+        if boxes is not None:
+            boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+            confidences = scores(boxes, confidences)
+            class_ids = labels(boxes, class_ids)
+
+            detections, tracks = assign(
+                iou_matrix(boxes, self.boxes()), self.iou_threshold
+            )
+
+            self.correct(tracks, boxes[detections])
+
+            self.hits[tracks] += 1
+            self.since[tracks] = 0
+            self.confidences[tracks] = confidences[detections]
+            self.class_ids[tracks] = class_ids[detections]
+
+            seen = ~self.missed
+
+            self.missed[:] = True
+            self.missed[tracks] = False
+
+            self.lost = (seen & self.missed).mean() if len(self) else 0
+
+            # tracks not seen for too long are dropped, unmatched detections
+            # start new ones
+
+            self.keep(self.since <= self.max_age)
+
+            new = np.ones(len(boxes), dtype=bool)
+            new[detections] = False
+
+            self.add(boxes[new], confidences[new], class_ids[new])
+            self.keep(capped(self.since, self.max_tracks))
+
+        shown = ~self.missed
+
+        return (
+            self.ids[shown],
+            self.boxes()[shown],
+            self.confidences[shown],
+            self.class_ids[shown],
+        )
+
+
+class TrackManager:
+    # one OpenCV appearance tracker per fish, made by create(), with stable
+    # ids and the same pruning as SortTracker
+
+    def __init__(
+        self,
+        create,
+        iou_threshold=IOU_THRESHOLD,
+        max_age=MAX_AGE,
+        max_misses=MAX_MISSES,
+        max_tracks=MAX_TRACKS,
+        threads=1,
+        reseed_iou=RESEED_IOU,
+    ):
+        self.create = create
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.max_misses = max_misses
+        self.max_tracks = max_tracks
+        self.threads = threads
+        self.reseed_iou = reseed_iou
+
+        # OpenCV lets go of the GIL while a tracker updates, so trackers
+        # update in parallel
+
+        self.pool = thread_pool(threads) if threads > 1 else None
+
+        self.trackers = []
+        self.tracked = np.zeros((0, 4))
+
+        # box of the detection each track last matched, appearance trackers
+        # can jump off a fish from one frame to the next
+
+        self.seen = np.zeros((0, 4))
+
+        self.ids = np.zeros(0, dtype=np.int64)
+
+        # detections matched to each track, detector runs since it last
+        # matched one and failed updates in a row, the tracker carries the
+        # fish in between so frames without detections don't age it
+
+        self.hits = np.zeros(0, dtype=np.int64)
+        self.since = np.zeros(0, dtype=np.int64)
+        self.misses = np.zeros(0, dtype=np.int64)
+
+        # confidence of the detection each track matched on this frame, nan
+        # when it wasn't detected on, and the class it was last detected as
+
+        self.confidences = np.zeros(0)
+        self.class_ids = np.zeros(0, dtype=np.int64)
+
+        self.next_id = 1
+
+        # share of trackers that failed on the last frame, a reason to
+        # detect again
+
+        self.lost = 0
+
+    def __len__(self):
+        return len(self.trackers)
+
+    def reset(self):
+        # ids carry on so they stay unique within a video
+
+        next_id = self.next_id
+
+        self.__init__(
+            self.create,
+            self.iou_threshold,
+            self.max_age,
+            self.max_misses,
+            self.max_tracks,
+            self.threads,
+            self.reseed_iou,
+        )
+
+        self.next_id = next_id
+
+    def map(self, call, items):
+        # call on every item, over the pool when there is more than one,
+        # results come back in order
+
+        if self.pool is not None and len(items) > 1:
+            return list(self.pool.map(call, items))
+
+        return [call(item) for item in items]
+
+    def start(self, frame, boxes):
+        # new trackers following the boxes from the frame
+
+        trackers = [self.create() for _ in boxes]
+
+        self.map(
+            lambda pair: pair[0].init(frame, tuple(int(i) for i in pair[1])),
+            list(zip(trackers, boxes)),
+        )
+
+        return trackers
+
+    def add(self, frame, boxes, confidences, class_ids):
+        self.trackers += self.start(frame, boxes)
+
+        count = len(boxes)
+
+        self.tracked = np.vstack([self.tracked, boxes])
+        self.seen = np.vstack([self.seen, boxes])
+        self.ids = np.concatenate(
+            [self.ids, np.arange(self.next_id, self.next_id + count)]
+        )
+        self.hits = np.concatenate([self.hits, np.ones(count, dtype=np.int64)])
+        self.since = np.concatenate([self.since, np.zeros(count, dtype=np.int64)])
+        self.misses = np.concatenate([self.misses, np.zeros(count, dtype=np.int64)])
+        self.confidences = np.concatenate([self.confidences, confidences])
+        self.class_ids = np.concatenate([self.class_ids, class_ids])
+
+        self.next_id += count
+
+    def keep(self, mask):
+        self.trackers = [tracker for tracker, kept in zip(self.trackers, mask) if kept]
+        self.tracked = self.tracked[mask]
+        self.seen = self.seen[mask]
+        self.ids = self.ids[mask]
+        self.hits = self.hits[mask]
+        self.since = self.since[mask]
+        self.misses = self.misses[mask]
+        self.confidences = self.confidences[mask]
+        self.class_ids = self.class_ids[mask]
+
+    def update(self, frame, boxes=None, confidences=None, class_ids=None):
+        # move every tracker on to the frame, then start trackers for the
+        # detections no tracker follows if the detector ran on it, returns
+        # the ids, boxes, confidences and class ids of the trackers that
+        # found their fish
+
+        updates = self.map(lambda tracker: tracker.update(frame), self.trackers)
+
+        for i, (success, box) in enumerate(updates):
+            if success:
+                self.tracked[i] = box
+                self.misses[i] = 0
+            else:
+                self.misses[i] += 1
+
+        failed = self.misses > 0
+
+        self.lost = failed.mean() if len(self) else 0
+
+        self.confidences[:] = np.nan
+
+        if boxes is not None:
+            boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+            confidences = scores(boxes, confidences)
+            class_ids = labels(boxes, class_ids)
+
+            self.since += 1
+
+            # each detection continues at most one tracked fish and the other
+            # way round, on the overlap with where the tracker or the detector
+            # last saw it, so trackers that failed or jumped still match
+
+            tracked = iou_matrix(boxes, self.tracked)
+
+            detections, tracks = assign(
+                np.maximum(tracked, iou_matrix(boxes, self.seen)), self.iou_threshold
+            )
+
+            # trackers that failed or drifted off their fish start again from
+            # the detection they matched, keeping their ids, the others carry
+            # on from where the detector saw the fish
+
+            drifted = tracked[detections, tracks] < self.reseed_iou
+            restart = failed[tracks] | drifted
+            lost = tracks[restart]
+
+            for i, tracker in zip(lost, self.start(frame, boxes[detections[restart]])):
+                self.trackers[i] = tracker
+
+            self.tracked[tracks] = boxes[detections]
+            self.seen[tracks] = boxes[detections]
+            self.misses[lost] = 0
+
+            self.hits[tracks] += 1
+            self.since[tracks] = 0
+            self.confidences[tracks] = confidences[detections]
+            self.class_ids[tracks] = class_ids[detections]
+
+            new = np.ones(len(boxes), dtype=bool)
+            new[detections] = False
+
+            self.add(frame, boxes[new], confidences[new], class_ids[new])
+
+        # trackers that keep failing or that no detection confirmed for too
+        # long are dropped
+
+        self.keep((self.misses <= self.max_misses) & (self.since <= self.max_age))
+        self.keep(capped(self.since, self.max_tracks))
+
+        shown = self.misses == 0
+
+        return (
+            self.ids[shown],
+            self.tracked[shown],
+            self.confidences[shown],
+            self.class_ids[shown],
+        )
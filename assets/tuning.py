@@ -0,0 +1,102 @@
+# picks the detection model's input size for a target frame rate, measured
+# on the machine it runs on
+
+import time
+from collections import deque
+import numpy as np
+
+# darknet input sizes to choose from, multiples of 32
+
+INPUT_SIZES = [192, 256, 320, 416, 512, 608]
+
+# timed forward passes per size when calibrating, after one to warm up
+
+CALIBRATION_PASSES = 3
+
+
+class InputSizeTuner:
+    def __init__(self, target_fps, sizes=INPUT_SIZES, window=30, tolerance=0.2):
+        self.target_fps = target_fps
+        self.budget = 1 / target_fps
+        self.sizes = sorted(sizes)
+        self.size = self.sizes[0]
+
+        # recent seconds per frame, the size changes when their median
+        # drifts more than tolerance from the budget
+
+        self.window = window
+        self.tolerance = tolerance
+        self.times = deque(maxlen=window)
+
+        # seconds per pass by size, from calibrating
+
+        self.calibration = {}
+        self.changes = 0
+
+    def calibrate(self, run):
+        # largest size whose forward pass fits the budget, run(size) does
+        # one pass at that size
+
+        for size in self.sizes:
+            run(size)
+
+            start = time.perf_counter()
+
+            for _ in range(CALIBRATION_PASSES):
+                run(size)
+
+            seconds = (time.perf_counter() - start) / CALIBRATION_PASSES
+
+            self.calibration[size] = seconds
+
+            # larger sizes only get slower, the smallest is kept regardless
+
+            if seconds > self.budget:
+                break
+
+            self.size = size
+
+        return self.size
+
+    def update(self, seconds):
+        # seconds per frame at the current size, returns the new size if it
+        # should change, None otherwise
+
+        self.times.append(seconds)
+
+        if len(self.times) < self.window:
+            return None
+
+        measured = float(np.median(self.times))
+        index = self.sizes.index(self.size)
+
+        if measured > self.budget * (1 + self.tolerance) and index > 0:
+            size = self.sizes[index - 1]
+        elif index + 1 < len(self.sizes):
+            # cost grows with the input area
+
+            larger = self.sizes[index + 1]
+            expected = measured * (larger / self.size) ** 2
+
+            if expected > self.budget * (1 - self.tolerance):
+                return None
+
+            size = larger
+        else:
+            return None
+
+        self.size = size
+        self.changes += 1
+        self.times.clear()
+
+        return size
+
+    def report(self):
+        calibration = ", ".join(
+            f"{size}: {1 / seconds:.0f}" for size, seconds in self.calibration.items()
+        )
+
+        return (
+            f"{self.size} px for {self.target_fps:g} fps, {self.changes} changes, "
+            f"calibrated fps by size {calibration}"
+        )
@@ -16,6 +16,8 @@ from assets.data import (
     record_behaviour,
 )
 from assets.stream import VideoStream
+from assets.metrics import PipelineStats
+from assets.store import track_path
 from assets.funcs import projectInit, projectDialog
 
 os.environ["QT_QPA_PLATFORM_PLUGIN_PATH"] = QLibraryInfo.location(
@@ -100,6 +102,40 @@ class samplePrompt(widgets.QDialog):
         self.setLayout(layout)
 
 
+class statsPanel(widgets.QDialog):
+    def __init__(self, video, parent=None):
+        super().__init__(parent)
+        self.video = video
+        self.setWindowTitle("Pipeline Stats")
+        self.setGeometry(400, 400, 600, 500)
+        layout = widgets.QVBoxLayout()
+        self.label = widgets.QLabel()
+        self.label.setFont(QFont("Monospace", 10))
+        self.label.setAlignment(Qt.AlignLeft | Qt.AlignTop)
+        layout.addWidget(self.label)
+        self.dump = widgets.QPushButton("Save")
+        self.dump.clicked.connect(self.save_stats)
+        layout.addWidget(self.dump)
+        self.setLayout(layout)
+
+        # refresh while open
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(500)
+        self.refresh()
+
+    def refresh(self):
+        self.label.setText(self.video.stats.report())
+
+    def save_stats(self):
+        file = widgets.QFileDialog.getSaveFileName(
+            self, "Save Stats", "stats.json", "JSON (*.json);;CSV (*.csv)"
+        )[0]
+        if file:
+            self.video.stats.dump(file)
+
+
 class VideoPane(QGraphicsView):
     def __init__(self, main_window):
         super().__init__()
@@ -118,6 +154,11 @@ class VideoPane(QGraphicsView):
         self.pt2 = None
         self.drawing = False
 
+        # pipeline stats for the whole session, shared by every stream
+
+        self.stats = PipelineStats()
+        self.last_tick = None
+
         self.setMouseTracking(True)
         self.setSizePolicy(widgets.QSizePolicy.Expanding, widgets.QSizePolicy.Expanding)
         self.adjustSize()
@@ -155,12 +196,14 @@ class VideoPane(QGraphicsView):
         self.status_label = widgets.QLabel()
         self.obs_label = widgets.QLabel()
         self.speed_label = widgets.QLabel()
+        self.cache_label = widgets.QLabel()
 
         status_layout.addWidget(self.cursor_label)
         status_layout.addWidget(self.time_label)
         status_layout.addWidget(self.status_label)
         status_layout.addWidget(self.obs_label)
         status_layout.addWidget(self.speed_label)
+        status_layout.addWidget(self.cache_label)
 
         self.status_bar.addPermanentWidget(status_widget)
 
@@ -230,8 +273,32 @@ class VideoPane(QGraphicsView):
                 useGPU=stream_properties["useGPU"],
                 detection=stream_properties["detection"],
                 tracking=stream_properties["tracking"],
+                buffer_mb=stream_properties["frame_buffer_mb"],
+                cache_mb=stream_properties["frame_cache_mb"],
+                display_width=stream_properties["display_width"],
+                batch_size=stream_properties["detect_batch"],
+                batch_wait=stream_properties["detect_wait_ms"] / 1000,
+                workers=stream_properties["detect_workers"],
+                detection_cache=stream_properties["detection_cache"],
+                detect_every=stream_properties["detect_every"],
+                motion_threshold=stream_properties["redetect_motion"],
+                motion_gate=stream_properties["motion_gate"],
+                decoder=self.project_info.get("decoder"),
+                tiling=self.project_info.get("tiling"),
+                tracker=stream_properties["tracker"],
+                track_threads=stream_properties["track_threads"],
+                track_file=track_path(self.project_info, sample_id, file),
+                detector={
+                    **self.project_info.get("detector", {}),
+                    **stream_properties["detector"],
+                },
+                stats=self.stats,
             ).start()
 
+            # the speed carries over from the last sample
+
+            self.stream.set_speed(self.speed)
+
             sys.stdout.write("\rInitialised.    ")
             sys.stdout.flush()
 
@@ -246,11 +313,7 @@ class VideoPane(QGraphicsView):
                 start_time = self.project_info["samples"][plot][sample_id]["start_time"]
 
                 # clear queue and set stream to start time
-                with self.stream.lock:
-                    while not self.stream.Q.empty():
-                        self.stream.Q.get()
-
-                    self.stream.stream.set(cv2.CAP_PROP_POS_MSEC, start_time * 1000)
+                self.stream.seek(start_time * 1000)
 
                 sys.stdout.write("\rFound last fish!!!              ")
                 sys.stdout.flush()
@@ -275,12 +338,20 @@ class VideoPane(QGraphicsView):
             self.stream.paused = True
 
     def update_frame(self):
+        # timer interval actually achieved
+
+        now = time.perf_counter()
+
+        if self.last_tick is not None:
+            self.stats.record("timer", now - self.last_tick)
+
+        self.last_tick = now
+
+        self.stream.sample_depths()
+
         # check if end of video
 
-        if (
-            self.stream.stream.get(cv2.CAP_PROP_POS_FRAMES)
-            >= self.stream.stream.get(cv2.CAP_PROP_FRAME_COUNT) - 1
-        ):
+        if self.stream.ended:
             prompt = samplePrompt()
             prompt.exec_()
 
@@ -295,61 +366,67 @@ class VideoPane(QGraphicsView):
                 self.project_info["samples"][plot][sample_id]["status"] = "complete"
             else:
                 self.stream.paused = True
+                self.stream.ended = False
 
-        if not self.stream.Q.empty() and not self.stream.paused:
-            # check if sample has ended
-            self.sample_queue()
+        if self.stream.paused:
+            self.update()
 
-            # calculate number of frames to skip
+            return
 
-            if self.speed > 1:
-                skip = int(self.speed)
-            else:
-                skip = 1
+        # set frames
 
-            # set frames
+        frame = self.stream.get_frame()
 
-            frame, self.stream.frame_time = self.stream.Q.get()
+        if frame is not None:
+            # check if sample has ended
+            self.sample_queue()
 
-            self.current_frame = frame
+            # frames skipped at high speed are dropped by the decoder
 
-            for i in range(skip - 1):
-                if not self.stream.Q.empty():
-                    frame, self.stream.frame_time = self.stream.Q.get()
+            self.current_frame = frame
 
             # check if rectangle is drawn
 
             if self.pt1 and self.pt2 and not self.drawing:
-                # map points in scene to frame adjust for aspect ratio
-
-                pt1 = (int(self.pt1.x()), int(self.pt1.y()))
-                pt2 = (int(self.pt2.x()), int(self.pt2.y()))
-
-                # fix start and end points
+                # fix start and end points, scene points are display pixels
 
-                pt1 = (min(pt1[0], pt2[0]), min(pt1[1], pt2[1]))
-                pt2 = (max(pt1[0], pt2[0]), max(pt1[1], pt2[1]))
+                x1, x2 = sorted([int(self.pt1.x()), int(self.pt2.x())])
+                y1, y2 = sorted([int(self.pt1.y()), int(self.pt2.y())])
 
-                cv2.rectangle(frame, pt1, pt2, (0, 255, 0), 2)
+                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
 
                 # pause the video
                 self.stream.paused = True
 
+                # map the rectangle to source pixels and save the full
+                # resolution frame
+
+                src1 = self.stream.to_source(x1, y1)
+                src2 = self.stream.to_source(x2, y2)
+
+                full_frame = self.stream.full_frame()
+
+                if full_frame is not None:
+                    cv2.rectangle(full_frame, src1, src2, (0, 255, 0), 2)
+
                 # enter data
 
-                with self.stream.lock:
-                    enter_data(
-                        frame=frame,
-                        data=self.stream.data,
-                        sizes=self.sizes,
-                        file=self.stream.path,
-                        deployment_id=self.stream.sample_id,
-                        video=self.stream,
-                        coordinates=(pt1[0], pt1[1], pt2[0], pt2[1]),
-                        status_bar=self.obs_label,
-                    )
+                enter_data(
+                    frame=full_frame,
+                    data=self.stream.data,
+                    sizes=self.sizes,
+                    file=self.stream.path,
+                    deployment_id=self.stream.sample_id,
+                    video=self.stream,
+                    coordinates=(src1[0], src1[1], src2[0], src2[1]),
+                    status_bar=self.obs_label,
+                )
+
+                # the fish is watched from where it came in at normal speed
 
-                    self.main_window.update_tables()
+                self.set_speed(1)
+
+                self.main_window.update_tables()
 
                 # rest
                 self.pt1 = None
@@ -357,23 +434,35 @@ class VideoPane(QGraphicsView):
 
             # scale and add frame to video pane
 
-            qt_img = self.cv_to_qt(frame)
-            self.original_img = qt_img
-            self.pixmap_item.setPixmap(QPixmap.fromImage(qt_img))
-            self.fitInView(
-                self.pixmap_item, Qt.KeepAspectRatio
-            )  # Ensure the pixmap item is scaled to fit the view
+            with self.stats.time("convert"):
+                qt_img = self.cv_to_qt(frame)
+                resized = qt_img.size() != self.original_img.size()
+                self.original_img = qt_img
+                self.pixmap_item.setPixmap(QPixmap.fromImage(qt_img))
+
+            # the view keeps its scale, only refit when the frame size changes
+
+            if resized:
+                self.fitInView(self.pixmap_item, Qt.KeepAspectRatio)
+
             self.update()
 
             # update status bar
             formatted_time = self.calculate_time()
             self.time_label.setText(formatted_time)
-            self.status_label.setText("Playing")
+            self.status_label.setText(self.stream.error or "Playing")
 
-        elif self.stream.Q.empty() and not self.stream.paused:
-            self.status_label.setText("Buffering")
-        elif not self.stream.Q.empty() and self.stream.paused:
-            self.update()
+            self.stats.frame_shown()
+            self.stats.record("display", time.perf_counter() - now)
+
+            if self.stream.cache is not None:
+                self.cache_label.setText(
+                    f"Cache: {self.stream.cache.hits} hits, "
+                    f"{self.stream.cache.misses} misses"
+                )
+
+        else:
+            self.status_label.setText(self.stream.error or "Buffering")
 
     def sample_queue(self):
         # check if video is running
@@ -419,7 +508,7 @@ class VideoPane(QGraphicsView):
         return f"{hours:02}:{minutes:02}:{seconds:02}:{milliseconds:03}"
 
     def cv_to_qt(self, img):
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        # frames arrive in RGB at display size from the stream
         height, width, channel = img.shape
         bytes_per_line = 3 * width
         return QImage(img.data, width, height, bytes_per_line, QImage.Format_RGB888)
@@ -441,6 +530,8 @@ class VideoPane(QGraphicsView):
         scene_pos = self.mapToScene(event.pos())
         self.MouseX = int(scene_pos.x())
         self.MouseY = int(scene_pos.y())
+        if self.stream is not None:
+            self.MouseX, self.MouseY = self.stream.to_source(self.MouseX, self.MouseY)
         self.cursor_label.setText(f"X: {self.MouseX}, Y: {self.MouseY}")
 
     def mouseReleaseEvent(self, event):
@@ -475,47 +566,33 @@ class VideoPane(QGraphicsView):
                 sizes = json.load(f)
                 self.sizes = sizes["sizes"]
 
+    def set_speed(self, speed):
+        # the timer shows frames faster and the decoder skips the ones in
+        # between
+
+        self.speed = speed
+        self.stream.set_speed(speed)
+
+        self.timer.setInterval(int(1000 / (FPS * speed)))
+        self.speed_label.setText(f"Speed: {speed}")
+
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Space:
             self.stream.paused = not self.stream.paused
             self.status_label.setText("Paused" if self.stream.paused else "Playing")
         elif event.key() == Qt.Key_J:
-            self.speed = max(MIN_SPEED, self.speed - SPEED_STEP)
-
-            dt = 1 / (self.speed * FPS)
-            interval = int(dt * 1000)
-
-            self.timer.setInterval(interval)
-            self.speed_label.setText(f"Speed: {self.speed}")
+            self.set_speed(max(MIN_SPEED, self.speed - SPEED_STEP))
 
         elif event.key() == Qt.Key_K:
-            self.speed = min(MAX_SPEED, self.speed + SPEED_STEP)
-
-            dt = 1 / (self.speed * FPS)
-            interval = int(dt * 1000)
-
-            self.timer.setInterval(interval)
-            self.speed_label.setText(f"Speed: {self.speed}")
+            self.set_speed(min(MAX_SPEED, self.speed + SPEED_STEP))
         elif event.key() == Qt.Key_Right:
-            with self.stream.lock:
-                while not self.stream.Q.empty():
-                    self.stream.Q.get()
-                self.stream.skip(1)
+            self.stream.skip(1)
         elif event.key() == Qt.Key_Left:
-            with self.stream.lock:
-                while not self.stream.Q.empty():
-                    self.stream.Q.get()
-                self.stream.skip(-1)
+            self.stream.skip(-1)
         elif event.key() == Qt.Key_Up:
-            with self.stream.lock:
-                while not self.stream.Q.empty():
-                    self.stream.Q.get()
-                self.stream.skip(10)
+            self.stream.skip(10)
         elif event.key() == Qt.Key_Down:
-            with self.stream.lock:
-                while not self.stream.Q.empty():
-                    self.stream.Q.get()
-                self.stream.skip(-10)
+            self.stream.skip(-10)
         elif event.key() == Qt.Key_Z:
             time_out(self.stream, self.obs_label)
             self.main_window.update_tables()
@@ -559,6 +636,9 @@ class MenuBar(widgets.QMenuBar):
         self.add_action(view_menu, "View Project Info", "Ctrl+I", self.view_project)
         self.add_action(view_menu, "View Behaviours", "Ctrl+B", self.view_behaviour)
         self.add_action(view_menu, "View Size Classes", "Ctrl+S", self.view_size)
+        self.add_action(
+            view_menu, "Pipeline Stats", "Ctrl+Shift+D", self.view_pipeline_stats
+        )
 
     def add_action(self, menu, name, shortcut, method):
         action = widgets.QAction(name, self)
@@ -776,6 +856,12 @@ class MenuBar(widgets.QMenuBar):
             dialog.setText("No project loaded")
             dialog.exec_()
 
+    def view_pipeline_stats(self):
+        # non-modal so it keeps updating while the video plays
+
+        self.stats_panel = statsPanel(self.main_window.video, self.main_window)
+        self.stats_panel.show()
+
     def view_size(self):
         if self.main_window.project_info is not None:
             dialog = widgets.QDialog()
@@ -867,6 +953,13 @@ class MainWindow(widgets.QMainWindow):  # Inherit from QMainWindow
                 self.video.stream.pause = False
                 self.video.stream.stop()
 
+            # save pipeline stats for the session
+
+            stats_file = self.stream_properties["stats_file"]
+
+            if stats_file:
+                self.video.stats.dump(stats_file)
+
         sys.stdout.flush()
 
         event.accept()
@@ -987,6 +1080,7 @@ class MainWindow(widgets.QMainWindow):  # Inherit from QMainWindow
             self.statusBar().removeWidget(self.video.obs_label)
             self.statusBar().removeWidget(self.video.speed_label)
             self.statusBar().removeWidget(self.video.cursor_label)
+            self.statusBar().removeWidget(self.video.cache_label)
 
             # set video
 
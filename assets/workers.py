@@ -0,0 +1,174 @@
+# detection in worker processes, each with its own copy of the model, frames
+# are read from the shared frame ring by slot number so only boxes are sent back
+
+import multiprocessing
+import time
+from collections import deque
+from queue import Empty
+from types import SimpleNamespace
+from assets.buffer import attach_frames
+from assets.detect import load_model, detect_batch
+
+# key of the message a worker sends once its model is loaded, or failed to
+# load, batch keys are numbers so the two never mix
+
+LOADED = "loaded"
+
+
+def detector_worker(ring, useGPU, settings, tiles, tasks, results, generation):
+    name, size, shape = ring
+
+    memory, frames = attach_frames(name, size, shape)
+
+    # load_model only needs somewhere to put the net
+
+    video = SimpleNamespace(useGPU=useGPU)
+
+    try:
+        load_model(video, settings)
+    except Exception as e:
+        results.put((LOADED, repr(e), 0))
+
+        return
+
+    # tell the pool the model is loaded
+
+    results.put((LOADED, None, 0))
+
+    while True:
+        task = tasks.get()
+
+        if task is None:
+            break
+
+        key, task_generation, slots = task
+
+        # frames dispatched before a seek are skipped, not detected on
+
+        if task_generation != generation.value:
+            results.put((key, None, 0))
+
+            continue
+
+        start = time.perf_counter()
+
+        # a batch the model fails on still comes back, with the error, so the
+        # stream is not left waiting for it
+
+        try:
+            detections = detect_batch(
+                video, [frames[slot] for slot in slots], rgb=True, tiles=tiles
+            )
+        except Exception as e:
+            detections = repr(e)
+
+        results.put((key, detections, time.perf_counter() - start))
+
+    del frames
+
+    memory.close()
+
+
+class DetectorPool:
+    def __init__(self, ring, workers, useGPU=False, settings=None, tiles=None):
+        # spawn rather than fork, the parent runs decoder and Qt threads
+
+        context = multiprocessing.get_context("spawn")
+
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+
+        # generation of the stream, set on seeks so workers can skip stale work
+
+        self.generation = context.Value("i", 0, lock=False)
+
+        # workers that reported their model loaded
+
+        self.loaded = 0
+
+        # batch results that came back while other workers were still loading
+
+        self.early = deque()
+
+        self.processes = [
+            context.Process(
+                target=detector_worker,
+                args=(
+                    (ring.name, ring.size, ring.shape),
+                    useGPU,
+                    settings,
+                    tiles,
+                    self.tasks,
+                    self.results,
+                    self.generation,
+                ),
+                daemon=True,
+            )
+            for _ in range(workers)
+        ]
+
+    def __len__(self):
+        return len(self.processes)
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+        return self
+
+    def wait(self, timeout=None):
+        # True once every worker has loaded its model, False if some are
+        # still loading after timeout, a missing model raises here like it
+        # does without workers
+
+        while self.loaded < len(self.processes):
+            try:
+                message = self.results.get(timeout=timeout)
+            except Empty:
+                return False
+
+            key, error, _ = message
+
+            # a worker that loaded first may already be sending back batches,
+            # they are kept for result rather than taken for a load
+
+            if key != LOADED:
+                self.early.append(message)
+
+                continue
+
+            if error is not None:
+                raise RuntimeError(f"Detector worker failed: {error}")
+
+            self.loaded += 1
+
+        return True
+
+    def submit(self, key, generation, slots):
+        self.tasks.put((key, generation, slots))
+
+    def result(self, timeout=None):
+        # (key, detections per frame, seconds), None if nothing came back,
+        # detections are None for skipped stale batches and the error for
+        # batches the model failed on
+
+        if self.early:
+            return self.early.popleft()
+
+        try:
+            return self.results.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def stop(self, timeout=5):
+        for _ in self.processes:
+            self.tasks.put(None)
+
+        for process in self.processes:
+            if process.pid is None:
+                continue
+
+            process.join(timeout)
+
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,913 @@
+# headless benchmark suite on synthetic videos, no model weights needed
+#
+# python -m bench.run [--out bench_results.json] [--compare old.json]
+#                     [--width 1920 --height 1080 --seconds 10 --codec mp4v]
+#                     [--only decode,track]
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+import cv2
+import numpy as np
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from bench.synthetic import make_video, make_model, make_onnx_model  # noqa: E402
+from bench.seek import seek_latency  # noqa: E402
+
+
+def timed(function, repeat=20):
+    # median wall time of repeated calls in seconds
+
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return float(np.median(times))
+
+
+def result(name, value, unit, **params):
+    return {"name": name, "params": params, "value": value, "unit": unit}
+
+
+def fake_outputs(candidates, classes=1, confident=0.1, seed=0):
+    # raw YOLO rows, centre/size normalised, a fraction above the threshold
+
+    rng = np.random.default_rng(seed)
+
+    out = np.zeros((candidates, 5 + classes), dtype=np.float32)
+    out[:, 0:2] = rng.uniform(0.05, 0.95, (candidates, 2))
+    out[:, 2:4] = rng.uniform(0.01, 0.1, (candidates, 2))
+    out[:, 4] = rng.uniform(0, 1, candidates)
+    out[:, 5:] = rng.uniform(0, 0.5, (candidates, classes))
+
+    strong = rng.uniform(0, 1, candidates) < confident
+    out[strong, 5] = rng.uniform(0.5, 1, strong.sum())
+
+    return out
+
+
+class FakeNet:
+    # stands in for cv2.dnn so only pre and post-processing are timed
+
+    def __init__(self, outs):
+        self.outs = outs
+
+    def setInput(self, blob):
+        pass
+
+    def forward(self, layers):
+        return self.outs
+
+
+def fake_video(outs=None):
+    from assets.detect import BACKENDS, model_settings
+
+    video = SimpleNamespace(
+        data={},
+        tracker=None,
+        useGPU=False,
+        settings=model_settings(),
+        keep_classes=None,
+    )
+
+    if outs is not None:
+        video.net = FakeNet(outs)
+        video.output_layers = ["yolo"]
+        video.backend = BACKENDS["darknet"]
+        video.input_size = video.settings["input_size"]
+
+    return video
+
+
+def fish_frame(boxes, width, height):
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    frame[:] = (120, 60, 10)
+
+    for x, y, w, h in boxes.astype(int):
+        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 200, 255), -1)
+
+    return frame
+
+
+# benchmarks, each returns a list of results
+
+
+def bench_decode(path, args):
+    from assets.stream import VideoStream
+
+    results = []
+
+    # raw decoder throughput
+
+    capture = cv2.VideoCapture(path, cv2.CAP_FFMPEG)
+
+    frames = 0
+    start = time.perf_counter()
+
+    while capture.grab():
+        capture.retrieve()
+        frames += 1
+
+    results.append(
+        result(
+            "decode_raw",
+            frames / (time.perf_counter() - start),
+            "fps",
+            width=args.width,
+            height=args.height,
+            codec=args.codec,
+        )
+    )
+
+    # through the playback pipeline: scaled to display size and in RGB
+
+    stream = VideoStream(
+        data={},
+        plot_id=None,
+        sample_id=None,
+        path=path,
+        detection=False,
+        tracking=False,
+        useGPU=False,
+        buffer_mb=64,
+        cache_mb=0,
+    ).start()
+
+    frames = 0
+    start = time.perf_counter()
+
+    while not stream.ended:
+        if stream.get_frame() is not None:
+            frames += 1
+        else:
+            time.sleep(0.0005)
+
+    results.append(
+        result(
+            "decode_pipeline",
+            frames / (time.perf_counter() - start),
+            "fps",
+            width=args.width,
+            height=args.height,
+            codec=args.codec,
+            display_width=stream.display_width,
+        )
+    )
+
+    stream.stop()
+
+    return results
+
+
+def bench_seek(path, args):
+    random.seed(0)
+
+    latencies, decoder = seek_latency(path, seeks=20, seconds=args.seconds)
+
+    return [
+        result("seek_first_frame_p50", float(np.median(latencies)), "ms"),
+        result("seek_first_frame_p95", float(np.percentile(latencies, 95)), "ms"),
+    ]
+
+
+def bench_postprocess(path, args):
+    from assets.detect import (
+        NMS_THRESHOLD,
+        detect_fish,
+        draw_fish,
+        non_max_suppression,
+        output_boxes,
+    )
+
+    frame = np.zeros((args.height, args.width, 3), dtype=np.uint8)
+
+    results = []
+
+    for candidates in [2028, 10647, 50000]:
+        video = fake_video([fake_outputs(candidates)])
+
+        seconds = timed(lambda: detect_fish(video, frame))
+
+        results.append(
+            result("detect_postprocess", seconds * 1000, "ms", candidates=candidates)
+        )
+
+        # suppression on its own, the rest is thresholding and box conversion
+
+        boxes, confidences, _ = output_boxes(video.net.outs, args.width, args.height)
+
+        seconds = timed(lambda: non_max_suppression(boxes, confidences, NMS_THRESHOLD))
+
+        results.append(result("nms", seconds * 1000, "ms", candidates=candidates))
+
+        boxes, confidences = detect_fish(video, frame)
+
+        seconds = timed(lambda: draw_fish(video, frame.copy(), boxes, confidences))
+
+        results.append(result("draw", seconds * 1000, "ms", candidates=candidates))
+
+    return results
+
+
+def bench_batch(path, args):
+    from assets.detect import detect_batch, load_model, model_settings
+
+    capture = cv2.VideoCapture(path, cv2.CAP_FFMPEG)
+
+    frames = []
+
+    while len(frames) < 32:
+        ret, frame = capture.read()
+
+        if not ret:
+            break
+
+        frames.append(frame)
+
+    capture.release()
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as folder:
+        cfg, weights = make_model(folder, confidence_bias=0.7)
+
+        video = fake_video()
+
+        load_model(video, model_settings({"cfg": cfg, "weights": weights}))
+
+        # warm up, the first pass allocates the layers
+
+        detect_batch(video, frames[:1])
+
+        for size in [1, 4, 8]:
+            batches = [frames[i : i + size] for i in range(0, len(frames), size)]
+
+            start = time.perf_counter()
+
+            for batch in batches:
+                detect_batch(video, batch)
+
+            results.append(
+                result(
+                    "detect_batch",
+                    len(frames) / (time.perf_counter() - start),
+                    "fps",
+                    batch=size,
+                )
+            )
+
+    return results
+
+
+def bench_backends(path, args):
+    from assets.detect import detect_batch, load_model, model_settings
+
+    capture = cv2.VideoCapture(path, cv2.CAP_FFMPEG)
+
+    frames = []
+
+    while len(frames) < 16:
+        ret, frame = capture.read()
+
+        if not ret:
+            break
+
+        frames.append(frame)
+
+    capture.release()
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as folder:
+        cfg, weights = make_model(folder, confidence_bias=0.7)
+
+        models = [("darknet", 416, {"cfg": cfg, "weights": weights})]
+
+        for size in [416, 320]:
+            for layout in ["v5", "v8"]:
+                onnx = os.path.join(folder, f"{layout}_{size}")
+                os.makedirs(onnx)
+
+                onnx = make_onnx_model(onnx, input_size=size, layout=layout)
+
+                models.append((f"onnx_{layout}", size, {"weights": onnx}))
+
+        for backend, size, files in models:
+            video = fake_video()
+
+            load_model(video, model_settings({**files, "input_size": size}))
+
+            detect_batch(video, frames[:1])
+
+            start = time.perf_counter()
+
+            for frame in frames:
+                detect_batch(video, [frame])
+
+            results.append(
+                result(
+                    "detect_backend",
+                    len(frames) / (time.perf_counter() - start),
+                    "fps",
+                    backend=backend,
+                    input_size=size,
+                )
+            )
+
+    return results
+
+
+def bench_tiles(path, args):
+    from assets.detect import detect_batch, load_model, model_settings, tile_grid
+
+    frame = np.random.default_rng(0).integers(0, 255, (2160, 3840, 3), np.uint8)
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as folder:
+        cfg, weights = make_model(folder, confidence_bias=0.7)
+
+        video = fake_video()
+
+        load_model(video, model_settings({"cfg": cfg, "weights": weights}))
+
+        detect_batch(video, [frame])
+
+        # whole frame, then tiles of decreasing size over a 4K frame
+
+        for tile in [None, 1280, 640]:
+            tiles = None if tile is None else tile_grid(3840, 2160, {"tile": tile})
+
+            seconds = timed(lambda: detect_batch(video, [frame], tiles=tiles), 5)
+
+            results.append(
+                result(
+                    "detect_tiled",
+                    seconds * 1000,
+                    "ms",
+                    tile=tile,
+                    tiles=1 if tiles is None else len(tiles),
+                )
+            )
+
+    return results
+
+
+@contextmanager
+def model_folder():
+    # random-weight model where load_model looks for it, in model/ under
+    # the working directory
+
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.makedirs(os.path.join(folder, "model"))
+        make_model(os.path.join(folder, "model"), confidence_bias=0.7)
+
+        os.chdir(folder)
+
+        try:
+            yield folder
+        finally:
+            os.chdir(cwd)
+
+
+def detect_pipeline(path, **options):
+    # frames per second shown with detection on, saved detections are not
+    # used so every run detects
+
+    from assets.stream import VideoStream
+
+    stream = VideoStream(
+        data={},
+        plot_id=None,
+        sample_id=None,
+        path=path,
+        detection=True,
+        tracking=False,
+        useGPU=False,
+        buffer_mb=64,
+        cache_mb=0,
+        detection_cache=False,
+        **options,
+    ).start()
+
+    frames = 0
+    start = time.perf_counter()
+
+    while not stream.ended:
+        if stream.get_frame() is not None:
+            frames += 1
+        else:
+            time.sleep(0.0005)
+
+    fps = frames / (time.perf_counter() - start)
+
+    stream.stop()
+
+    return fps
+
+
+def bench_workers(path, args):
+    with model_folder():
+        return [
+            result(
+                "detect_pipeline",
+                detect_pipeline(path, workers=workers),
+                "fps",
+                workers=workers,
+            )
+            for workers in sorted({0, 1, 2, os.cpu_count() or 1})
+        ]
+
+
+def bench_cadence(path, args):
+    with model_folder():
+        return [
+            result(
+                "detect_cadence",
+                detect_pipeline(path, detect_every=every),
+                "fps",
+                every=every,
+            )
+            for every in [1, 5, 10]
+        ]
+
+
+def bench_gate(path, args):
+    from assets.metrics import PipelineStats
+
+    results = []
+
+    with model_folder():
+        for threshold in [0, 0.01, 0.05]:
+            stats = PipelineStats()
+
+            fps = detect_pipeline(path, motion_gate=threshold, stats=stats)
+
+            summary = stats.summary()
+            static = summary["counts"].get("detect_static", 0)
+            detected = summary["stages"].get("detect", {}).get("count", 0)
+
+            results += [
+                result("detect_gate", fps, "fps", threshold=threshold),
+                result(
+                    "detect_gate_static",
+                    static / max(static + detected, 1),
+                    "share",
+                    threshold=threshold,
+                ),
+            ]
+
+    return results
+
+
+def bench_track(path, args):
+    from assets.detect import make_tracker, tracker_available, track_fish
+
+    # appearance trackers other than MIL ship with the opencv-contrib builds
+    # only
+
+    trackers = [name for name in ["sort", "kcf"] if tracker_available(name)]
+
+    if "kcf" not in trackers:
+        print("\nSkipping kcf tracking: this OpenCV build has no KCF tracker")
+
+    width, height = 1280, 720
+
+    results = []
+
+    for tracker in trackers:
+        for fish in [1, 10, 50, 100, 200]:
+            rng = np.random.default_rng(0)
+
+            size = 24
+
+            boxes = np.column_stack(
+                [
+                    rng.uniform(0, width - size, fish),
+                    rng.uniform(0, height - size, fish),
+                    np.full(fish, size),
+                    np.full(fish, size // 2),
+                ]
+            )
+
+            velocity = rng.uniform(-2, 2, (fish, 2))
+
+            video = fake_video()
+            video.tracker = make_tracker(tracker)
+
+            times = []
+
+            for i in range(30):
+                boxes[:, :2] = np.clip(
+                    boxes[:, :2] + velocity, 0, [width - size, height - size]
+                )
+
+                frame = fish_frame(boxes, width, height)
+                confidences = np.full(fish, 0.9)
+
+                start = time.perf_counter()
+                track_fish(video, frame, boxes.copy(), confidences)
+                times.append(time.perf_counter() - start)
+
+            # the first frames create trackers, time the steady state
+
+            results.append(
+                result(
+                    "track_frame",
+                    float(np.median(times[5:])) * 1000,
+                    "ms",
+                    tracker=tracker,
+                    fish=fish,
+                )
+            )
+
+    return results
+
+
+def bench_track_threads(path, args):
+    from assets.detect import make_tracker, track_fish
+
+    # appearance trackers updated one after another and over a thread per
+    # core, with MIL as it ships with every OpenCV build
+
+    width, height, size, fish = 1280, 720, 48, 16
+
+    rng = np.random.default_rng(0)
+
+    boxes = np.column_stack(
+        [
+            rng.uniform(0, [width - size, height - size], (fish, 2)),
+            np.full(fish, size),
+            np.full(fish, size // 2),
+        ]
+    )
+
+    results = []
+
+    for threads in sorted({1, os.cpu_count() or 1}):
+        video = fake_video()
+        video.tracker = make_tracker("mil", threads)
+
+        track_fish(
+            video, fish_frame(boxes, width, height), boxes.copy(), np.full(fish, 0.9)
+        )
+
+        times = []
+
+        for i in range(5):
+            frame = fish_frame(boxes + [i, 0, 0, 0], width, height)
+
+            start = time.perf_counter()
+            track_fish(video, frame, None, None)
+            times.append(time.perf_counter() - start)
+
+        results.append(
+            result(
+                "track_threads",
+                float(np.median(times)) * 1000,
+                "ms",
+                threads=threads,
+                fish=fish,
+            )
+        )
+
+    return results
+
+
+def bench_match(path, args):
+    from assets.tracking import assign, iou_matrix
+
+    # matching detections to tracked fish: IoU one detection at a time as
+    # track_fish used to, the whole matrix at once, and the matrix with the
+    # one-to-one assignment
+
+    def iou_rows(boxes, tracked):
+        x, y, w, h = tracked.T
+
+        rows = []
+
+        for bx, by, bw, bh in boxes:
+            inter = np.maximum(
+                0, np.minimum(bx + bw, x + w) - np.maximum(bx, x)
+            ) * np.maximum(0, np.minimum(by + bh, y + h) - np.maximum(by, y))
+
+            rows.append(inter / (bw * bh + w * h - inter))
+
+        return np.array(rows)
+
+    methods = {
+        "rows": lambda boxes, tracked: iou_rows(boxes, tracked).max(axis=1) > 0.5,
+        "matrix": lambda boxes, tracked: iou_matrix(boxes, tracked).max(axis=1) > 0.5,
+        "assign": lambda boxes, tracked: assign(iou_matrix(boxes, tracked), 0.5),
+    }
+
+    width, height, size = 1920, 1080, 24
+
+    results = []
+
+    for fish in [10, 100, 500]:
+        rng = np.random.default_rng(0)
+
+        tracked = np.column_stack(
+            [
+                rng.uniform(0, [width - size, height - size], (fish, 2)),
+                np.full(fish, size),
+                np.full(fish, size // 2),
+            ]
+        )
+
+        boxes = tracked + rng.normal(0, 1, tracked.shape) * [1, 1, 0, 0]
+
+        for method, match in methods.items():
+            match(boxes, tracked)
+
+            runs = max(10, 1000 // fish)
+
+            start = time.perf_counter()
+
+            for _ in range(runs):
+                match(boxes, tracked)
+
+            results.append(
+                result(
+                    "track_match",
+                    (time.perf_counter() - start) / runs * 1000,
+                    "ms",
+                    method=method,
+                    boxes=fish,
+                )
+            )
+
+    return results
+
+
+def bench_churn(path, args):
+    from assets.detect import make_tracker, track_fish
+
+    # fish swim in and out for a long stretch, tracking should cost the same
+    # at the end as at the start
+
+    width, height = 640, 360
+    size = 24
+
+    results = []
+
+    # MIL takes tens of ms per fish, so it gets a few dozen frames
+
+    for tracker, fish, frames in [("sort", 50, 3000), ("mil", 3, 40)]:
+        rng = np.random.default_rng(0)
+
+        limits = [width - size, height - size]
+
+        boxes = np.column_stack(
+            [
+                rng.uniform(0, limits, (fish, 2)),
+                np.full(fish, size),
+                np.full(fish, size // 2),
+            ]
+        )
+
+        video = fake_video()
+        video.tracker = make_tracker(tracker)
+
+        times = []
+
+        for i in range(frames):
+            # a fish leaves and another arrives somewhere else every tenth
+            # frame
+
+            if i % 10 == 0:
+                boxes[i // 10 % fish, :2] = rng.uniform(0, limits)
+
+            frame = fish_frame(boxes, width, height)
+            confidences = np.full(fish, 0.9)
+
+            start = time.perf_counter()
+            track_fish(video, frame, boxes.copy(), confidences)
+            times.append(time.perf_counter() - start)
+
+        # tracks pile up until the first ones reach their maximum age, then
+        # compare the second tenth of the run with the last
+
+        window = frames // 10
+
+        for part, part_times in [
+            ("early", times[window : 2 * window]),
+            ("last", times[-window:]),
+        ]:
+            results.append(
+                result(
+                    "track_churn",
+                    float(np.median(part_times)) * 1000,
+                    "ms",
+                    tracker=tracker,
+                    frames=part,
+                )
+            )
+
+        # tracks left over from fish that moved are kept until they age out,
+        # more than that means fish get a new track instead of keeping theirs
+
+        results.append(
+            result(
+                "track_churn_live",
+                len(video.tracker) / fish,
+                "tracks per fish",
+                tracker=tracker,
+            )
+        )
+
+    return results
+
+
+def bench_save(path, args):
+    import assets.data
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as folder:
+        assets.data.data_file = os.path.join(folder, "data.json")
+
+        for individuals in [10, 100, 1000, 10000]:
+            data = {
+                f"P1_{i}": {
+                    "species": "Chromis viridis",
+                    "group": "Planktivore",
+                    "size_class": "0-10",
+                    "remarks": "",
+                    "coordinates": (10, 10, 50, 50),
+                    "file": "video.mp4",
+                    "time_in": 1000.0 * i,
+                    "time_out": 1000.0 * i + 5000,
+                    "behaviour": [{"time": 1000.0 * i, "behaviour": "Feeding"}] * 5,
+                }
+                for i in range(individuals)
+            }
+
+            if os.path.exists(assets.data.data_file):
+                os.remove(assets.data.data_file)
+
+            seconds = timed(lambda: assets.data.save_to_json(data), repeat=5)
+
+            results.append(
+                result("save_to_json", seconds * 1000, "ms", individuals=individuals)
+            )
+
+    return results
+
+
+def bench_convert(path, args):
+    from PyQt5 import QtWidgets
+    from PyQt5.QtGui import QPixmap
+    from assets.ui import VideoPane
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+    results = []
+
+    for width, height in [(1280, 720), (1920, 1080), (3840, 2160)]:
+        frame = np.random.default_rng(0).integers(0, 255, (height, width, 3), np.uint8)
+
+        def convert():
+            QPixmap.fromImage(VideoPane.cv_to_qt(None, frame))
+
+        results.append(
+            result(
+                "ui_convert", timed(convert) * 1000, "ms", width=width, height=height
+            )
+        )
+
+    app.processEvents()
+
+    return results
+
+
+BENCHMARKS = {
+    "decode": bench_decode,
+    "seek": bench_seek,
+    "postprocess": bench_postprocess,
+    "batch": bench_batch,
+    "workers": bench_workers,
+    "cadence": bench_cadence,
+    "gate": bench_gate,
+    "tiles": bench_tiles,
+    "backends": bench_backends,
+    "track": bench_track,
+    "threads": bench_track_threads,
+    "match": bench_match,
+    "churn": bench_churn,
+    "save": bench_save,
+    "convert": bench_convert,
+}
+
+
+def key(entry):
+    return entry["name"] + json.dumps(entry["params"], sort_keys=True)
+
+
+def compare(results, old_path):
+    # ratio new / old for every matching result
+
+    with open(old_path, "r") as f:
+        old = {key(entry): entry for entry in json.load(f)["results"]}
+
+    print(f"\nCompared to {old_path}:")
+
+    for entry in results:
+        previous = old.get(key(entry))
+
+        if previous is None or previous["value"] == 0:
+            continue
+
+        ratio = entry["value"] / previous["value"]
+
+        print(
+            f"  {entry['name']:<24}{json.dumps(entry['params']):<48}"
+            f"{previous['value']:>10.2f} -> {entry['value']:>10.2f} {entry['unit']}"
+            f"  ({ratio:.2f}x)"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WhatFishDo benchmark suite")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--seconds", type=int, default=10)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--codec", default="mp4v")
+    parser.add_argument("--only", help="Comma separated benchmarks to run")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = make_video(
+            os.path.join(folder, "bench.mp4"),
+            width=args.width,
+            height=args.height,
+            seconds=args.seconds,
+            fps=args.fps,
+            codec=args.codec,
+        )
+
+        for name in names:
+            sys.stdout.write(f"\rRunning {name}...          ")
+            sys.stdout.flush()
+
+            results += BENCHMARKS[name](path, args)
+
+    output = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cores": os.cpu_count(),
+            "video": {
+                "width": args.width,
+                "height": args.height,
+                "seconds": args.seconds,
+                "fps": args.fps,
+                "codec": args.codec,
+            },
+        },
+        "results": results,
+    }
+
+    with open(args.out, "w") as f:
+        json.dump(output, f, indent=4)
+
+    print("\n")
+
+    for entry in results:
+        print(
+            f"{entry['name']:<24}{json.dumps(entry['params']):<48}"
+            f"{entry['value']:>10.2f} {entry['unit']}"
+        )
+
+    print(f"\nSaved to {args.out}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
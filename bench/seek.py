@@ -0,0 +1,97 @@
+# time to first frame after a seek
+#
+# python -m bench.seek [--width 1920 --height 1080 --seeks 20 --no-index]
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import numpy as np
+from assets.stream import VideoStream
+from bench.synthetic import make_video
+
+
+def first_frame(stream, timeout=10):
+    # poll like the UI timer does until a frame shows up
+
+    start = time.perf_counter()
+
+    while time.perf_counter() - start < timeout:
+        if stream.get_frame() is not None:
+            return time.perf_counter() - start
+
+        time.sleep(0.001)
+
+    return None
+
+
+def seek_latency(path, seeks=20, seconds=30, seek_index=True):
+    stream = VideoStream(
+        data={},
+        plot_id=None,
+        sample_id=None,
+        path=path,
+        detection=False,
+        tracking=False,
+        useGPU=False,
+        seek_index=seek_index,
+    ).start()
+
+    first_frame(stream)
+
+    latencies = []
+    decoder = []
+
+    for i in range(seeks):
+        target = random.uniform(0, seconds - 1) * 1000
+
+        start = time.perf_counter()
+        stream.seek(target)
+        latency = first_frame(stream)
+
+        if latency is not None:
+            latencies.append(time.perf_counter() - start)
+            decoder.append(stream.seek_time)
+
+    stream.stop()
+
+    return np.array(latencies) * 1000, np.array(decoder) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to first frame after a seek")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--seconds", type=int, default=30)
+    parser.add_argument("--seeks", type=int, default=20)
+    parser.add_argument(
+        "--no-index", action="store_true", help="Seek with CAP_PROP_POS_MSEC"
+    )
+    args = parser.parse_args()
+
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = make_video(
+            os.path.join(folder, "seek.mp4"),
+            width=args.width,
+            height=args.height,
+            seconds=args.seconds,
+        )
+
+        latencies, decoder = seek_latency(
+            path, args.seeks, args.seconds, not args.no_index
+        )
+
+    print(
+        f"\nSeeks: {len(latencies)}/{args.seeks}, "
+        f"median: {np.median(latencies):.1f} ms, "
+        f"p95: {np.percentile(latencies, 95):.1f} ms, "
+        f"max: {latencies.max():.1f} ms, "
+        f"decoder seek max: {decoder.max():.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+# synthetic fish videos for benchmarks and tests
+
+import os
+import cv2
+import numpy as np
+
+
+def make_video(path, width=640, height=480, seconds=5, fps=30, codec="mp4v", fish=5):
+    # write a video of coloured rectangles swimming across a blue background
+
+    rng = np.random.default_rng(0)
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+
+    if not writer.isOpened():
+        raise ValueError(f"Unable to write video with codec {codec}")
+
+    size = max(8, min(width, height) // 12)
+
+    position = rng.uniform([0, 0], [width - size, height - size], (fish, 2))
+    velocity = rng.uniform(-4, 4, (fish, 2)) * max(1, width / 640)
+    colours = rng.integers(0, 255, (fish, 3))
+
+    background = np.zeros((height, width, 3), dtype=np.uint8)
+    background[:] = (120, 60, 10)
+
+    for i in range(int(seconds * fps)):
+        frame = background.copy()
+
+        # bounce off the edges
+
+        position += velocity
+        out = (position < 0) | (position > [width - size, height - size])
+        velocity[out] *= -1
+        position = np.clip(position, 0, [width - size, height - size])
+
+        for (x, y), colour in zip(position.astype(int), colours):
+            cv2.rectangle(frame, (x, y), (x + size, y + size // 2), colour.tolist(), -1)
+
+        # frame number, useful to check seeks by eye
+
+        cv2.putText(
+            frame, str(i), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2
+        )
+
+        writer.write(frame)
+
+    writer.release()
+
+    return path
+
+
+# tiny YOLO style darknet model with random weights, enough to time the dnn
+# pipeline without the real model files
+
+MODEL_LAYERS = [16, 32, 64, 128]
+
+
+def make_model(folder, input_size=416, classes=1, seed=0, confidence_bias=0.0):
+    # confidence_bias pushes the objectness and class logits up so a share of
+    # the candidates pass the detection threshold
+
+    rng = np.random.default_rng(seed)
+
+    outputs = 3 * (5 + classes)
+
+    cfg = [
+        "[net]",
+        "batch=1",
+        f"width={input_size}",
+        f"height={input_size}",
+        "channels=3",
+        "",
+    ]
+
+    weights = [np.array([0, 2, 0], dtype=np.int32).tobytes()]
+    weights.append(np.array([0], dtype=np.int64).tobytes())
+
+    channels = 3
+
+    for filters in MODEL_LAYERS:
+        cfg += [
+            "[convolutional]",
+            "batch_normalize=1",
+            f"filters={filters}",
+            "size=3",
+            "stride=2",
+            "pad=1",
+            "activation=leaky",
+            "",
+        ]
+
+        # biases, scales, rolling mean and variance, then the kernels
+
+        weights.append(np.zeros(filters, dtype=np.float32).tobytes())
+        weights.append(np.ones(filters, dtype=np.float32).tobytes())
+        weights.append(np.zeros(filters, dtype=np.float32).tobytes())
+        weights.append(np.ones(filters, dtype=np.float32).tobytes())
+
+        kernels = rng.normal(0, 1 / np.sqrt(channels * 9), filters * channels * 9)
+
+        weights.append(kernels.astype(np.float32).tobytes())
+
+        channels = filters
+
+    cfg += [
+        "[convolutional]",
+        "size=1",
+        "stride=1",
+        "pad=1",
+        f"filters={outputs}",
+        "activation=linear",
+        "",
+        "[yolo]",
+        "mask=0,1,2",
+        "anchors=10,14, 23,27, 37,58",
+        f"classes={classes}",
+        "num=3",
+        "",
+    ]
+
+    biases = np.zeros((3, 5 + classes), dtype=np.float32)
+    biases[:, 4:] = confidence_bias
+
+    weights.append(biases.tobytes())
+
+    kernels = rng.normal(0, 1 / np.sqrt(channels), outputs * channels)
+
+    weights.append(kernels.astype(np.float32).tobytes())
+
+    cfg_path = os.path.join(folder, "model.cfg")
+    weights_path = os.path.join(folder, "model.weights")
+
+    with open(cfg_path, "w") as f:
+        f.write("\n".join(cfg))
+
+    with open(weights_path, "wb") as f:
+        f.write(b"".join(weights))
+
+    return cfg_path, weights_path
+
+
+# minimal protobuf writer, enough to build an ONNX file without the onnx
+# package
+
+
+def varint(value):
+    value &= (1 << 64) - 1
+
+    out = bytearray()
+
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+
+            return bytes(out)
+
+
+def message(*fields):
+    # fields as (number, value), ints are varints, everything else is
+    # length delimited
+
+    out = b""
+
+    for number, value in fields:
+        if isinstance(value, int):
+            out += varint(number << 3) + varint(value)
+        else:
+            if isinstance(value, str):
+                value = value.encode()
+
+            out += varint(number << 3 | 2) + varint(len(value)) + value
+
+    return out
+
+
+def onnx_tensor(name, array):
+    data_type = {np.dtype(np.float32): 1, np.dtype(np.int64): 7}[array.dtype]
+
+    return message(
+        *((1, int(d)) for d in array.shape),
+        (2, data_type),
+        (8, name),
+        (9, array.tobytes()),
+    )
+
+
+def onnx_value(name, dims):
+    # float tensor, dims are sizes or names of dynamic axes
+
+    shape = message(
+        *((1, message((1, d) if isinstance(d, int) else (2, d))) for d in dims)
+    )
+
+    return message((1, name), (2, message((1, message((1, 1), (2, shape))))))
+
+
+def onnx_node(op, inputs, outputs, **attributes):
+    fields = [(1, name) for name in inputs] + [(2, name) for name in outputs]
+    fields.append((4, op))
+
+    for name, values in attributes.items():
+        # lists of ints only
+
+        fields.append((5, message((1, name), *((8, v) for v in values), (20, 7))))
+
+    return message(*fields)
+
+
+def make_onnx_model(
+    folder,
+    input_size=416,
+    classes=1,
+    seed=0,
+    confidence_bias=0.0,
+    layout="v5",
+    stride=32,
+):
+    # one strided convolution standing in for an exported YOLO model, rows
+    # are centre, size in input pixels and scores, layout "v5" gives
+    # (batch, rows, 5 + classes) with objectness, "v8" gives
+    # (batch, 4 + classes, rows) without it
+
+    rng = np.random.default_rng(seed)
+
+    channels = (5 if layout == "v5" else 4) + classes
+
+    kernels = rng.normal(
+        0, 1 / np.sqrt(3 * stride * stride), (channels, 3, stride, stride)
+    )
+
+    biases = np.zeros(channels, dtype=np.float32)
+    biases[4:] = confidence_bias
+
+    # sigmoid outputs are scaled to input pixels for the box columns
+
+    nodes = [
+        onnx_node(
+            "Conv",
+            ["images", "kernels", "biases"],
+            ["conv"],
+            kernel_shape=[stride, stride],
+            strides=[stride, stride],
+        ),
+        onnx_node("Sigmoid", ["conv"], ["sigmoid"]),
+        onnx_node("Reshape", ["sigmoid", "shape"], ["rows"]),
+        onnx_node("Mul", ["rows", "scale"], ["output" if layout == "v8" else "scaled"]),
+    ]
+
+    if layout == "v5":
+        nodes.append(onnx_node("Transpose", ["scaled"], ["output"], perm=[0, 2, 1]))
+
+    scale = np.ones((1, channels, 1), dtype=np.float32)
+    scale[0, :4] = input_size
+
+    initializers = [
+        onnx_tensor("kernels", kernels.astype(np.float32)),
+        onnx_tensor("biases", biases),
+        onnx_tensor("shape", np.array([0, channels, -1], dtype=np.int64)),
+        onnx_tensor("scale", scale),
+    ]
+
+    graph = message(
+        *((1, node) for node in nodes),
+        (2, "synthetic"),
+        *((5, tensor) for tensor in initializers),
+        (11, onnx_value("images", ["batch", 3, input_size, input_size])),
+        (12, onnx_value("output", [])),
+    )
+
+    model = message(
+        (1, 7),
+        (2, "whatfishdo-bench"),
+        (7, graph),
+        (8, message((1, ""), (2, 13))),
+    )
+
+    path = os.path.join(folder, "model.onnx")
+
+    with open(path, "wb") as f:
+        f.write(model)
+
+    return path
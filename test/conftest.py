@@ -0,0 +1,83 @@
+# fixtures shared by the tests that play synthetic videos through VideoStream
+
+from assets.stream import VideoStream
+from bench.synthetic import make_model
+import time
+import pytest
+
+
+@pytest.fixture
+def model(tmp_path, monkeypatch):
+    # random-weight model in model/ of the working directory, where
+    # load_model looks for it
+
+    (tmp_path / "model").mkdir()
+    make_model(str(tmp_path / "model"), confidence_bias=0.7)
+
+    monkeypatch.chdir(tmp_path)
+
+    return tmp_path
+
+
+@pytest.fixture
+def open_stream():
+    # a started stream of a video, without detection or tracking unless given
+
+    def open_stream(path, start=True, **kwargs):
+        stream = VideoStream(
+            **{
+                "data": {},
+                "plot_id": None,
+                "sample_id": None,
+                "path": path,
+                "detection": False,
+                "tracking": False,
+                "useGPU": False,
+                **kwargs,
+            }
+        )
+
+        return stream.start() if start else stream
+
+    return open_stream
+
+
+@pytest.fixture
+def wait_for_frame():
+    # next frame of a stream, None if none came in time
+
+    def wait_for_frame(stream, timeout=5):
+        start = time.perf_counter()
+
+        while time.perf_counter() - start < timeout:
+            frame = stream.get_frame()
+
+            if frame is not None:
+                return frame
+
+            time.sleep(0.001)
+
+        return None
+
+    return wait_for_frame
+
+
+@pytest.fixture
+def play():
+    # show a stream to the end and stop it, the indices of the frames shown
+
+    def play(stream, timeout=30):
+        shown = []
+        start = time.perf_counter()
+
+        while not stream.ended and time.perf_counter() - start < timeout:
+            if stream.get_frame() is not None:
+                shown.append(stream.frame_index)
+            else:
+                time.sleep(0.001)
+
+        stream.stop()
+
+        return shown
+
+    return play
@@ -0,0 +1,43 @@
+from assets.decoder import decoder_threads, decoder_options, fourcc_to_str, open_capture
+from bench.synthetic import make_video
+import cv2
+import os
+
+
+def test_decoder_threads():
+    # a quarter of 1080p per thread, capped by the cores
+
+    assert decoder_threads(640, 480, cores=32) == 1
+    assert decoder_threads(1920, 1080, cores=32) == 4
+    assert decoder_threads(3840, 2160, cores=32) == 16
+    assert decoder_threads(3840, 2160, cores=6) == 6
+    assert decoder_threads(7680, 4320, cores=64) == 16
+
+
+def test_fourcc_to_str():
+    assert fourcc_to_str(cv2.VideoWriter_fourcc(*"hvc1")) == "hvc1"
+
+
+def test_decoder_options(tmp_path):
+    path = make_video(str(tmp_path / "fish.mp4"), width=320, height=240, seconds=1)
+
+    info, options = decoder_options(path)
+
+    assert info["width"] == 320
+    assert info["codec"] != ""
+    assert options == {"threads": 1}
+
+    # project overrides win
+
+    info, options = decoder_options(path, {"threads": 3, "video_codec": "mpeg4"})
+
+    assert options == {"threads": 3, "video_codec": "mpeg4"}
+
+    capture = open_capture(path, options)
+
+    assert capture.get(cv2.CAP_PROP_N_THREADS) == 3
+    assert capture.read()[0] is True
+
+    # the environment is left as it was
+
+    assert "OPENCV_FFMPEG_CAPTURE_OPTIONS" not in os.environ
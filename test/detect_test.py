@@ -0,0 +1,521 @@
+from assets.detect import (
+    Detector,
+    class_filter,
+    class_name,
+    detect_batch,
+    detect_fish,
+    load_model,
+    make_tracker,
+    model_settings,
+    non_max_suppression,
+    process_outputs,
+    shared_detector,
+    tile_grid,
+    track_fish,
+)
+from assets.index import SeekIndex
+from assets.store import TrackStore
+from assets.workers import LOADED, DetectorPool
+from bench.synthetic import make_model, make_onnx_model, make_video
+from types import SimpleNamespace
+import cv2
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("model")
+
+    cfg, weights = make_model(str(folder), confidence_bias=0.7)
+
+    video = SimpleNamespace(useGPU=False)
+
+    load_model(video, model_settings({"cfg": cfg, "weights": weights}))
+
+    return video
+
+
+def test_batch_matches_single_frames(video):
+    rng = np.random.default_rng(0)
+
+    frames = [rng.integers(0, 255, (240, 320, 3), np.uint8) for _ in range(4)]
+
+    results = detect_batch(video, frames, rgb=True)
+
+    assert len(results) == 4
+
+    for frame, (boxes, confidences, _) in zip(frames, results):
+        single_boxes, single_confidences = detect_fish(video, frame, rgb=True)
+
+        assert len(boxes) > 0
+        assert np.allclose(boxes, single_boxes, atol=1)
+        assert np.allclose(confidences, single_confidences, atol=1e-4)
+
+
+def test_worker_pool_keeps_frame_order(model, open_stream, play):
+    path = make_video(str(model / "fish.mp4"), width=320, height=240, seconds=2)
+
+    stream = open_stream(path, detection=True, buffer_mb=8, batch_size=2, workers=2)
+
+    shown = play(stream)
+
+    assert stream.ended is True
+    assert shown == list(range(stream.frame_count))
+    assert stream.stats.summary()["stages"]["detect"]["count"] == len(shown)
+
+
+def test_worker_pool_without_model(tmp_path, monkeypatch, open_stream, play):
+    path = make_video(str(tmp_path / "fish.mp4"), width=320, height=240, seconds=1)
+
+    # no model/ here, the workers fail to load it after the stream started
+
+    monkeypatch.chdir(tmp_path)
+
+    stream = open_stream(
+        path, detection=True, buffer_mb=8, workers=1, detection_cache=False
+    )
+
+    assert len(play(stream)) == stream.frame_count
+    assert "Detector worker failed" in stream.error
+
+
+def test_worker_pool_loads_staggered():
+    # with the second worker still loading, the first one already sends back
+    # a batch and a skipped stale one, neither is taken for a load
+
+    ring = SimpleNamespace(name=None, size=2, shape=(240, 320, 3))
+
+    pool = DetectorPool(ring, 2)
+
+    batch = [(np.zeros((1, 4)), np.ones(1), np.zeros(1, int))]
+
+    pool.results.put((LOADED, None, 0))
+    pool.results.put((0, batch, 0.1))
+    pool.results.put((1, None, 0))
+
+    assert pool.wait(timeout=0.5) is False
+
+    pool.results.put((LOADED, None, 0))
+
+    assert pool.wait(timeout=5) is True
+
+    key, detections, seconds = pool.result(timeout=1)
+
+    assert key == 0 and seconds == 0.1
+    assert np.array_equal(detections[0][1], batch[0][1])
+    assert pool.result(timeout=1) == (1, None, 0)
+    assert pool.result(timeout=0.1) is None
+
+    # a worker that fails to load after another sent back a batch still
+    # fails the pool
+
+    pool = DetectorPool(ring, 2)
+
+    pool.results.put((LOADED, None, 0))
+    pool.results.put((0, batch, 0.1))
+    pool.results.put((LOADED, "OSError()", 0))
+
+    with pytest.raises(RuntimeError, match="OSError"):
+        pool.wait(timeout=5)
+
+
+def test_cached_detections_are_replayed(model, open_stream, play):
+    path = make_video(str(model / "fish.mp4"), width=320, height=240, seconds=1)
+
+    # detections are cached by frame number, so index the video first
+
+    SeekIndex.load(path)
+
+    first = open_stream(path, detection=True, buffer_mb=8)
+    play(first)
+
+    assert first.detections.misses == first.frame_count
+
+    second = open_stream(path, detection=True, buffer_mb=8)
+    play(second)
+
+    assert second.detections.hits == second.frame_count
+    assert second.detections.misses == 0
+    assert "detect" not in second.stats.summary()["stages"]
+
+
+def test_every_output_layer_is_used():
+    # one strong box per layer, both survive
+
+    first = np.zeros((4, 6), dtype=np.float32)
+    first[0] = [0.25, 0.25, 0.1, 0.1, 0.9, 0.9]
+
+    second = np.zeros((8, 6), dtype=np.float32)
+    second[3] = [0.75, 0.75, 0.2, 0.2, 0.8, 0.8]
+
+    boxes, confidences, class_ids = process_outputs([first, second], 400, 200)
+
+    assert boxes.tolist() == [[80, 40, 40, 20], [260, 130, 80, 40]]
+    assert np.allclose(confidences, [0.9, 0.8])
+    assert class_ids.tolist() == [0, 0]
+
+
+def test_detect_classes():
+    # a fish and a shark, only the fish is kept
+
+    out = np.zeros((4, 7), dtype=np.float32)
+    out[0] = [0.25, 0.25, 0.1, 0.1, 0.9, 0.9, 0.0]
+    out[1] = [0.75, 0.75, 0.2, 0.2, 0.8, 0.0, 0.8]
+
+    settings = model_settings(
+        {"classes": ["Fish", "Shark"], "detect_classes": ["Fish"]}
+    )
+
+    boxes, confidences, class_ids = process_outputs(
+        [out], 400, 200, classes=class_filter(settings)
+    )
+
+    assert boxes.tolist() == [[80, 40, 40, 20]]
+    assert class_ids.tolist() == [0]
+    assert class_name(settings, 1) == "Shark"
+    assert class_name(settings, 2) == "Class 2"
+
+    with pytest.raises(ValueError):
+        class_filter(model_settings({"detect_classes": ["Shark"]}))
+
+
+def test_non_max_suppression_matches_opencv():
+    rng = np.random.default_rng(0)
+
+    for _ in range(50):
+        count = rng.integers(0, 300)
+
+        boxes = np.column_stack(
+            [
+                rng.integers(0, 200, (count, 2)),
+                rng.integers(0, 60, (count, 2)),
+            ]
+        ).astype(np.float64)
+
+        confidences = rng.choice([0.6, 0.7, 0.8, 0.9], count).astype(np.float32)
+
+        expected = cv2.dnn.NMSBoxes(boxes, confidences, 0, 0.4)
+
+        assert non_max_suppression(boxes, confidences, 0.4).tolist() == sorted(
+            np.asarray(expected, dtype=int).reshape(-1).tolist()
+        )
+
+
+def test_detect_every_n_frames(model, open_stream, play):
+    path = make_video(str(model / "fish.mp4"), width=320, height=240, seconds=2)
+
+    stream = open_stream(
+        path,
+        detection=True,
+        buffer_mb=8,
+        detection_cache=False,
+        detect_every=5,
+        motion_threshold=1,
+    )
+
+    shown = len(play(stream))
+
+    summary = stream.stats.summary()
+
+    assert shown == stream.frame_count
+    assert summary["stages"]["detect"]["count"] == stream.frame_count // 5
+    assert summary["counts"]["detect_carried"] == shown - shown // 5
+
+
+def test_motion_gate_skips_static_frames(model, open_stream, play):
+    # no fish, only the frame number changes
+
+    path = make_video(
+        str(model / "empty.mp4"), width=320, height=240, seconds=1, fish=0
+    )
+
+    stream = open_stream(
+        path, detection=True, buffer_mb=8, detection_cache=False, motion_gate=0.05
+    )
+
+    shown = len(play(stream))
+
+    summary = stream.stats.summary()
+
+    assert shown == stream.frame_count
+    assert summary["stages"]["detect"]["count"] == 1
+    assert summary["counts"]["detect_static"] == shown - 1
+    assert "motion_gate" in summary["info"]
+
+
+def test_tile_grid():
+    # tiles overlap and cover the frame edge to edge
+
+    tiles = tile_grid(1280, 720, {"tile": 640, "overlap": 0.2})
+
+    assert {x for x, _, _, _ in tiles} == {0, 320, 640}
+    assert {y for _, y, _, _ in tiles} == {0, 80}
+    assert all(w == h == 640 for _, _, w, h in tiles)
+
+    # tile size and region of interest are in source pixels
+
+    tiles = tile_grid(640, 360, {"tile": 640, "roi": [100, 100, 400, 300]}, 0.5)
+
+    assert tiles == [(50, 50, 200, 150)]
+
+    with pytest.raises(ValueError):
+        tile_grid(640, 360, {"roi": [1000, 0, 10, 10]})
+
+
+def test_tiled_detection(video):
+    rng = np.random.default_rng(0)
+
+    frame = rng.integers(0, 255, (240, 320, 3), np.uint8)
+
+    # a single tile over the whole frame is the same as no tiles
+
+    whole = detect_batch(video, [frame], rgb=True)[0]
+    tiled = detect_batch(video, [frame], rgb=True, tiles=[(0, 0, 320, 240)])[0]
+
+    for a, b in zip(whole, tiled):
+        assert np.array_equal(a, b)
+
+    # boxes found on a tile are moved back to frame pixels
+
+    crop = np.ascontiguousarray(frame[40:200, 100:300])
+
+    boxes, confidences, _ = detect_batch(video, [crop], rgb=True)[0]
+    shifted, _, _ = detect_batch(video, [frame], rgb=True, tiles=[(100, 40, 200, 160)])[
+        0
+    ]
+
+    assert len(boxes) > 0
+    assert np.array_equal(shifted, boxes + [100, 40, 0, 0])
+
+
+def test_stream_with_bad_tiling(tmp_path, open_stream):
+    path = make_video(str(tmp_path / "fish.mp4"), width=320, height=240, seconds=1)
+
+    # a region of interest outside the frame detects on whole frames
+
+    stream = open_stream(
+        path,
+        start=False,
+        detection=True,
+        buffer_mb=8,
+        tiling={"roi": [1000, 1000, 10, 10]},
+    )
+
+    assert stream.tiles is None
+    assert "Tiling off" in stream.error
+    assert stream.detection_settings == {
+        **model_settings(None),
+        "detect_width": 320,
+    }
+
+    stream.stop()
+
+
+def test_shared_detector(tmp_path, monkeypatch, open_stream):
+    monkeypatch.chdir(tmp_path)
+
+    # missing model files fail when waited on, not when loading starts
+
+    with pytest.raises(RuntimeError):
+        shared_detector().wait(timeout=30)
+
+    (tmp_path / "model").mkdir()
+    make_model(str(tmp_path / "model"), confidence_bias=0.7)
+
+    detector = shared_detector().wait(timeout=30)
+
+    path = make_video(str(tmp_path / "fish.mp4"), width=320, height=240, seconds=1)
+
+    # every stream uses the same model
+
+    for _ in range(2):
+        stream = open_stream(path, detection=True, buffer_mb=8, detection_cache=False)
+
+        stream.stop()
+
+        assert stream.detector is detector
+
+
+def test_detection_errors_do_not_stall(model, monkeypatch, open_stream, play):
+    path = make_video(str(model / "fish.mp4"), width=320, height=240, seconds=1)
+
+    shared_detector().wait(timeout=30)
+
+    # e.g. a batch of 4 through an ONNX model exported for batches of 1
+
+    def fail(self, frames, rgb=False, tiles=None):
+        raise cv2.error("batch size mismatch")
+
+    monkeypatch.setattr(Detector, "detect", fail)
+
+    stream = open_stream(
+        path, detection=True, buffer_mb=8, batch_size=4, detection_cache=False
+    )
+
+    shown = len(play(stream))
+
+    # every frame is still shown and the error is kept for the UI
+
+    assert shown == stream.frame_count
+    assert stream.error.startswith("Detection failed")
+    assert stream.stats.summary()["counts"]["detect_failed"] == shown
+
+
+def test_model_settings():
+    settings = model_settings()
+
+    assert settings["backend"] == "darknet"
+    assert settings["classes"] == ["Fish"]
+
+    # the backend follows the weights file, unset values keep the defaults
+
+    settings = model_settings(
+        {"weights": "model/yolo.onnx", "input_size": 320, "nms_threshold": None}
+    )
+
+    assert settings["backend"] == "onnx"
+    assert "cfg" not in settings
+    assert settings["input_size"] == 320
+    assert settings["nms_threshold"] == 0.4
+
+    with pytest.raises(ValueError):
+        model_settings({"backend": "tflite"})
+
+
+@pytest.mark.parametrize("layout", ["v5", "v8"])
+def test_onnx_backend(tmp_path, layout):
+    weights = make_onnx_model(
+        str(tmp_path), input_size=320, confidence_bias=2, layout=layout
+    )
+
+    video = SimpleNamespace(useGPU=False)
+
+    load_model(video, model_settings({"weights": weights, "input_size": 320}))
+
+    rng = np.random.default_rng(0)
+
+    frames = [rng.integers(0, 255, (240, 320, 3), np.uint8) for _ in range(2)]
+
+    results = detect_batch(video, frames, rgb=True)
+
+    # raw outputs decoded by hand for the first frame
+
+    blob = cv2.dnn.blobFromImages(frames, 0.00392, (320, 320), (0, 0, 0), False)
+
+    video.net.setInput(blob)
+
+    out = video.net.forward(video.output_layers)[0][0]
+
+    if layout == "v8":
+        out = out.T
+        scores = out[:, 4]
+    else:
+        scores = out[:, 4] * out[:, 5]
+
+    boxes, confidences, class_ids = results[0]
+
+    assert len(results) == 2
+    assert len(boxes) > 0
+    assert np.all(class_ids == 0)
+    assert np.all(np.isin(confidences, scores[scores > 0.5]))
+
+
+def test_auto_input_size(tmp_path):
+    cfg, weights = make_model(str(tmp_path), confidence_bias=0.7)
+
+    def tuned(target_fps):
+        settings = model_settings(
+            {"cfg": cfg, "weights": weights, "target_fps": target_fps}
+        )
+
+        return Detector(settings=settings).start().wait(timeout=60)
+
+    # unreachable frame rates get the smallest size, easy ones the largest
+
+    unreachable = tuned(target_fps=1e6)
+    easy = tuned(target_fps=1e-3)
+
+    assert unreachable.input_size == unreachable.tuner.sizes[0]
+    assert easy.input_size == easy.tuner.sizes[-1]
+
+    rng = np.random.default_rng(0)
+
+    frame = rng.integers(0, 255, (240, 320, 3), np.uint8)
+
+    boxes, _ = detect_fish(unreachable, frame)
+
+    assert len(boxes) > 0
+
+    # detections come back with the size they were made at, which is not the
+    # configured one the cache is keyed on
+
+    _, size = unreachable.detect([frame])
+
+    assert size == unreachable.tuner.sizes[0]
+    assert size != unreachable.settings["input_size"]
+
+
+def test_tracking_stream(model, open_stream, play):
+    path = make_video(str(model / "fish.mp4"), width=320, height=240, seconds=1)
+
+    stream = open_stream(
+        path,
+        tracking=True,
+        buffer_mb=8,
+        detection_cache=False,
+        detect_every=3,
+        motion_threshold=1,
+        track_file=str(model / "tracks" / "fish.tracks"),
+    )
+
+    shown = len(play(stream))
+
+    assert shown == stream.frame_count
+    assert stream.stats.summary()["stages"]["track"]["count"] == shown
+    assert len(stream.tracker) > 0
+
+    # every fish shown was saved, in source pixels
+
+    table = TrackStore(str(model / "tracks" / "fish.tracks")).table()
+
+    assert table["frame"].nunique() > 0
+    assert table["frame"].max() < shown
+    assert table["track"].max() < stream.tracker.next_id
+
+
+def test_tracks_wait_for_seek_index(model, open_stream, play):
+    path = make_video(str(model / "fish.mp4"), width=320, height=240, seconds=1)
+
+    # without the seek index frames may be misnumbered, so none are saved
+
+    stream = open_stream(
+        path,
+        tracking=True,
+        buffer_mb=8,
+        detection_cache=False,
+        seek_index=False,
+        track_file=str(model / "tracks" / "fish.tracks"),
+    )
+
+    play(stream)
+
+    assert len(stream.tracker) > 0
+    assert len(TrackStore(str(model / "tracks" / "fish.tracks")).table()) == 0
+
+
+def test_track_fish_keeps_detector_boxes():
+    # boxes are thresholded and suppressed with the detector's settings
+    # before tracking, e.g. --confidence 0.3, and not filtered again
+
+    video = SimpleNamespace(
+        data={}, settings=model_settings(), tracker=make_tracker("sort")
+    )
+    frame = np.zeros((100, 100, 3), dtype=np.uint8)
+
+    ids, boxes, confidences, _ = track_fish(
+        video, frame, np.array([[10, 10, 20, 20]]), np.array([0.35])
+    )
+
+    assert ids.tolist() == [1]
+    assert np.allclose(confidences, [0.35])
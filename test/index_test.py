@@ -0,0 +1,78 @@
+from assets.index import SeekIndex, sidecar_path, INDEX_SUFFIX
+from bench.synthetic import make_video
+import cv2
+import numpy as np
+import os
+import pytest
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    path = tmp_path_factory.mktemp("videos") / "fish.mp4"
+
+    return make_video(str(path), width=320, height=240, seconds=4, fps=30)
+
+
+def decode_all(path):
+    capture = cv2.VideoCapture(path, cv2.CAP_FFMPEG)
+    frames = []
+
+    while True:
+        ret, frame = capture.read()
+
+        if not ret:
+            break
+
+        frames.append(frame)
+
+    return frames
+
+
+def test_build_index(video):
+    index = SeekIndex.build(video)
+
+    assert index.frame_count == 120
+    assert index.keyframes[0] == 0
+    assert len(index.keyframes) > 1
+
+    # timestamps are monotonic and evenly spaced at 30 fps
+
+    assert np.allclose(np.diff(index.msec), 1000 / 30)
+
+    assert index.frame_at(0) == 0
+    assert index.frame_at(1000) == 30
+    assert index.frame_at(10**9) == 119
+
+
+def test_sidecar_is_reused(video):
+    index_path = sidecar_path(video, INDEX_SUFFIX)
+
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    index = SeekIndex.load(video)
+
+    assert os.path.exists(index_path)
+
+    mtime = os.path.getmtime(index_path)
+
+    reloaded = SeekIndex.load(video)
+
+    assert os.path.getmtime(index_path) == mtime
+    assert np.array_equal(reloaded.msec, index.msec)
+    assert np.array_equal(reloaded.keyframes, index.keyframes)
+
+
+def test_seek_is_frame_accurate(video):
+    frames = decode_all(video)
+    index = SeekIndex.load(video)
+
+    capture = cv2.VideoCapture(video, cv2.CAP_FFMPEG)
+
+    for target in [0, 5, 13, 59, 60, 118, 7]:
+        index.seek(capture, target)
+
+        ret, frame = capture.read()
+
+        assert ret is True
+        assert np.array_equal(frame, frames[target])
@@ -0,0 +1,64 @@
+from assets.metrics import PipelineStats
+import json
+import pandas as pd
+import pytest
+
+
+def test_stage_histograms():
+    stats = PipelineStats()
+
+    for ms in [0.2, 3, 3, 3, 40]:
+        stats.record("decode", ms / 1000)
+
+    summary = stats.summary()["stages"]["decode"]
+
+    assert summary["count"] == 5
+    assert summary["mean_ms"] == pytest.approx(9.84)
+    assert summary["max_ms"] == pytest.approx(40)
+    assert summary["p50_ms"] == 5
+    assert summary["p95_ms"] == pytest.approx(40)
+    assert summary["histogram"]["0.5"] == 1
+    assert summary["histogram"]["5"] == 3
+
+
+def test_dump(tmp_path):
+    stats = PipelineStats()
+
+    with stats.time("detect"):
+        pass
+
+    stats.sample(display=3, free_slots=10)
+    stats.drop("stale", 2)
+    stats.set("decode_fps", 120)
+    stats.frame_shown()
+
+    stats.dump(str(tmp_path / "stats.json"))
+
+    with open(tmp_path / "stats.json") as f:
+        summary = json.load(f)
+
+    assert summary["dropped"] == {"stale": 2}
+    assert summary["queue_depths"][0]["display"] == 3
+    assert summary["info"]["decode_fps"] == 120
+    assert summary["frames_shown"] == 1
+
+    stats.dump(str(tmp_path / "stats.csv"))
+
+    stages = pd.read_csv(tmp_path / "stats.csv", index_col="stage")
+    queues = pd.read_csv(tmp_path / "stats_queues.csv")
+
+    assert stages.loc["detect", "count"] == 1
+    assert queues.loc[0, "free_slots"] == 10
+
+
+def test_dump_without_stages(tmp_path):
+    # e.g. --stats given but the app closed before a video was opened
+
+    PipelineStats().dump(str(tmp_path / "stats.csv"))
+
+    stages = pd.read_csv(tmp_path / "stats.csv", index_col="stage")
+    queues = pd.read_csv(tmp_path / "stats_queues.csv")
+
+    assert len(stages) == 0
+    assert "p95_ms" in stages.columns
+    assert len(queues) == 0
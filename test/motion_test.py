@@ -0,0 +1,79 @@
+from assets.motion import DetectionCadence, MotionGate, MotionMeter, shrink
+import numpy as np
+
+
+def frame(value=0):
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+    frame[:] = value
+
+    return shrink(frame)
+
+
+def test_motion_meter():
+    meter = MotionMeter()
+
+    assert meter.update(frame()) == 1.0
+    assert meter.update(frame()) == 0.0
+
+    moved = frame()
+    moved[:60] = 255
+
+    assert meter.update(moved) == 0.5
+
+    meter.reset()
+
+    assert meter.update(moved) == 1.0
+
+
+def test_cadence():
+    cadence = DetectionCadence(every=3, motion_threshold=0.1)
+
+    still = frame()
+
+    assert [cadence.due(still) for _ in range(7)] == [
+        "interval",
+        None,
+        None,
+        "interval",
+        None,
+        None,
+        "interval",
+    ]
+
+    # motion and lost trackers bring detection forward
+
+    assert cadence.due(frame(255)) == "motion"
+    assert cadence.due(frame(255), lost=0.5) == "tracker"
+    assert cadence.due(frame(255)) is None
+
+    cadence.reset()
+
+    assert cadence.due(frame(255)) == "interval"
+
+
+def test_motion_gate():
+    gate = MotionGate(threshold=0.01)
+
+    # nothing to compare with before the detector has run
+
+    assert gate.is_static(frame()) is False
+
+    gate.detected(frame())
+
+    assert gate.is_static(frame()) is True
+
+    # small changes add up against the frame last detected on
+
+    drifted = frame()
+    drifted[:1] = 255
+
+    assert gate.is_static(drifted) is True
+
+    drifted[:3] = 255
+
+    assert gate.is_static(drifted) is False
+    assert (gate.static, gate.checked) == (2, 4)
+
+    gate.reset()
+
+    assert gate.is_static(frame()) is False
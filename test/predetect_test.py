@@ -0,0 +1,123 @@
+from assets.detect import model_settings
+from assets.predetect import detect_video, init_worker, predetect, project_jobs
+from assets.store import DetectionCache
+from bench.synthetic import make_video
+import pytest
+
+
+def test_project_jobs(tmp_path):
+    for name in ["a.mp4", "b.mp4", "a.mp4.idx.npz", "a.mp4.0123456789ab.det"]:
+        (tmp_path / name).write_bytes(b"")
+
+    jobs = project_jobs({"type": "Individual", "video_folder": str(tmp_path)})
+
+    assert jobs == {
+        str(tmp_path / "a.mp4"): [(0, None)],
+        str(tmp_path / "b.mp4"): [(0, None)],
+    }
+
+    samples = {
+        "p1": {
+            "p1_0": {"start_time": 10, "video": "a.mp4", "status": "pending"},
+            "p1_1": {"start_time": 50, "video": "a.mp4", "status": "complete"},
+        },
+        "p2": {"p2_0": {"start_time": 5, "video": None, "status": "pending"}},
+    }
+
+    jobs = project_jobs({"type": "Plot", "sample_s": 20, "samples": samples})
+
+    assert jobs == {"a.mp4": [(10, 30), (50, 70)]}
+
+
+def test_stream_loads_predetected(model, open_stream, play):
+    (model / "videos").mkdir()
+    path = make_video(str(model / "videos" / "fish.mp4"), 640, 480, seconds=1)
+
+    project = {"type": "Individual", "video_folder": str(model / "videos")}
+
+    assert predetect(project, workers=1, display_width=320) is True
+
+    # played back at half size the saved boxes are scaled to match
+
+    stream = open_stream(path, detection=True, buffer_mb=8, display_width=320)
+
+    play(stream)
+
+    assert stream.detections.hits == stream.frame_count
+    assert stream.detections.misses == 0
+
+    boxes, _, _ = stream.detections.get(0)
+
+    assert len(boxes) > 0
+    assert boxes[:, 0].max() <= 320
+
+    # detections made at another size are not reused
+
+    stream = open_stream(
+        path, start=False, detection=True, buffer_mb=8, display_width=0
+    )
+
+    # the saved detections are only read once the detector thread asks
+
+    assert stream.detections is None
+    assert len(stream.load_detections()) == 0
+
+    stream.stop()
+
+
+def test_model_that_fails_to_load(model, capsys):
+    (model / "videos").mkdir()
+    make_video(str(model / "videos" / "fish.mp4"), 320, 240, seconds=1)
+
+    (model / "model" / "model.cfg").write_text("[net]\nnot a layer\n")
+
+    project = {"type": "Individual", "video_folder": str(model / "videos")}
+
+    assert predetect(project, workers=1) is False
+    assert "Unable to load the detection model" in capsys.readouterr().out
+
+
+def test_interrupted_video_keeps_detections(model):
+    path = make_video(str(model / "fish.mp4"), 640, 480, seconds=1)
+
+    class Progress:
+        # stops the run after two batches are detected
+
+        batches = 0
+
+        def put(self, message):
+            if message[0] == "detected":
+                self.batches += 1
+
+                if self.batches == 2:
+                    raise KeyboardInterrupt
+
+    init_worker(Progress(), False, 2, 1, {}, 320)
+
+    with pytest.raises(KeyboardInterrupt):
+        detect_video((path, [(0, None)], None))
+
+    cache = DetectionCache(path, {**model_settings({}), "detect_width": 320}, scale=0.5)
+
+    assert len(cache) == 4
+
+
+def test_tiling_that_does_not_fit(model, capsys):
+    (model / "videos").mkdir()
+    path = make_video(str(model / "videos" / "fish.mp4"), 320, 240, seconds=1)
+
+    project = {
+        "type": "Individual",
+        "video_folder": str(model / "videos"),
+        "tiling": {"tile": 160, "overlap": 1.5},
+    }
+
+    # the video is detected on whole frames, under the key playback uses for
+    # untiled detection
+
+    assert predetect(project, workers=1) is True
+    assert "Tiling off" in capsys.readouterr().out
+
+    cache = DetectionCache(path, {**model_settings({}), "detect_width": 320})
+
+    assert len(cache) > 0
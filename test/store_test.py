@@ -0,0 +1,182 @@
+from assets.store import (
+    ColumnStore,
+    DetectionCache,
+    TrackStore,
+    export_tracks,
+    track_path,
+    video_files,
+)
+import numpy as np
+import pandas as pd
+
+
+def test_column_store_drops_partial_chunk(tmp_path):
+    path = str(tmp_path / "columns.npy")
+
+    store = ColumnStore(path, ["frame", "value"], {"name": "test"})
+
+    store.append(frame=np.arange(3), value=np.ones(3))
+    store.append(frame=np.arange(3, 5), value=np.zeros(2))
+
+    # an interrupted write leaves half a chunk behind
+
+    with open(path, "ab") as f:
+        np.save(f, np.arange(10))
+
+    header, chunks = store.read()
+
+    assert header["name"] == "test"
+    assert np.concatenate(chunks["frame"]).tolist() == [0, 1, 2, 3, 4]
+
+    # appending carries on after the last complete chunk
+
+    store.append(frame=np.array([5]), value=np.array([2.0]))
+
+    _, chunks = store.read()
+
+    assert np.concatenate(chunks["frame"]).tolist() == [0, 1, 2, 3, 4, 5]
+
+
+def test_video_files(tmp_path):
+    # seek index and detection files next to the videos are not videos
+
+    for name in ["a.mp4", "b.MOV", "a.mp4.idx.npz", "a.mp4.0123456789ab.det"]:
+        (tmp_path / name).write_bytes(b"")
+
+    assert sorted(video_files(str(tmp_path))) == ["a.mp4", "b.MOV"]
+
+
+def test_detection_cache(tmp_path):
+    video = tmp_path / "fish.mp4"
+    video.write_bytes(b"not really a video")
+
+    settings = {"input_size": 416, "confidence_threshold": 0.5}
+
+    cache = DetectionCache(str(video), settings)
+
+    cache.add(0, np.array([[1, 2, 3, 4], [5, 6, 7, 8]]), [0.9, 0.8], [0, 0])
+    cache.add(1, np.zeros((0, 4)), [], [])
+    cache.flush()
+
+    cache = DetectionCache(str(video), settings)
+
+    assert len(cache) == 2
+
+    boxes, confidences, class_ids = cache.get(0)
+
+    assert boxes.tolist() == [[1, 2, 3, 4], [5, 6, 7, 8]]
+    assert np.allclose(confidences, [0.9, 0.8])
+    assert len(cache.get(1)[0]) == 0
+    assert cache.get(2) is None
+
+    # other settings don't reuse these detections
+
+    assert len(DetectionCache(str(video), {**settings, "input_size": 608})) == 0
+
+    # the tuner's target is not part of the key, only the configured size is
+
+    assert len(DetectionCache(str(video), {**settings, "target_fps": 10})) == 2
+
+
+def test_track_store(tmp_path):
+    path = str(tmp_path / "tracks" / "s1.tracks")
+
+    store = TrackStore(path, {"sample_id": "s1"}, scale=0.5)
+
+    store.add(0, [1, 2], [[10, 20, 4, 4], [30, 40, 4, 4]], [0.9, np.nan], [0, 1])
+    store.add(1, [2], [[32, 40, 4, 4]], [0.8], [1])
+    store.add(2, [], np.zeros((0, 4)), [], [])
+    store.flush()
+
+    # frames tracked again after a seek are not saved twice, new tracks
+    # follow on from the saved ids
+
+    store = TrackStore(path)
+
+    assert store.next_id == 3
+
+    store.add(1, [3], [[0, 0, 4, 4]], [0.5], [0])
+    store.add(3, [3], [[0, 0, 4, 4]], [0.5], [0])
+    store.flush()
+
+    table = store.table()
+
+    assert table["frame"].tolist() == [0, 0, 1, 3]
+    assert table["track"].tolist() == [1, 2, 2, 3]
+    assert table.loc[0, ["x", "y", "w", "h"]].tolist() == [20, 40, 8, 8]
+    assert np.isnan(table.loc[1, "confidence"])
+    assert table["class_id"].tolist() == [0, 1, 1, 0]
+
+
+def test_export_tracks(tmp_path):
+    video = {"video": "fish.mp4"}
+
+    project = {
+        "type": "Plot",
+        "data_folder": str(tmp_path),
+        "samples": {"p1": {"s1": video, "s2": video}, "p2": {"s3": video}},
+    }
+
+    for sample_id in ["s1", "s3"]:
+        store = TrackStore(track_path(project, sample_id, "fish.mp4"))
+        store.add(0, [1], [[1, 2, 3, 4]], [0.9], [0])
+        store.flush()
+
+    out = str(tmp_path / "tracks.csv")
+
+    assert export_tracks(project, out)
+
+    table = pd.read_csv(out)
+
+    assert table["sample_id"].tolist() == ["s1", "s3"]
+    assert table["plot_id"].tolist() == ["p1", "p2"]
+    assert table.columns.tolist()[2:] == [
+        "frame",
+        "track",
+        "x",
+        "y",
+        "w",
+        "h",
+        "confidence",
+        "class_id",
+    ]
+
+
+def test_track_store_other_video(tmp_path):
+    path = str(tmp_path / "a.tracks")
+
+    store = TrackStore(path, {"video": "a.mp4"})
+    store.add(0, [1], [[1, 2, 3, 4]], [0.9], [0])
+    store.flush()
+
+    assert TrackStore(path, {"video": "a.mp4"}).next_id == 2
+
+    # another video's tracks are not mixed in
+
+    store = TrackStore(path, {"video": "b.mp4"})
+
+    assert store.next_id == 1
+    assert len(store.table()) == 0
+
+
+def test_export_individual_tracks(tmp_path):
+    # individual projects have no samples, their tracks are kept per video
+
+    project = {"type": "Individual", "data_folder": str(tmp_path)}
+
+    out = str(tmp_path / "tracks.csv")
+
+    assert not export_tracks(project, out)
+
+    for video in ["/videos/a.mp4", "/videos/b.mp4"]:
+        path = track_path(project, "fish 1", video)
+
+        store = TrackStore(path, {"video": video})
+        store.add(0, [1], [[1, 2, 3, 4]], [0.9], [0])
+        store.flush()
+
+    assert export_tracks(project, out)
+
+    table = pd.read_csv(out)
+
+    assert table["video"].tolist() == ["/videos/a.mp4", "/videos/b.mp4"]
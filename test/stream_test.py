@@ -0,0 +1,258 @@
+from assets.buffer import FrameCache
+from assets.index import INDEX_SUFFIX, SeekIndex
+from bench.synthetic import make_video
+import cv2
+import os
+import numpy as np
+import time
+import pytest
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    path = tmp_path_factory.mktemp("videos") / "fish.mp4"
+
+    make_video(str(path), width=320, height=240, seconds=4, fps=30)
+
+    # indexed ahead so the frame cache is there from the first frame
+
+    SeekIndex.load(str(path))
+
+    return str(path)
+
+
+def test_first_frame(video, open_stream, wait_for_frame):
+    stream = open_stream(video)
+
+    frame = wait_for_frame(stream)
+
+    assert frame is not None
+    assert frame.shape == (240, 320, 3)
+
+    stream.stop()
+
+    assert stream.stopped is True
+
+    for thread in stream.threads:
+        assert thread.is_alive() is False
+
+
+def test_index_is_built_while_playing(tmp_path, open_stream, wait_for_frame):
+    path = make_video(str(tmp_path / "fish.mp4"), width=320, height=240, seconds=1)
+
+    stream = open_stream(path, start=False)
+
+    # nothing is indexed before playback starts
+
+    assert stream.index is None
+    assert stream.cache is None
+
+    stream.start()
+
+    assert wait_for_frame(stream) is not None
+
+    start = time.perf_counter()
+
+    while stream.index is None and time.perf_counter() - start < 5:
+        time.sleep(0.01)
+
+    assert stream.index is not None
+    assert stream.cache is not None
+    assert stream.frame_count == 30
+    assert os.path.exists(path + INDEX_SUFFIX)
+
+    stream.stop()
+
+
+def test_seek_drops_stale_frames(video, open_stream, wait_for_frame):
+    stream = open_stream(video, buffer_mb=2)
+
+    assert wait_for_frame(stream) is not None
+
+    # let the queue fill so there is something stale to drop
+
+    time.sleep(0.2)
+
+    stream.seek(3000)
+
+    start = time.perf_counter()
+
+    assert wait_for_frame(stream) is not None
+
+    # the reader must wake up promptly rather than back off
+
+    assert time.perf_counter() - start < 1
+
+    assert stream.frame_time >= 3000
+
+    stream.stop()
+
+
+def test_end_of_stream(video, open_stream, wait_for_frame):
+    stream = open_stream(video)
+
+    stream.seek(3900)
+
+    start = time.perf_counter()
+
+    while not stream.ended and time.perf_counter() - start < 5:
+        stream.get_frame()
+        time.sleep(0.001)
+
+    assert stream.ended is True
+
+    # seeking back after the end resumes reading
+
+    stream.seek(0)
+
+    assert stream.ended is False
+    assert wait_for_frame(stream) is not None
+
+    stream.stop()
+
+
+def test_ring_budget(video, open_stream, wait_for_frame):
+    # 320x240 frames are 225 KB, so 2 MB buys 9 slots
+
+    stream = open_stream(video, buffer_mb=2)
+
+    assert stream.ring.size == 9
+    assert stream.ring.nbytes <= 2 * 1024 * 1024
+
+    first = wait_for_frame(stream)
+    second = wait_for_frame(stream)
+
+    # frames are decoded into the ring, not freshly allocated
+
+    assert first.base is stream.ring.frames
+    assert second.base is stream.ring.frames
+
+    # only the frame held by the UI and the buffered ones are out of the pool
+
+    time.sleep(0.2)
+
+    assert stream.ring.available() == 0
+    assert stream.Q.qsize() == stream.ring.size - 1
+
+    stream.stop()
+
+    assert stream.ring.available() == stream.ring.size - 1
+
+
+def test_backward_skip_replays_from_cache(video, open_stream, wait_for_frame):
+    stream = open_stream(video)
+
+    shown = {}
+
+    # watch the first second
+
+    while len(shown) < 30:
+        frame = wait_for_frame(stream)
+        shown[stream.frame_index] = (frame.copy(), stream.frame_time)
+
+    # skip back half a second, this must come from the cache
+
+    misses = stream.cache.misses
+
+    stream.skip(-0.5)
+
+    assert stream.replay is not None
+
+    frame = stream.get_frame()
+
+    assert stream.cache.misses == misses
+    assert stream.cache.hits > 0
+
+    assert np.array_equal(frame, shown[stream.frame_index][0])
+    assert stream.frame_time == pytest.approx(shown[stream.frame_index][1])
+
+    # drawing on a replayed frame leaves the cached one as it was
+
+    frame[:] = 0
+
+    assert np.array_equal(
+        stream.cache.get(stream.frame_index), shown[stream.frame_index][0]
+    )
+
+    # replay runs out into freshly decoded frames without gaps
+
+    previous = stream.frame_index
+
+    for _ in range(40):
+        frame = wait_for_frame(stream)
+
+        assert stream.frame_index == previous + 1
+
+        previous = stream.frame_index
+
+    stream.stop()
+
+
+def test_cache_eviction():
+    cache = FrameCache((4, 4, 3), budget_mb=3 * 48 / 1024 / 1024)
+
+    assert cache.size == 3
+
+    for i in range(5):
+        cache.put(i, np.full((4, 4, 3), i, dtype=np.uint8))
+
+    # oldest frames were evicted
+
+    assert 0 not in cache and 1 not in cache
+    assert cache.get(2)[0, 0, 0] == 2
+
+    cache.put(5, np.zeros((4, 4, 3), dtype=np.uint8))
+
+    # 2 was used recently so 3 goes
+
+    assert 2 in cache and 3 not in cache
+    assert cache.run(4) == 6
+
+
+def test_display_scaling(video, open_stream, wait_for_frame):
+    stream = open_stream(video, display_width=160)
+
+    assert stream.scale == 0.5
+
+    frame = wait_for_frame(stream)
+
+    assert frame.shape == (120, 160, 3)
+
+    # full resolution frame on demand matches the scaled one once converted
+
+    full = stream.full_frame()
+
+    assert full.shape == (240, 320, 3)
+
+    expected = cv2.cvtColor(
+        cv2.resize(full, (160, 120), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB
+    )
+
+    assert np.array_equal(frame, expected)
+
+    # display coordinates map back to source pixels
+
+    assert stream.to_source(80, 60) == (160, 120)
+    assert stream.to_source(500, -5) == (319, 0)
+
+    stream.stop()
+
+
+def test_decoder_skips_frames_at_speed(video, open_stream, wait_for_frame):
+    stream = open_stream(video)
+
+    assert wait_for_frame(stream) is not None
+
+    stream.set_speed(4)
+
+    indices = []
+
+    while len(indices) < 10:
+        wait_for_frame(stream)
+        indices.append(stream.frame_index)
+
+    # after the first frame every fourth frame is decoded
+
+    assert np.all(np.diff(indices[1:]) == 4)
+
+    stream.stop()
@@ -0,0 +1,321 @@
+from assets.motion import DetectionCadence
+from assets.tracking import (
+    SortTracker,
+    TrackManager,
+    assign,
+    hungarian,
+    iou_matrix,
+)
+import itertools
+import random
+import time
+import numpy as np
+import pytest
+
+
+def test_iou_matrix():
+    a = np.array([[0, 0, 10, 10], [100, 100, 10, 10]])
+    b = np.array([[0, 0, 10, 10], [5, 0, 10, 10], [0, 0, 0, 0]])
+
+    assert np.allclose(iou_matrix(a, b), [[1, 50 / 150, 0], [0, 0, 0]])
+    assert iou_matrix(a, np.zeros((0, 4))).shape == (2, 0)
+
+
+def test_hungarian_is_optimal():
+    rng = np.random.default_rng(0)
+
+    for _ in range(100):
+        rows, columns = (int(n) for n in rng.integers(1, 6, 2))
+
+        cost = rng.random((rows, columns))
+
+        r, c = hungarian(cost)
+
+        if rows <= columns:
+            best = min(
+                cost[range(rows), list(p)].sum()
+                for p in itertools.permutations(range(columns), rows)
+            )
+        else:
+            best = min(
+                cost[list(p), range(columns)].sum()
+                for p in itertools.permutations(range(rows), columns)
+            )
+
+        assert len(r) == min(rows, columns)
+        assert np.isclose(cost[r, c].sum(), best)
+
+
+def test_assign_one_to_one():
+    # both detections overlap the first track most, only one can have it
+
+    iou = np.array([[0.9, 0.6], [0.8, 0.1], [0.0, 0.2]])
+
+    rows, columns = assign(iou, 0.3)
+
+    assert rows.tolist() == [0, 1]
+    assert columns.tolist() == [1, 0]
+
+
+def test_sort_tracker_keeps_ids():
+    rng = np.random.default_rng(0)
+
+    boxes = np.column_stack(
+        [rng.uniform(0, 1000, (50, 2)), np.full(50, 24), np.full(50, 12)]
+    )
+    velocity = rng.uniform(-3, 3, (50, 2))
+
+    tracker = SortTracker()
+
+    first, *_ = tracker.update(boxes)
+
+    for frame in range(1, 30):
+        boxes[:, :2] += velocity
+
+        # once the tracks have a velocity the detector runs every third
+        # frame, tracks coast in between
+
+        detected = frame < 5 or frame % 3 == 0
+
+        ids, tracked, *_ = tracker.update(boxes if detected else None)
+
+        assert len(ids) == 50
+
+    assert np.array_equal(ids, first)
+    assert np.abs(tracked - boxes).max() < 2
+
+
+def test_sort_tracker_drops_old_tracks():
+    tracker = SortTracker(max_age=3)
+
+    tracker.update(np.array([[0, 0, 10, 10], [100, 100, 10, 10]]))
+
+    # the second fish is gone
+
+    for _ in range(3):
+        ids, *_ = tracker.update(np.array([[0, 0, 10, 10]]))
+
+    assert ids.tolist() == [1]
+    assert len(tracker) == 2
+
+    ids, *_ = tracker.update(np.array([[0, 0, 10, 10]]))
+
+    assert len(tracker) == 1
+
+    # new fish get new ids
+
+    ids, *_ = tracker.update(np.array([[0, 0, 10, 10], [200, 200, 10, 10]]))
+
+    assert ids.tolist() == [1, 3]
+
+
+def test_sort_tracker_lost_fish_trigger_detection():
+    tracker = SortTracker()
+    cadence = DetectionCadence(every=10, motion_threshold=1)
+
+    grey = np.zeros((36, 64), np.uint8)
+
+    tracker.update(np.array([[0, 0, 10, 10], [100, 100, 10, 10]]))
+
+    assert tracker.lost == 0
+    assert cadence.due(grey, tracker.lost) == "interval"
+    assert cadence.due(grey, tracker.lost) is None
+
+    # one of the two fish goes missing, the next frame is detected on
+
+    tracker.update(np.array([[0, 0, 10, 10]]))
+
+    assert tracker.lost == 0.5
+    assert cadence.due(grey, tracker.lost) == "tracker"
+
+    # it counts once, not for as long as the track is kept
+
+    tracker.update(np.array([[0, 0, 10, 10]]))
+
+    assert tracker.lost == 0
+    assert cadence.due(grey, tracker.lost) is None
+
+
+def test_sort_tracker_caps_tracks():
+    tracker = SortTracker(max_tracks=3)
+
+    tracker.update(np.array([[0, 0, 10, 10], [100, 100, 10, 10]]))
+
+    # the first fish is gone and three new ones arrive, the track seen
+    # longest ago goes first
+
+    ids, *_ = tracker.update(
+        np.array([[100, 100, 10, 10], [200, 200, 10, 10], [300, 300, 10, 10]])
+    )
+
+    assert len(tracker) == 3
+    assert tracker.ids.tolist() == [2, 3, 4]
+
+
+class FakeTracker:
+    # stands in for an OpenCV tracker, fails while its box is in fail
+
+    fail = set()
+
+    def init(self, frame, box):
+        self.box = box
+
+    def update(self, frame):
+        return self.box not in self.fail, self.box
+
+
+def test_track_manager():
+    FakeTracker.fail = set()
+
+    tracks = TrackManager(FakeTracker, max_misses=2, max_tracks=3)
+
+    ids, *_ = tracks.update(None, np.array([[0, 0, 10, 10], [100, 100, 10, 10]]))
+
+    assert ids.tolist() == [1, 2]
+
+    # tracked fish keep their ids, new ones get the next
+
+    ids, *_ = tracks.update(None, np.array([[1, 0, 10, 10], [200, 200, 10, 10]]))
+
+    assert ids.tolist() == [1, 2, 3]
+    assert tracks.hits.tolist() == [2, 1, 1]
+
+    # a failing tracker is hidden, then dropped
+
+    FakeTracker.fail = {(100, 100, 10, 10)}
+
+    for _ in range(2):
+        ids, *_ = tracks.update(None)
+
+        assert ids.tolist() == [1, 3]
+        assert len(tracks) == 3
+
+    assert tracks.lost == 1 / 3
+
+    tracks.update(None)
+
+    assert len(tracks) == 2
+
+    # past the cap the fish the detector confirmed longest ago go
+
+    tracks.update(None, np.array([[0, 0, 10, 10], [300, 300, 10, 10]]))
+    tracks.update(None, np.array([[0, 0, 10, 10], [400, 400, 10, 10]]))
+
+    assert tracks.ids.tolist() == [1, 4, 5]
+
+
+def test_track_manager_matches_one_to_one():
+    FakeTracker.fail = set()
+
+    tracks = TrackManager(FakeTracker)
+
+    tracks.update(None, np.array([[0, 0, 10, 10]]))
+
+    # both detections overlap the one fish, the closer one continues it and
+    # the other starts a new track
+
+    ids, *_ = tracks.update(None, np.array([[0, 2, 10, 10], [0, 1, 10, 10]]))
+
+    assert ids.tolist() == [1, 2]
+    assert tracks.hits.tolist() == [2, 1]
+    assert tracks.tracked[1].tolist() == [0, 2, 10, 10]
+
+
+def test_track_manager_restarts_failed_trackers():
+    FakeTracker.fail = set()
+
+    tracks = TrackManager(FakeTracker)
+
+    tracks.update(None, np.array([[0, 0, 10, 10], [100, 100, 10, 10]]))
+
+    # the second tracker loses its fish for a frame
+
+    FakeTracker.fail = {(100, 100, 10, 10)}
+
+    ids, *_ = tracks.update(None)
+
+    assert ids.tolist() == [1]
+
+    # the detector finds it again next to where it was last seen, the track
+    # carries on under its id from a new tracker rather than a second track
+    # starting beside it
+
+    ids, tracked, *_ = tracks.update(
+        None, np.array([[0, 0, 10, 10], [102, 100, 10, 10]])
+    )
+
+    assert ids.tolist() == [1, 2]
+    assert tracked[1].tolist() == [102, 100, 10, 10]
+    assert len(tracks) == 2
+    assert tracks.misses.tolist() == [0, 0]
+
+    ids, tracked, *_ = tracks.update(None)
+
+    assert ids.tolist() == [1, 2]
+    assert tracked[1].tolist() == [102, 100, 10, 10]
+
+
+class DriftingTracker(FakeTracker):
+    # slides off its fish every update, as appearance trackers do, a step
+    # wider than the fish jumps off it
+
+    step = 3
+
+    def update(self, frame):
+        x, y, w, h = self.box
+        self.box = (x + self.step, y, w, h)
+
+        return True, self.box
+
+
+@pytest.mark.parametrize("step", [3, 12])
+def test_track_manager_reseeds_drifting_trackers(step):
+    DriftingTracker.step = step
+
+    tracks = TrackManager(DriftingTracker)
+
+    fish = np.array([[0, 0, 10, 10], [100, 100, 10, 10]])
+
+    # the trackers are put back on their fish by every detection, so each
+    # fish keeps one id
+
+    for _ in range(6):
+        ids, tracked, *_ = tracks.update(None, fish)
+
+        assert ids.tolist() == [1, 2]
+        assert tracked.tolist() == fish.tolist()
+
+    assert len(tracks) == 2
+
+
+class SlowTracker(FakeTracker):
+    # finishes in a random order when updated over threads
+
+    def update(self, frame):
+        time.sleep(random.uniform(0, 0.002))
+
+        x, y, w, h = self.box
+        self.box = (x + 1, y, w, h)
+
+        return True, self.box
+
+
+def test_track_manager_threads():
+    boxes = np.column_stack(
+        [np.arange(20) * 20, np.zeros(20), np.full(20, 10), np.full(20, 10)]
+    )
+
+    results = []
+
+    for threads in [1, 4]:
+        tracks = TrackManager(SlowTracker, threads=threads)
+
+        tracks.update(None, boxes)
+
+        for _ in range(3):
+            ids, tracked, *_ = tracks.update(None)
+
+        results.append((ids.tolist(), tracked.tolist()))
+
+    assert results[0] == results[1]
+    assert results[0][1][5] == [103, 0, 10, 10]
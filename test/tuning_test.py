@@ -0,0 +1,37 @@
+from assets import tuning
+from assets.tuning import InputSizeTuner
+from types import SimpleNamespace
+
+
+def test_calibrate(monkeypatch):
+    # a pass takes 1 ms per 10000 input pixels on a fake clock
+
+    clock = SimpleNamespace(now=0.0)
+
+    monkeypatch.setattr(tuning, "time", SimpleNamespace(perf_counter=lambda: clock.now))
+
+    def run(size):
+        clock.now += size * size / 1e7
+
+    # 416 takes 17 ms, 512 takes 26 ms
+
+    assert InputSizeTuner(50).calibrate(run) == 416
+    assert InputSizeTuner(1000).calibrate(run) == 192
+
+
+def test_update():
+    tuner = InputSizeTuner(20, window=5)
+    tuner.size = 416
+
+    # within tolerance of the 50 ms budget nothing changes
+
+    assert [tuner.update(0.05) for _ in range(5)] == [None] * 5
+
+    # too slow steps down once most of the window is
+
+    assert [tuner.update(0.08) for _ in range(3)] == [None, None, 320]
+
+    # fast enough for the next size up
+
+    assert [tuner.update(0.01) for _ in range(5)] == [None] * 4 + [416]
+    assert tuner.changes == 2